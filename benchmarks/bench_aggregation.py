@@ -0,0 +1,130 @@
+#!/usr/bin/python2
+"""Microbenchmarks aggregating and serializing metrics for large renters.
+
+Unlike run_benchmarks, this calls Builder against an in-memory fake of the
+Sia API, so the timings cover only the collector's own work of summing
+contracts and files and writing rows, without HTTP or JSON decoding.
+
+Python 2 has no tracemalloc to count allocations directly, and in this
+code allocation is most of the cost, so time per operation stands in for
+allocations per operation. The garbage collector is disabled while timing so
+that collections don't add noise.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_aggregation --contract_counts 1000,50000
+"""
+
+import argparse
+import datetime
+import gc
+import io
+import json
+import time
+
+from benchmarks import fake_siad
+from sia_metrics_collector import serialize
+from sia_metrics_collector import state
+
+# Number of rows to write when timing serialization.
+_SERIALIZE_ROWS = 100000
+
+
+class _InMemorySiaApi(object):
+    """Answers Sia API calls with pre-decoded responses."""
+
+    def __init__(self, workload):
+        self._responses = {
+            path: json.loads(body)
+            for path, body in fake_siad.render_responses(workload).iteritems()
+        }
+
+    def get_renter_contracts(self):
+        return self._responses['/renter/contracts']
+
+    def get_renter_files(self):
+        return self._responses['/renter/files']
+
+    def get_wallet(self):
+        return self._responses['/wallet']
+
+
+def _measure(fn, repetitions):
+    """Returns the number of microseconds that fn takes per call."""
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.time()
+        for _ in xrange(repetitions):
+            fn()
+        return (time.time() - start) * 1e6 / repetitions
+    finally:
+        gc.enable()
+
+
+def bench_build(contract_count, file_count, repetitions):
+    builder = state.Builder(
+        _InMemorySiaApi(
+            fake_siad.Workload(
+                file_count=file_count, contract_count=contract_count)),
+        datetime.datetime.utcnow)
+    return _measure(builder.build, repetitions)
+
+
+def bench_write_state():
+    s = state.SiaState(
+        timestamp=datetime.datetime(2018, 2, 11, 16, 5, 2),
+        contract_count=50,
+        file_count=20,
+        uploads_in_progress_count=2,
+        total_contract_size=9 * 10**12,
+        total_file_bytes=4444.5,
+        uploaded_bytes=900 * 10**9,
+        total_contract_spending=65 * 10**27,
+        contract_fee_spending=25 * 10**26,
+        storage_spending=2 * 10**27,
+        upload_spending=35 * 10**24,
+        download_spending=0,
+        remaining_renter_funds=100 * 10**27,
+        wallet_siacoin_balance=75 * 10**27,
+        wallet_outgoing_siacoins=0,
+        wallet_incoming_siacoins=0,
+        api_latency=5.0,
+        contracts_api_latency=3.0,
+        files_api_latency=1.0,
+        wallet_api_latency=1.0,
+        contracts_age=0.0,
+        files_age=0.0,
+        wallet_age=0.0)
+    serializer = serialize.CsvSerializer(
+        io.BytesIO(), serialize.FlushPolicy(max_rows=1000))
+    return _measure(lambda: serializer.write_state(s), _SERIALIZE_ROWS)
+
+
+def main(args):
+    for contract_count in [int(c) for c in args.contract_counts.split(',')]:
+        print 'build, %6d contracts, %6d files: %10.1f us/poll' % (
+            contract_count, args.file_count,
+            bench_build(contract_count, args.file_count, args.repetitions))
+    print 'write_state: %10.2f us/row' % bench_write_state()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Sia Metrics Collector Aggregation Microbenchmark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--contract_counts',
+        default='1000,50000',
+        help='Comma-separated numbers of contracts to benchmark')
+    parser.add_argument(
+        '--file_count',
+        type=int,
+        default=1000,
+        help='Number of files to aggregate in each poll')
+    parser.add_argument(
+        '--repetitions',
+        type=int,
+        default=20,
+        help='Number of polls to time for each contract count')
+    main(parser.parse_args())
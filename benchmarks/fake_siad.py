@@ -0,0 +1,174 @@
+#!/usr/bin/python2
+"""A fake siad that serves synthetic renter and wallet data over HTTP.
+
+The fake serves the three APIs that Sia Metrics Collector queries, with as
+many files and contracts as a benchmark asks for, so that benchmarks can
+measure the collector against large renters without running Sia.
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import logging
+import random
+import SocketServer
+import threading
+import time
+
+import recordtype
+
+logger = logging.getLogger(__name__)
+
+# Number of bytes of a response to write at a time.
+_WRITE_CHUNK_SIZE = 64 * 1024
+"""Describes the data that a fake siad serves.
+
+Fields:
+    file_count: Number of files in the /renter/files response.
+    contract_count: Number of contracts in the /renter/contracts response.
+    latency: Number of seconds to wait before answering each API call.
+    seed: Seed for the random values of each file and contract.
+"""
+Workload = recordtype.recordtype('Workload',
+                                 [('file_count', 10), ('contract_count', 10),
+                                  ('latency', 0.0), ('seed', 0)])
+
+
+def render_responses(workload):
+    """Renders the body of each API response for a workload.
+
+    Args:
+        workload: The Workload to render.
+
+    Returns:
+        A dict of API path to response body.
+    """
+    rng = random.Random(workload.seed)
+    return {
+        '/renter/contracts':
+        _render_contracts(rng, workload.contract_count),
+        '/renter/files':
+        _render_files(rng, workload.file_count),
+        '/wallet':
+        json.dumps({
+            'confirmedsiacoinbalance': str(rng.randint(0, 10**28)),
+            'unconfirmedoutgoingsiacoins': str(rng.randint(0, 10**25)),
+            'unconfirmedincomingsiacoins': str(rng.randint(0, 10**25)),
+        }),
+    }
+
+
+def _render_contracts(rng, contract_count):
+    # Formatting each contract directly is much faster than building dicts
+    # for json.dumps, which matters for the largest workloads.
+    contracts = []
+    for i in xrange(contract_count):
+        contracts.append(
+            ('{"id": "%064x", "size": %d, "totalcost": "%d", "fees": "%d", '
+             '"StorageSpending": "%d", "uploadspending": "%d", '
+             '"downloadspending": "%d", "renterfunds": "%d"}') %
+            (i, rng.randint(0, 2**40), rng.randint(0, 10**27),
+             rng.randint(0, 10**26), rng.randint(0, 10**26),
+             rng.randint(0, 10**25), rng.randint(0, 10**25),
+             rng.randint(0, 10**27)))
+    return ('{"activecontracts": [%s], "inactivecontracts": []}' %
+            ', '.join(contracts))
+
+
+def _render_files(rng, file_count):
+    files = []
+    for i in xrange(file_count):
+        file_size = rng.randint(1, 2**30)
+        upload_progress = rng.choice((100, 100, 100, rng.uniform(0, 100)))
+        files.append(('{"siapath": "files/%09d.dat", "filesize": %d, '
+                      '"uploadedbytes": %d, "uploadprogress": %r}') %
+                     (i, file_size, file_size * 3 * upload_progress / 100,
+                      upload_progress))
+    return '{"files": [%s]}' % ', '.join(files)
+
+
+class FakeSiad(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server that answers Sia API calls with a workload's data."""
+
+    daemon_threads = True
+
+    def __init__(self, workload, port=0):
+        """Creates a FakeSiad instance, listening on localhost.
+
+        Args:
+            workload: The Workload to serve.
+            port: Port on which to listen. Pass 0 to pick any free port.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           _FakeSiadHandler)
+        self.workload = workload
+        self.responses = render_responses(workload)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Starts serving on a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class _FakeSiadHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Allow keep-alive connections, like siad.
+    protocol_version = 'HTTP/1.1'
+    # Buffer the status line and headers rather than sending each in its own
+    # packet, which with keep-alive stalls on delayed ACKs and would add
+    # ~40ms of latency to every call that siad doesn't have.
+    wbufsize = -1
+
+    def do_GET(self):
+        body = self.server.responses.get(self.path.split('?')[0])
+        if self.server.workload.latency:
+            time.sleep(self.server.workload.latency)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in xrange(0, len(body), _WRITE_CHUNK_SIZE):
+            self.wfile.write(body[i:i + _WRITE_CHUNK_SIZE])
+
+    def log_message(self, format_string, *args):
+        logger.debug('%s %s', self.address_string(), format_string % args)
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO)
+    server = FakeSiad(
+        Workload(
+            file_count=args.file_count,
+            contract_count=args.contract_count,
+            latency=args.latency_ms / 1000.0), args.port)
+    logger.info('Serving %d files and %d contracts on port %d', args.file_count,
+                args.contract_count, server.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Fake siad',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-p', '--port', type=int, default=9980, help='Port on which to listen')
+    parser.add_argument(
+        '--file_count', type=int, default=10, help='Number of files to serve')
+    parser.add_argument(
+        '--contract_count',
+        type=int,
+        default=10,
+        help='Number of contracts to serve')
+    parser.add_argument(
+        '--latency_ms',
+        type=float,
+        default=0.0,
+        help='Number of milliseconds to wait before answering each API call')
+    main(parser.parse_args())
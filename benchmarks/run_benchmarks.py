@@ -0,0 +1,309 @@
+#!/usr/bin/python2
+"""Benchmarks polling a fake siad across a range of workloads.
+
+Each workload runs a fake siad with a given number of files and contracts,
+then polls it repeatedly, timing each phase of a poll:
+
+    build: state.Builder.build, including every Sia API call.
+    write_state: serialize.CsvSerializer.write_state.
+    print_state: cli.print_state.
+
+The fake siad and the poller each run in their own process, so the peak RSS
+of each workload covers only the poller and isn't inflated by the fake siad
+or by earlier workloads.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --output results.json
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_siad
+from sia_metrics_collector import cli
+from sia_metrics_collector import serialize
+from sia_metrics_collector import state
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('build', 'write_state', 'print_state')
+
+# Version of the results file format.
+_RESULTS_VERSION = 1
+
+
+def run_workload(workload, options):
+    """Benchmarks polling a fake siad serving the given workload.
+
+    Args:
+        workload: The fake_siad.Workload to serve.
+        options: A dict of benchmark options. See _benchmark_options.
+
+    Returns:
+        A dict describing the workload and the benchmark's results.
+    """
+    port_queue = multiprocessing.Queue()
+    server_process = multiprocessing.Process(
+        target=_serve, args=(workload, port_queue))
+    server_process.daemon = True
+    server_process.start()
+    try:
+        port = port_queue.get()
+        result_queue = multiprocessing.Queue()
+        poller_process = multiprocessing.Process(
+            target=_poll, args=(port, options, result_queue))
+        poller_process.start()
+        result = result_queue.get()
+        poller_process.join()
+    finally:
+        server_process.terminate()
+        server_process.join()
+    if 'error' in result:
+        raise RuntimeError('Benchmark of %s failed: %s' % (workload,
+                                                           result['error']))
+    result['workload'] = dict(workload._asdict())
+    return result
+
+
+def _serve(workload, port_queue):
+    server = fake_siad.FakeSiad(workload)
+    port_queue.put(server.port)
+    server.serve_forever()
+
+
+def _poll(port, options, result_queue):
+    try:
+        result_queue.put(_measure_polls(port, options))
+    except Exception as e:
+        result_queue.put({'error': repr(e)})
+
+
+def _measure_polls(port, options):
+    builder = state.make_builder(
+        'http://127.0.0.1',
+        port,
+        concurrent=options['concurrent_queries'],
+        stream_files=options['stream_files'],
+        incremental=options['incremental'])
+    output_dir = tempfile.mkdtemp()
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    timings = {phase: [] for phase in PHASES}
+    try:
+        with open(os.path.join(output_dir, 'metrics.csv'), 'w') as csv_file:
+            serializer = serialize.CsvSerializer(csv_file)
+            rss_before_kb = _peak_rss_kb()
+            for i in xrange(options['warmup_polls'] + options['polls']):
+                build_start = time.time()
+                s = builder.build()
+                write_start = time.time()
+                serializer.write_state(s)
+                print_start = time.time()
+                sys.stdout = devnull
+                try:
+                    cli.print_state(s)
+                finally:
+                    sys.stdout = stdout
+                print_end = time.time()
+                if i < options['warmup_polls']:
+                    continue
+                timings['build'].append(write_start - build_start)
+                timings['write_state'].append(print_start - write_start)
+                timings['print_state'].append(print_end - print_start)
+    finally:
+        devnull.close()
+        shutil.rmtree(output_dir)
+    total_seconds = sum(sum(t) for t in timings.itervalues())
+    return {
+        'polls': options['polls'],
+        'polls_per_second': options['polls'] / total_seconds,
+        'phases': {phase: _summarize(timings[phase])
+                   for phase in PHASES},
+        'rss_before_polls_kb': rss_before_kb,
+        'peak_rss_kb': _peak_rss_kb(),
+    }
+
+
+def _peak_rss_kb():
+    # Linux reports ru_maxrss in kilobytes, but OS X reports it in bytes.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss // 1024
+    return max_rss
+
+
+def _summarize(seconds):
+    """Summarizes the durations of a phase, in milliseconds."""
+    milliseconds = sorted(s * 1000.0 for s in seconds)
+    return {
+        'mean_ms': sum(milliseconds) / len(milliseconds),
+        'p50_ms': _percentile(milliseconds, 50),
+        'p95_ms': _percentile(milliseconds, 95),
+        'max_ms': milliseconds[-1],
+    }
+
+
+def _percentile(sorted_values, percent):
+    index = int(round((len(sorted_values) - 1) * percent / 100.0))
+    return sorted_values[index]
+
+
+def compare(results, baseline):
+    """Compares benchmark results to a baseline run.
+
+    Args:
+        results: A list of workload results from this run.
+        baseline: A list of workload results from an earlier run.
+
+    Returns:
+        A list of (workload, polls/sec ratio, peak RSS ratio) tuples for each
+        workload in both runs, where a ratio above 1 means this run has the
+        higher value.
+    """
+    baseline_by_workload = {
+        _workload_key(result['workload']): result
+        for result in baseline
+    }
+    comparisons = []
+    for result in results:
+        key = _workload_key(result['workload'])
+        if key not in baseline_by_workload:
+            continue
+        old = baseline_by_workload[key]
+        comparisons.append(
+            (result['workload'],
+             result['polls_per_second'] / old['polls_per_second'],
+             float(result['peak_rss_kb']) / old['peak_rss_kb']))
+    return comparisons
+
+
+def _workload_key(workload):
+    return (workload['file_count'], workload['contract_count'],
+            workload['latency'], workload['seed'])
+
+
+def _benchmark_options(args):
+    return {
+        'polls': args.polls,
+        'warmup_polls': args.warmup_polls,
+        'concurrent_queries': args.concurrent_queries,
+        'stream_files': args.stream_files,
+        'incremental': args.incremental,
+    }
+
+
+def _parse_counts(counts):
+    return [int(count) for count in counts.split(',')]
+
+
+def _print_result(result):
+    workload = result['workload']
+    print('%8d files %6d contracts: %7.2f polls/s, build %9.2fms, '
+          'write %6.3fms, print %6.3fms, peak RSS %7.1fMB') % (
+              workload['file_count'], workload['contract_count'],
+              result['polls_per_second'], result['phases']['build']['mean_ms'],
+              result['phases']['write_state']['mean_ms'],
+              result['phases']['print_state']['mean_ms'],
+              result['peak_rss_kb'] / 1024.0)
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO)
+    options = _benchmark_options(args)
+    results = []
+    for file_count, contract_count in itertools.product(
+            _parse_counts(args.file_counts), _parse_counts(
+                args.contract_counts)):
+        workload = fake_siad.Workload(
+            file_count=file_count,
+            contract_count=contract_count,
+            latency=args.latency_ms / 1000.0)
+        logger.info('Benchmarking %d files, %d contracts', file_count,
+                    contract_count)
+        result = run_workload(workload, options)
+        _print_result(result)
+        results.append(result)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(
+                {
+                    'version':
+                    _RESULTS_VERSION,
+                    'time':
+                    datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'python':
+                    platform.python_version(),
+                    'platform':
+                    platform.platform(),
+                    'options':
+                    options,
+                    'results':
+                    results,
+                },
+                output_file,
+                indent=2,
+                sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        for workload, speed_ratio, rss_ratio in compare(results, baseline):
+            print('%8d files %6d contracts: %+6.1f%% polls/s, %+6.1f%% peak '
+                  'RSS vs. baseline') % (workload['file_count'],
+                                         workload['contract_count'],
+                                         (speed_ratio - 1) * 100,
+                                         (rss_ratio - 1) * 100)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Sia Metrics Collector Benchmarks',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--file_counts',
+        default='10,10000',
+        help='Comma-separated numbers of files to benchmark')
+    parser.add_argument(
+        '--contract_counts',
+        default='10,1000',
+        help='Comma-separated numbers of contracts to benchmark')
+    parser.add_argument(
+        '--latency_ms',
+        type=float,
+        default=0.0,
+        help='Milliseconds the fake siad waits before answering each call')
+    parser.add_argument(
+        '--polls', type=int, default=10, help='Number of polls to time')
+    parser.add_argument(
+        '--warmup_polls',
+        type=int,
+        default=1,
+        help='Number of polls to run before timing starts')
+    parser.add_argument(
+        '--concurrent_queries',
+        action='store_true',
+        help='Query all Sia APIs in parallel')
+    parser.add_argument(
+        '--stream_files',
+        action='store_true',
+        help='Decode the list of files incrementally')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Update metrics from only the contracts and files that changed')
+    parser.add_argument('-o', '--output', help='Path to write results as JSON')
+    parser.add_argument(
+        '--baseline',
+        help='Path to results from an earlier run to compare against')
+    main(parser.parse_args())
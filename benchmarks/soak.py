@@ -0,0 +1,389 @@
+#!/usr/bin/python2
+"""Soak test that runs the poll loop for a long time to catch slow leaks.
+
+The soak runs the collector's real poll loop (main._poll_forever, with a
+Builder made the way production makes one, its Scheduler, and writer thread)
+against a fake siad in a separate process. The collector's clock is faked, so
+the scheduler never really sleeps and a year of one-minute polls takes as
+long as the API calls do. Like a real sleep, each fake sleep overshoots by a
+random amount of up to --sleep_overshoot_seconds, so the drift check measures
+whether the scheduler keeps that lateness from piling up.
+
+Every so often, the soak samples the collector's RSS, open file handles, and
+threads. At the end, it reports how much each grew after warmup, along with
+how far any poll strayed from its deadline, and fails if any of them exceed
+their thresholds.
+
+Run from the repository root:
+
+    python -m benchmarks.soak --polls 1000000 --output soak.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import threading
+
+from benchmarks import fake_siad
+from sia_metrics_collector import main as collector_main
+from sia_metrics_collector import scheduler
+from sia_metrics_collector import serialize
+from sia_metrics_collector import state
+from sia_metrics_collector import writer
+
+logger = logging.getLogger(__name__)
+
+# Time at which the fake clock starts, in seconds since the epoch.
+_START_TIME = 1518364802.0
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class FakeClock(object):
+    """A clock that only moves forward when something sleeps on it."""
+
+    def __init__(self, start=_START_TIME, sleep_overshoot_seconds=0.0, seed=0):
+        """Creates a fake clock.
+
+        Args:
+            start: Time at which the clock starts, in seconds since the epoch.
+            sleep_overshoot_seconds: Maximum number of seconds by which each
+                sleep overshoots, as the OS wakes sleeping threads late.
+            seed: Seed for the random overshoot of each sleep.
+        """
+        self._seconds = start
+        self._sleep_overshoot_seconds = sleep_overshoot_seconds
+        self._random = random.Random(seed)
+
+    def time(self):
+        """Returns the current time in seconds since the epoch."""
+        return self._seconds
+
+    def now(self):
+        """Returns the current time as a UTC datetime."""
+        return _EPOCH + datetime.timedelta(seconds=self._seconds)
+
+    def advance(self, seconds):
+        """Advances the clock by exactly the given number of seconds."""
+        self._seconds += seconds
+
+    def sleep(self, seconds):
+        """Advances the clock by at least the given number of seconds."""
+        self._seconds += seconds + self._random.uniform(
+            0.0, self._sleep_overshoot_seconds)
+
+
+class _SoakFinished(Exception):
+    pass
+
+
+class _SoakScheduler(object):
+    """Wraps a Scheduler to measure drift and sample resources at each poll.
+
+    Ends the soak by raising _SoakFinished once every poll has run.
+    """
+
+    def __init__(self, poll_scheduler, clock, options):
+        self._scheduler = poll_scheduler
+        self._clock = clock
+        self._options = options
+        self._poll_count = 0
+        self._first_deadline = None
+        self.max_drift_seconds = 0.0
+        # List of (poll count, RSS in KB, file handle count, thread count).
+        self.samples = []
+
+    def wait(self):
+        if (self._poll_count % self._options['sample_interval'] == 0 or
+                self._poll_count == self._options['polls']):
+            self.samples.append((self._poll_count, _rss_kb(), _fd_count(),
+                                 threading.active_count()))
+        if self._poll_count == self._options['polls']:
+            raise _SoakFinished()
+        self._scheduler.wait()
+        now = self._clock.time()
+        if self._first_deadline is None:
+            self._first_deadline = now
+        # Overrun policies may skip deadlines, so measure how far the poll
+        # is from the nearest deadline on the grid rather than from the
+        # deadline that poll_count alone would give.
+        offset = (now - self._first_deadline) % self._options['poll_frequency']
+        self.max_drift_seconds = max(
+            self.max_drift_seconds,
+            min(offset, self._options['poll_frequency'] - offset))
+        self._poll_count += 1
+
+    @property
+    def missed_count(self):
+        return self._scheduler.missed_count
+
+
+class _SlowBuilder(object):
+    """Wraps a Builder so each build takes some time on the fake clock."""
+
+    def __init__(self, builder, clock, seconds):
+        self._builder = builder
+        self._clock = clock
+        self._seconds = seconds
+
+    def build(self):
+        self._clock.advance(self._seconds)
+        return self._builder.build()
+
+
+def run_soak(port, options):
+    """Soaks the poll loop against a fake siad listening on a local port.
+
+    Args:
+        port: Port of the fake siad.
+        options: A dict of soak options. See _soak_options.
+
+    Returns:
+        A dict of the soak's results.
+    """
+    clock = FakeClock(
+        sleep_overshoot_seconds=options['sleep_overshoot_seconds'])
+    builder = _SlowBuilder(
+        state.make_builder(
+            'http://127.0.0.1',
+            port,
+            concurrent=options['concurrent_queries'],
+            time_fn=clock.now), clock, options['poll_seconds'])
+    poll_scheduler = scheduler.Scheduler(
+        options['poll_frequency'], clock=clock.time, sleep=clock.sleep)
+    soak_scheduler = _SoakScheduler(poll_scheduler, clock, options)
+    loop_args = argparse.Namespace(
+        write_queue_size=writer.DEFAULT_MAX_QUEUE_SIZE,
+        write_overflow_policy=writer.BLOCK,
+        ring_buffer_file=None)
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        with open(options['csv_file'], 'w') as csv_file:
+            try:
+                collector_main._poll_forever(builder, soak_scheduler,
+                                             serialize.CsvSerializer(
+                                                 csv_file, time_fn=clock.time),
+                                             None, loop_args)
+            except _SoakFinished:
+                pass
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    return _summarize(soak_scheduler, options)
+
+
+def check_thresholds(result, options):
+    """Checks a soak's results against the thresholds in its options.
+
+    Args:
+        result: A dict of results from run_soak.
+        options: A dict of soak options. See _soak_options.
+
+    Returns:
+        A list of messages describing each threshold that was exceeded.
+    """
+    failures = []
+    checks = (
+        ('rss_growth_kb', 'max_rss_growth_kb', 'RSS grew by %d KB'),
+        ('fd_growth', 'max_fd_growth', 'Open file handles grew by %d'),
+        ('thread_growth', 'max_thread_growth', 'Threads grew by %d'),
+        ('max_drift_seconds', 'max_drift_seconds',
+         'A poll strayed %.6fs from its deadline'),
+    )
+    for result_key, threshold_key, message in checks:
+        value = result[result_key]
+        if value is not None and value > options[threshold_key]:
+            failures.append('%s (threshold %s)' % (message % value,
+                                                   options[threshold_key]))
+    return failures
+
+
+def _summarize(soak_scheduler, options):
+    # The last sample is taken at the end of the soak, while the writer
+    # thread and output file are still open.
+    samples = soak_scheduler.samples
+    final_sample = samples[-1]
+    # Measure growth from the first sample after warmup, as caches and
+    # buffers fill up during the first polls.
+    baseline = next((s for s in samples if s[0] >= options['warmup_polls']),
+                    samples[-1])
+
+    def growth(index):
+        if baseline[index] is None or final_sample[index] is None:
+            return None
+        return final_sample[index] - baseline[index]
+
+    return {
+        'polls':
+        options['polls'],
+        'simulated_seconds':
+        options['polls'] * options['poll_frequency'],
+        'rss_growth_kb':
+        growth(1),
+        'fd_growth':
+        growth(2),
+        'thread_growth':
+        growth(3),
+        'max_drift_seconds':
+        soak_scheduler.max_drift_seconds,
+        'missed_deadlines':
+        soak_scheduler.missed_count,
+        'samples': [{
+            'poll': poll,
+            'rss_kb': rss_kb,
+            'fd_count': fd_count,
+            'thread_count': thread_count,
+        } for poll, rss_kb, fd_count, thread_count in samples],
+    }
+
+
+def _rss_kb():
+    """Returns the current RSS, or the peak RSS where that's unavailable."""
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * resource.getpagesize() // 1024
+    except IOError:
+        pass
+    # Linux reports ru_maxrss in kilobytes, but OS X reports it in bytes.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss // 1024
+    return max_rss
+
+
+def _fd_count():
+    """Returns the number of open file handles, or None if unknown."""
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return None
+
+
+def _serve(workload, port_queue):
+    server = fake_siad.FakeSiad(workload)
+    port_queue.put(server.port)
+    server.serve_forever()
+
+
+def _soak_options(args):
+    return {
+        'polls': args.polls,
+        'warmup_polls': args.warmup_polls,
+        'sample_interval': args.sample_interval,
+        'poll_frequency': args.poll_frequency,
+        'poll_seconds': args.poll_seconds,
+        'sleep_overshoot_seconds': args.sleep_overshoot_seconds,
+        'concurrent_queries': args.concurrent_queries,
+        'csv_file': args.csv_file,
+        'max_rss_growth_kb': args.max_rss_growth_kb,
+        'max_fd_growth': args.max_fd_growth,
+        'max_thread_growth': args.max_thread_growth,
+        'max_drift_seconds': args.max_drift_seconds,
+    }
+
+
+def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    options = _soak_options(args)
+    port_queue = multiprocessing.Queue()
+    server_process = multiprocessing.Process(
+        target=_serve,
+        args=(fake_siad.Workload(
+            file_count=args.file_count, contract_count=args.contract_count),
+              port_queue))
+    server_process.daemon = True
+    server_process.start()
+    try:
+        result = run_soak(port_queue.get(), options)
+    finally:
+        server_process.terminate()
+        server_process.join()
+    result['failures'] = check_thresholds(result, options)
+    report = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report + '\n')
+    print report
+    for failure in result['failures']:
+        logger.error(failure)
+    if result['failures']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Soak test',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--polls', type=int, default=1000000, help='Number of polls to run')
+    parser.add_argument(
+        '--warmup_polls',
+        type=int,
+        default=1000,
+        help='Number of polls to run before measuring growth')
+    parser.add_argument(
+        '--sample_interval',
+        type=int,
+        default=10000,
+        help='Number of polls between samples of RSS and file handles')
+    parser.add_argument(
+        '--poll_frequency',
+        type=int,
+        default=60,
+        help='Simulated number of seconds between polls')
+    parser.add_argument(
+        '--poll_seconds',
+        type=float,
+        default=1.0,
+        help='Simulated number of seconds that each poll takes')
+    parser.add_argument(
+        '--sleep_overshoot_seconds',
+        type=float,
+        default=0.0005,
+        help='Maximum simulated number of seconds by which each sleep '
+        'overshoots')
+    parser.add_argument(
+        '--concurrent_queries',
+        action='store_true',
+        help='Query each Sia API on its own thread')
+    parser.add_argument(
+        '--file_count', type=int, default=10, help='Number of files to serve')
+    parser.add_argument(
+        '--contract_count',
+        type=int,
+        default=10,
+        help='Number of contracts to serve')
+    parser.add_argument(
+        '--csv_file',
+        default=os.devnull,
+        help='Path of the CSV file to write metrics to')
+    parser.add_argument(
+        '--max_rss_growth_kb',
+        type=int,
+        default=10 * 1024,
+        help='Fail if RSS grows by more than this many KB after warmup')
+    parser.add_argument(
+        '--max_fd_growth',
+        type=int,
+        default=0,
+        help='Fail if open file handles grow by more than this after warmup')
+    parser.add_argument(
+        '--max_thread_growth',
+        type=int,
+        default=0,
+        help='Fail if threads grow by more than this after warmup')
+    parser.add_argument(
+        '--max_drift_seconds',
+        type=float,
+        default=0.001,
+        help='Fail if any poll starts further than this from its deadline')
+    parser.add_argument('--output', help='Path to write JSON results to')
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+"""Maintains running totals over keyed collections of Sia entities."""
+
+import recordtype
+"""Counts of entities that changed between two updates of an IncrementalSum.
+
+Fields:
+    added_count: Number of entities that were not present in the previous
+        update.
+    removed_count: Number of entities that were present in the previous
+        update but not in this one.
+    changed_count: Number of entities whose values differ from the previous
+        update.
+"""
+Changes = recordtype.recordtype(
+    'Changes', ['added_count', 'removed_count', 'changed_count'], default=0)
+
+
+class IncrementalSum(object):
+    """Sums fields across a collection of entities, applying only diffs.
+
+    Each update compares every entity to its cached values from the previous
+    update and adjusts the running totals only for entities that were added,
+    removed, or changed, so an update where nothing changed leaves the totals
+    untouched.
+
+    Note that totals of float fields can accumulate rounding error over many
+    updates, as each change is applied by subtraction and addition.
+    """
+
+    def __init__(self, field_count):
+        """Creates a new IncrementalSum instance.
+
+        Args:
+            field_count: Number of fields summed for each entity.
+        """
+        self._values_by_key = {}
+        self._totals = [0] * field_count
+
+    def __len__(self):
+        """Returns the number of entities in the most recent update."""
+        return len(self._values_by_key)
+
+    @property
+    def totals(self):
+        """A tuple of the sum of each field across all entities."""
+        return tuple(self._totals)
+
+    def copy(self):
+        """Returns an IncrementalSum with the same entities and totals."""
+        other = IncrementalSum(len(self._totals))
+        other._values_by_key = dict(self._values_by_key)
+        other._totals = list(self._totals)
+        return other
+
+    def update(self, entities):
+        """Replaces the collection of entities, adjusting totals for changes.
+
+        If entities raises an exception partway through, the entities read so
+        far are applied and the remaining entities keep their previous values,
+        so the totals stay consistent with the cache.
+
+        Args:
+            entities: An iterable of (key, values) pairs, where key uniquely
+                identifies an entity and values is a tuple of its fields.
+
+        Returns:
+            A Changes instance counting the entities that changed.
+        """
+        changes = Changes()
+        values_by_key = self._values_by_key
+        totals = self._totals
+        seen_keys = set()
+        for key, values in entities:
+            seen_keys.add(key)
+            old_values = values_by_key.get(key)
+            if old_values == values:
+                continue
+            if old_values is None:
+                changes.added_count += 1
+                for i, value in enumerate(values):
+                    totals[i] += value
+            else:
+                changes.changed_count += 1
+                for i, value in enumerate(values):
+                    totals[i] += value - old_values[i]
+            values_by_key[key] = values
+        if len(seen_keys) < len(values_by_key):
+            removed_keys = [k for k in values_by_key if k not in seen_keys]
+            for key in removed_keys:
+                for i, value in enumerate(values_by_key.pop(key)):
+                    totals[i] -= value
+            changes.removed_count = len(removed_keys)
+        if not values_by_key:
+            # Clear any accumulated rounding error.
+            self._totals = [0] * len(totals)
+        return changes
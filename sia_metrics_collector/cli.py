@@ -5,6 +5,22 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Number of rows the ConsolePrinter prints between headers.
+_ROWS_PER_HEADER = 100
+
+
+class ConsolePrinter(object):
+    """Prints each SiaState to the console, with a header every so often."""
+
+    def __init__(self):
+        self._row_count = 0
+
+    def write_state(self, state):
+        if self._row_count % _ROWS_PER_HEADER == 0:
+            print_header()
+        print_state(state)
+        self._row_count += 1
+
 
 def print_header():
     print """
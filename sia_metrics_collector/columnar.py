@@ -0,0 +1,295 @@
+"""Serializes SiaState to an append-only, fixed-width columnar format.
+
+A columnar store is a directory with one file per SiaState field, plus a
+schema.json file describing them. Each column file is a flat array of
+little-endian values, one per row, so a reader can memory-map a column and
+use it directly without parsing.
+
+Column types:
+    timestamp: int64 microseconds since the Unix epoch (UTC).
+    int64: Signed 64-bit integer. Missing values are stored as -2^63.
+    float64: IEEE 754 double. Missing values are stored as NaN.
+    hastings: Unsigned 128-bit integer stored as two uint64 values (low word
+        first), as hastings amounts overflow 64 bits. Missing values are
+        stored with every bit set.
+
+A store written by an older version, with only some of the current columns,
+stays readable: its missing columns read as missing values, and the next
+writer adds them, filled with missing values for the rows before it.
+
+Reading requires numpy, which is an optional dependency.
+"""
+
+import datetime
+import json
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TIMESTAMP = 'timestamp'
+INT64 = 'int64'
+FLOAT64 = 'float64'
+HASTINGS = 'hastings'
+
+# SiaState fields stored in a columnar store and the type of each.
+COLUMNS = (
+    ('timestamp', TIMESTAMP),
+    ('contract_count', INT64),
+    ('file_count', INT64),
+    ('uploads_in_progress_count', INT64),
+    ('total_contract_size', INT64),
+    ('total_file_bytes', FLOAT64),
+    ('uploaded_bytes', INT64),
+    ('total_contract_spending', HASTINGS),
+    ('contract_fee_spending', HASTINGS),
+    ('storage_spending', HASTINGS),
+    ('upload_spending', HASTINGS),
+    ('download_spending', HASTINGS),
+    ('remaining_renter_funds', HASTINGS),
+    ('wallet_siacoin_balance', HASTINGS),
+    ('wallet_outgoing_siacoins', HASTINGS),
+    ('wallet_incoming_siacoins', HASTINGS),
+    ('api_latency', FLOAT64),
+    ('contracts_api_latency', FLOAT64),
+    ('files_api_latency', FLOAT64),
+    ('wallet_api_latency', FLOAT64),
+    ('contracts_age', FLOAT64),
+    ('files_age', FLOAT64),
+    ('wallet_age', FLOAT64),
+    ('response_cache_hits', INT64),
+    ('response_cache_misses', INT64),
+    ('contracts_status', INT64),
+    ('files_status', INT64),
+    ('wallet_status', INT64),
+    ('write_queue_depth', INT64),
+    ('dropped_state_count', INT64),
+)
+
+_SCHEMA_FILENAME = 'schema.json'
+_COLUMN_FILE_EXTENSION = '.col'
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_INT64_NULL = -2**63
+_UINT64_MAX = 2**64 - 1
+_HASTINGS_MAX = 2**128 - 1
+
+# Number of rows of missing values to write at a time when adding a column.
+_NULL_CHUNK_ROWS = 65536
+
+_STRUCTS = {
+    TIMESTAMP: struct.Struct('<q'),
+    INT64: struct.Struct('<q'),
+    FLOAT64: struct.Struct('<d'),
+    HASTINGS: struct.Struct('<QQ'),
+}
+
+
+class ColumnarSerializer(object):
+    """Appends SiaState rows to a columnar store."""
+
+    def __init__(self, directory, rows_per_flush=1):
+        """Creates a serializer, appending to the store in the given directory.
+
+        Creates the directory if it does not exist. If a previous writer
+        stopped partway through a row, the partial row is discarded. If the
+        store lacks some of the current columns, they are added.
+
+        Args:
+            directory: Path to the columnar store's directory.
+            rows_per_flush: Number of rows to buffer before flushing the
+                column files.
+
+        Raises:
+            ValueError: If the directory holds a store with columns that
+                aren't among the current columns.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        stored_columns = list(COLUMNS)
+        if os.path.exists(os.path.join(directory, _SCHEMA_FILENAME)):
+            stored_columns = _read_schema(directory)
+        row_count = _count_complete_rows(directory, stored_columns)
+        self._column_files = []
+        for name, column_type in COLUMNS:
+            path = _column_path(directory, name)
+            if (name, column_type) in stored_columns:
+                with open(path, 'ab') as column_file:
+                    column_file.truncate(row_count * _STRUCTS[column_type].size)
+            else:
+                _write_null_column(path, column_type, row_count)
+            self._column_files.append((open(path, 'ab'), column_type))
+        _write_schema(directory)
+        self._rows_per_flush = rows_per_flush
+        self._buffered_rows = 0
+
+    def write_state(self, state):
+        for (name, _), (column_file, column_type) in zip(
+                COLUMNS, self._column_files):
+            column_file.write(_pack(column_type, getattr(state, name)))
+        self._buffered_rows += 1
+        if self._buffered_rows >= self._rows_per_flush:
+            self.flush()
+
+    def flush(self):
+        for column_file, _ in self._column_files:
+            column_file.flush()
+        self._buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        for column_file, _ in self._column_files:
+            column_file.close()
+
+
+class ColumnarReader(object):
+    """Reads columns of a columnar store as memory-mapped numpy arrays."""
+
+    def __init__(self, directory):
+        """Creates a reader for the store in the given directory.
+
+        Args:
+            directory: Path to the columnar store's directory.
+
+        Raises:
+            ImportError: If numpy is not installed.
+            ValueError: If the directory holds a store with columns that
+                aren't among the current columns.
+        """
+        if numpy is None:
+            raise ImportError('Reading columnar metrics requires numpy')
+        self._stored_columns = _read_schema(directory)
+        self._directory = directory
+        self.row_count = _count_complete_rows(directory, self._stored_columns)
+
+    def column(self, name):
+        """Returns the values of a single column.
+
+        Timestamps are returned as datetime64[us] values and int64 and
+        float64 columns as memory-mapped arrays of their stored values.
+        Hastings columns are converted to float64, which is precise to about
+        15 significant digits, with missing values as NaN. A column that the
+        store doesn't have yet has a missing value in every row.
+
+        Args:
+            name: Name of the SiaState field to read.
+
+        Returns:
+            A numpy array with one value per row.
+
+        Raises:
+            KeyError: If the store has no column with the given name.
+        """
+        column_type = dict(COLUMNS)[name]
+        if (name, column_type) not in self._stored_columns:
+            values = _null_values(column_type, self.row_count)
+        elif self.row_count == 0:
+            # numpy can't memory-map an empty file.
+            values = numpy.zeros(0, dtype=_dtype(column_type))
+        else:
+            values = numpy.memmap(
+                _column_path(self._directory, name),
+                dtype=_dtype(column_type),
+                mode='r',
+                shape=(self.row_count,))
+        if column_type == TIMESTAMP:
+            return values.view('datetime64[us]')
+        if column_type == HASTINGS:
+            return _hastings_to_float(values)
+        return values
+
+    def columns(self, names=None):
+        """Returns a dict of column name to values for the given columns.
+
+        Args:
+            names: Names of the SiaState fields to read. Defaults to all.
+        """
+        if names is None:
+            names = [name for name, _ in COLUMNS]
+        return {name: self.column(name) for name in names}
+
+
+def _column_path(directory, name):
+    return os.path.join(directory, name + _COLUMN_FILE_EXTENSION)
+
+
+def _write_schema(directory):
+    # Write the schema only once every column file exists, and replace it
+    # atomically, so a reader never sees a column without its file.
+    path = os.path.join(directory, _SCHEMA_FILENAME)
+    with open(path + '.tmp', 'w') as schema_file:
+        json.dump({'columns': [list(c) for c in COLUMNS]}, schema_file)
+    os.rename(path + '.tmp', path)
+
+
+def _read_schema(directory):
+    """Returns the (name, type) pairs of a store's columns."""
+    with open(os.path.join(directory, _SCHEMA_FILENAME)) as schema_file:
+        columns = [tuple(c) for c in json.load(schema_file)['columns']]
+    unknown_columns = [c for c in columns if c not in COLUMNS]
+    if unknown_columns:
+        raise ValueError('Columnar store in %s has unexpected columns: %s' %
+                         (directory, unknown_columns))
+    return columns
+
+
+def _count_complete_rows(directory, columns):
+    row_counts = []
+    for name, column_type in columns:
+        path = _column_path(directory, name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        row_counts.append(size // _STRUCTS[column_type].size)
+    return min(row_counts)
+
+
+def _write_null_column(path, column_type, row_count):
+    """Writes a column file with a missing value in each of row_count rows."""
+    null_value = _pack(column_type, None)
+    with open(path, 'wb') as column_file:
+        # Write in chunks to bound memory use for long histories.
+        for start in xrange(0, row_count, _NULL_CHUNK_ROWS):
+            column_file.write(
+                null_value * min(_NULL_CHUNK_ROWS, row_count - start))
+
+
+def _pack(column_type, value):
+    if column_type == TIMESTAMP:
+        if value is None:
+            return _STRUCTS[TIMESTAMP].pack(_INT64_NULL)
+        delta = value - _EPOCH
+        return _STRUCTS[TIMESTAMP].pack(
+            (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+    if column_type == INT64:
+        return _STRUCTS[INT64].pack(_INT64_NULL if value is None else value)
+    if column_type == FLOAT64:
+        return _STRUCTS[FLOAT64].pack(float('nan') if value is None else value)
+    if value is None:
+        value = _HASTINGS_MAX
+    elif not 0 <= value < _HASTINGS_MAX:
+        raise ValueError('Hastings value out of range: %d' % value)
+    return _STRUCTS[HASTINGS].pack(value & _UINT64_MAX, value >> 64)
+
+
+def _dtype(column_type):
+    if column_type == HASTINGS:
+        return numpy.dtype([('low', '<u8'), ('high', '<u8')])
+    if column_type == FLOAT64:
+        return numpy.dtype('<f8')
+    return numpy.dtype('<i8')
+
+
+def _null_values(column_type, row_count):
+    """Returns stored values of a column with a missing value in each row."""
+    return numpy.frombuffer(
+        _pack(column_type, None) * row_count, dtype=_dtype(column_type))
+
+
+def _hastings_to_float(values):
+    result = (values['high'].astype(numpy.float64) * float(2**64) +
+              values['low'].astype(numpy.float64))
+    result[(values['high'] == _UINT64_MAX) &
+           (values['low'] == _UINT64_MAX)] = numpy.nan
+    return result
@@ -0,0 +1,537 @@
+#!/usr/bin/python2
+"""Serializes SiaState to a compact, block-compressed time series file.
+
+Most metrics barely change from one poll to the next: timestamps advance by
+a fixed step and counters grow slowly. Like Gorilla and Prometheus TSDB
+chunks, this format groups rows into blocks and encodes each column of a
+block against its own previous values:
+
+    timestamp: Delta-of-delta, so a steady poll interval costs one byte a
+        row.
+    int64 and hastings: Delta from the previous value.
+    float64: XOR with the previous value's bits, with trailing zero bits
+        dropped.
+
+Integers are written as zigzag varints, which handle hastings amounts of any
+size. Each column starts with a bitmap of which rows have a value, if any
+row is missing one. The encoded block is then compressed with zlib, which
+squeezes out the runs of zero deltas that the encodings leave behind.
+
+A file starts with a magic line and a JSON line listing its columns, then
+holds a sequence of sealed blocks, each with a header giving its first row
+number, row count, length, and CRC-32. Rows of the block that isn't yet full
+live in a sidecar file (metrics.smc.tail for metrics.smc), to which each
+flush appends the rows written since the last flush, as a small block of
+their own. Once the block fills, the serializer seals its rows into the main
+file and deletes the sidecar. A block that was only partially written is
+discarded when the file is next opened.
+
+Blocks are always encoded with the columns listed in the file, so a file
+written by an older version, with fewer columns, stays readable, and new
+rows are appended with only the file's columns.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+import struct
+import zlib
+
+import columnar
+import state
+
+logger = logging.getLogger(__name__)
+
+# Default number of rows in each block.
+DEFAULT_BLOCK_ROWS = 1024
+
+_MAGIC = 'sia-metrics-compressed 1\n'
+_TAIL_FILE_EXTENSION = '.tail'
+
+# First row number, row count, payload length, and payload CRC-32 of a block.
+_BLOCK_HEADER = struct.Struct('<QIII')
+_FLOAT = struct.Struct('<d')
+_FLOAT_BITS = struct.Struct('<Q')
+
+# Marks a float64 value whose bits equal the previous value's.
+_XOR_SAME_VALUE = 64
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_CSV_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+_COLUMN_TYPES = (columnar.TIMESTAMP, columnar.INT64, columnar.FLOAT64,
+                 columnar.HASTINGS)
+
+
+def tail_path(path):
+    """Returns the path of the file holding the unsealed rows of a file."""
+    return path + _TAIL_FILE_EXTENSION
+
+
+class CompressedSerializer(object):
+    """Appends SiaState rows to a compressed time series file."""
+
+    def __init__(self,
+                 path,
+                 rows_per_flush=1,
+                 rows_per_block=DEFAULT_BLOCK_ROWS,
+                 fsync=False):
+        """Creates a serializer, appending to the file at the given path.
+
+        Creates the file if it does not exist. If the file ends with a
+        partially written block, the partial block is discarded.
+
+        Args:
+            path: Path to the compressed time series file.
+            rows_per_flush: Number of rows to buffer before writing them to
+                the tail file.
+            rows_per_block: Number of rows to collect before sealing them
+                into a block of the main file.
+            fsync: If True, asks the OS to write each flush and each sealed
+                block through to disk.
+
+        Raises:
+            ValueError: If the file is not a compressed time series file.
+        """
+        if not os.path.exists(path):
+            with open(path, 'wb') as new_file:
+                new_file.write(_file_header())
+        self._path = path
+        self._file = open(path, 'r+b')
+        self._columns = _read_file_header(self._file, path)
+        missing_columns = [
+            name for name, _ in columnar.COLUMNS
+            if name not in dict(self._columns)
+        ]
+        if missing_columns:
+            logger.warning(
+                '%s was written by an older version, so it will not store %s. '
+                'Write to a new file to keep them.', path,
+                ', '.join(missing_columns))
+        end_offset, self._sealed_row_count = _scan_blocks(self._file)
+        self._file.truncate(end_offset)
+        self._file.seek(end_offset)
+        self._rows, tail_end_offset = _read_tail(path, self._sealed_row_count,
+                                                 self._columns)
+        if os.path.exists(tail_path(path)):
+            # Drop stale rows or a partially written block from the end of
+            # the tail before appending to it.
+            with open(tail_path(path), 'r+b') as tail_file:
+                tail_file.truncate(tail_end_offset)
+        self._tail_file = None
+        self._rows_per_flush = rows_per_flush
+        self._rows_per_block = rows_per_block
+        self._fsync = fsync
+        self._buffered_rows = 0
+
+    def write_state(self, sia_state):
+        self._rows.append(_state_to_row(sia_state, self._columns))
+        if len(self._rows) >= self._rows_per_block:
+            self._seal_block()
+            return
+        self._buffered_rows += 1
+        if self._buffered_rows >= self._rows_per_flush:
+            self.flush()
+
+    def flush(self):
+        """Appends rows buffered since the last flush to the tail file."""
+        if self._buffered_rows:
+            if self._tail_file is None:
+                self._tail_file = open(tail_path(self._path), 'ab')
+            first_buffered = len(self._rows) - self._buffered_rows
+            self._tail_file.write(
+                _encode_block(self._sealed_row_count + first_buffered,
+                              self._rows[first_buffered:], self._columns))
+            self._tail_file.flush()
+            if self._fsync:
+                os.fsync(self._tail_file.fileno())
+        self._buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        if self._tail_file:
+            self._tail_file.close()
+        self._file.close()
+
+    def _seal_block(self):
+        self._file.write(
+            _encode_block(self._sealed_row_count, self._rows, self._columns))
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        self._sealed_row_count += len(self._rows)
+        self._rows = []
+        self._buffered_rows = 0
+        # A tail left behind by a crash here is ignored on the next open, as
+        # its first row number is now behind the sealed rows.
+        if self._tail_file:
+            self._tail_file.close()
+            self._tail_file = None
+        if os.path.exists(tail_path(self._path)):
+            os.remove(tail_path(self._path))
+
+
+def iter_states(path):
+    """Decodes the rows of a compressed time series file, one at a time.
+
+    Only one block is held in memory at once.
+
+    Args:
+        path: Path to a file written by CompressedSerializer.
+
+    Yields:
+        A SiaState for each row, in the order they were written.
+
+    Raises:
+        ValueError: If the file is not a compressed time series file.
+    """
+    row_count = 0
+    with open(path, 'rb') as input_file:
+        columns = _read_file_header(input_file, path)
+        for first_row, block_row_count, payload in _iter_blocks(input_file):
+            if first_row != row_count:
+                break
+            for row in _decode_payload(payload, block_row_count, columns):
+                yield _row_to_state(row, columns)
+            row_count += block_row_count
+    for row in _read_tail(path, row_count, columns)[0]:
+        yield _row_to_state(row, columns)
+
+
+def convert_csv(csv_path, path, rows_per_block=DEFAULT_BLOCK_ROWS):
+    """Appends the rows of a metrics CSV file to a compressed file.
+
+    Columns that the CSV file lacks, such as those added in later versions,
+    are stored as missing values.
+
+    Args:
+        csv_path: Path to a CSV file written by serialize.CsvSerializer.
+        path: Path to the compressed time series file to append to.
+        rows_per_block: Number of rows in each block.
+
+    Returns:
+        The number of rows converted.
+    """
+    serializer = CompressedSerializer(
+        path, rows_per_flush=rows_per_block, rows_per_block=rows_per_block)
+    row_count = 0
+    try:
+        with open(csv_path, 'rb') as csv_file:
+            for row in csv.DictReader(csv_file):
+                serializer.write_state(_csv_row_to_state(row))
+                row_count += 1
+    finally:
+        serializer.close()
+    return row_count
+
+
+def _file_header():
+    return _MAGIC + json.dumps({
+        'columns': [list(c) for c in columnar.COLUMNS]
+    }) + '\n'
+
+
+def _read_file_header(input_file, path):
+    """Reads the header of a file and returns the columns it lists."""
+    if input_file.readline() != _MAGIC:
+        raise ValueError('%s is not a compressed time series file' % path)
+    columns = [tuple(c) for c in json.loads(input_file.readline())['columns']]
+    for name, column_type in columns:
+        if column_type not in _COLUMN_TYPES:
+            raise ValueError('%s has column %s of unknown type %s' %
+                             (path, name, column_type))
+    return columns
+
+
+def _scan_blocks(input_file):
+    """Returns the offset after the last intact block and the row count."""
+    end_offset = input_file.tell()
+    row_count = 0
+    for first_row, block_row_count, _ in _iter_blocks(input_file):
+        if first_row != row_count:
+            break
+        row_count += block_row_count
+        end_offset = input_file.tell()
+    return end_offset, row_count
+
+
+def _iter_blocks(input_file):
+    """Yields the first row number, row count, and payload of each block.
+
+    Stops at the first block that was only partially written.
+    """
+    while True:
+        header = input_file.read(_BLOCK_HEADER.size)
+        if len(header) < _BLOCK_HEADER.size:
+            return
+        first_row, row_count, payload_length, crc = _BLOCK_HEADER.unpack(header)
+        payload = input_file.read(payload_length)
+        if len(payload) < payload_length or _crc32(payload) != crc:
+            logger.warning('Ignoring partially written block at row %d',
+                           first_row)
+            return
+        yield first_row, row_count, payload
+
+
+def _read_tail(path, sealed_row_count, columns):
+    """Reads the rows of the tail file that follow the sealed rows.
+
+    Returns:
+        A list of the rows, and the offset in the tail file after the last
+        block they came from.
+    """
+    try:
+        tail_file = open(tail_path(path), 'rb')
+    except IOError:
+        return [], 0
+    rows = []
+    end_offset = 0
+    with tail_file:
+        for first_row, row_count, payload in _iter_blocks(tail_file):
+            if first_row != sealed_row_count + len(rows):
+                break
+            rows.extend(_decode_payload(payload, row_count, columns))
+            end_offset = tail_file.tell()
+    return rows, end_offset
+
+
+def _crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def _state_to_row(s, columns):
+    row = []
+    for name, column_type in columns:
+        # A file written by a newer version may have columns that this
+        # version's SiaState lacks.
+        value = getattr(s, name, None)
+        if value is not None and column_type == columnar.TIMESTAMP:
+            delta = value - _EPOCH
+            value = ((delta.days * 86400 + delta.seconds) * 1000000 +
+                     delta.microseconds)
+        row.append(value)
+    return row
+
+
+def _row_to_state(row, columns):
+    s = state.SiaState()
+    for (name, column_type), value in zip(columns, row):
+        if name not in state.SiaState._fields:
+            continue
+        if value is not None and column_type == columnar.TIMESTAMP:
+            value = _EPOCH + datetime.timedelta(microseconds=value)
+        setattr(s, name, value)
+    return s
+
+
+def _csv_row_to_state(row):
+    s = state.SiaState()
+    for name, column_type in columnar.COLUMNS:
+        value = row.get(name)
+        if not value:
+            continue
+        if column_type == columnar.TIMESTAMP:
+            value = datetime.datetime.strptime(value, _CSV_TIMESTAMP_FORMAT)
+        elif column_type == columnar.FLOAT64:
+            value = float(value)
+        else:
+            value = long(value)
+        setattr(s, name, value)
+    return s
+
+
+def _encode_block(first_row, rows, columns):
+    payload = bytearray()
+    for i, (_, column_type) in enumerate(columns):
+        encoded = _encode_column(column_type, [row[i] for row in rows])
+        _write_varint(len(encoded), payload)
+        payload += encoded
+    payload = zlib.compress(str(payload))
+    return _BLOCK_HEADER.pack(first_row, len(rows), len(payload),
+                              _crc32(payload)) + payload
+
+
+def _decode_payload(payload, row_count, columns):
+    data = bytearray(zlib.decompress(payload))
+    pos = 0
+    values = []
+    for _, column_type in columns:
+        length, pos = _read_varint(data, pos)
+        values.append(
+            _decode_column(column_type, data[pos:pos + length], row_count))
+        pos += length
+    return [list(row) for row in zip(*values)]
+
+
+def _encode_column(column_type, values):
+    encoded = bytearray()
+    present = [value is not None for value in values]
+    if all(present):
+        encoded.append(0)
+    else:
+        encoded.append(1)
+        encoded += _pack_bitmap(present)
+        values = [value for value in values if value is not None]
+    if column_type == columnar.TIMESTAMP:
+        _encode_delta_of_delta(values, encoded)
+    elif column_type == columnar.FLOAT64:
+        _encode_xor(values, encoded)
+    else:
+        _encode_delta(values, encoded)
+    return encoded
+
+
+def _decode_column(column_type, data, row_count):
+    pos = 1
+    if data[0]:
+        present = _unpack_bitmap(data, pos, row_count)
+        pos += (row_count + 7) // 8
+    else:
+        present = [True] * row_count
+    value_count = sum(present)
+    if column_type == columnar.TIMESTAMP:
+        values = _decode_delta_of_delta(data, pos, value_count)
+    elif column_type == columnar.FLOAT64:
+        values = _decode_xor(data, pos, value_count)
+    else:
+        values = _decode_delta(data, pos, value_count)
+    values = iter(values)
+    return [next(values) if is_present else None for is_present in present]
+
+
+def _pack_bitmap(bits):
+    packed = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        if bit:
+            packed[i // 8] |= 1 << (i % 8)
+    return packed
+
+
+def _unpack_bitmap(data, pos, count):
+    return [bool(data[pos + i // 8] & (1 << (i % 8))) for i in xrange(count)]
+
+
+def _encode_delta_of_delta(values, encoded):
+    previous = 0
+    previous_delta = 0
+    for value in values:
+        delta = value - previous
+        _write_varint(_zigzag(delta - previous_delta), encoded)
+        previous = value
+        previous_delta = delta
+
+
+def _decode_delta_of_delta(data, pos, count):
+    values = []
+    previous = 0
+    delta = 0
+    for _ in xrange(count):
+        delta_of_delta, pos = _read_varint(data, pos)
+        delta += _unzigzag(delta_of_delta)
+        previous += delta
+        values.append(previous)
+    return values
+
+
+def _encode_delta(values, encoded):
+    previous = 0
+    for value in values:
+        _write_varint(_zigzag(value - previous), encoded)
+        previous = value
+
+
+def _decode_delta(data, pos, count):
+    values = []
+    previous = 0
+    for _ in xrange(count):
+        delta, pos = _read_varint(data, pos)
+        previous += _unzigzag(delta)
+        values.append(previous)
+    return values
+
+
+def _encode_xor(values, encoded):
+    previous_bits = 0
+    for value in values:
+        bits = _FLOAT_BITS.unpack(_FLOAT.pack(value))[0]
+        xor = bits ^ previous_bits
+        if xor == 0:
+            encoded.append(_XOR_SAME_VALUE)
+        else:
+            trailing_zeros = (xor & -xor).bit_length() - 1
+            encoded.append(trailing_zeros)
+            _write_varint(xor >> trailing_zeros, encoded)
+        previous_bits = bits
+
+
+def _decode_xor(data, pos, count):
+    values = []
+    bits = 0
+    for _ in xrange(count):
+        trailing_zeros = data[pos]
+        pos += 1
+        if trailing_zeros != _XOR_SAME_VALUE:
+            xor, pos = _read_varint(data, pos)
+            bits ^= xor << trailing_zeros
+        values.append(_FLOAT.unpack(_FLOAT_BITS.pack(bits))[0])
+    return values
+
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def _unzigzag(n):
+    return n >> 1 if not n & 1 else -((n + 1) >> 1)
+
+
+def _write_varint(n, encoded):
+    while n >= 0x80:
+        encoded.append((n & 0x7f) | 0x80)
+        n >>= 7
+    encoded.append(n)
+
+
+def _read_varint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO)
+    row_count = convert_csv(args.input_file, args.output_file, args.block_rows)
+    logger.info('Converted %d rows (%d bytes of CSV to %d bytes)', row_count,
+                os.path.getsize(args.input_file),
+                os.path.getsize(args.output_file))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Sia Metrics Collector CSV Converter',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-i',
+        '--input_file',
+        required=True,
+        help='Path to metrics CSV file to convert')
+    parser.add_argument(
+        '-o',
+        '--output_file',
+        required=True,
+        help='Path to compressed file to append the rows to')
+    parser.add_argument(
+        '--block_rows',
+        type=int,
+        default=DEFAULT_BLOCK_ROWS,
+        help='Number of rows in each block')
+    main(parser.parse_args())
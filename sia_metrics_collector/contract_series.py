@@ -0,0 +1,226 @@
+"""Records a time series of every Sia contract's fields to a CSV file.
+
+Writing every contract on every poll would take far more space than the
+summed metrics, so the series is delta encoded. Each poll writes a row only
+for contracts that were added, changed, or removed since the previous poll,
+and a changed row holds only the fields that changed. Every so often, a poll
+instead writes a snapshot: a full row for every contract. A reader can start
+at any snapshot and apply the rows after it to recover every contract's
+fields at a later time.
+
+The optional index file (metrics.csv.idx for metrics.csv) uses the same
+format as csv_index, with one entry for the first row of each snapshot.
+"""
+
+import csv
+import io
+import os
+
+import csv_index
+
+# Kinds of rows, as written to the event column.
+SNAPSHOT = 'snapshot'
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+# Contract fields recorded in the series, as CSV column names and the key of
+# each in the /renter/contracts response.
+FIELDS = (
+    ('host', u'netaddress'),
+    ('size', u'size'),
+    ('total_cost', u'totalcost'),
+    ('fees', u'fees'),
+    ('storage_spending', u'StorageSpending'),
+    ('upload_spending', u'uploadspending'),
+    ('download_spending', u'downloadspending'),
+    ('renter_funds', u'renterfunds'),
+)
+
+COLUMNS = ('timestamp', 'contract_id', 'event') + tuple(
+    name for name, _ in FIELDS)
+
+# Default number of polls between snapshots.
+DEFAULT_SNAPSHOT_INTERVAL = 60
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class ContractSeriesWriter(object):
+    """Appends changes to each contract's fields to a CSV file."""
+
+    def __init__(self,
+                 csv_file,
+                 snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 index_writer=None):
+        """Creates a new ContractSeriesWriter instance.
+
+        The first poll written is always a snapshot, as the writer doesn't
+        know the contracts that an earlier process last wrote.
+
+        Args:
+            csv_file: Output file to write CSV to, opened as for
+                serialize.CsvSerializer. If the file is empty, the writer
+                writes a header row.
+            snapshot_interval: Number of polls between snapshots.
+            index_writer: A csv_index.IndexWriter with an interval of 1 to
+                record the offset of each snapshot in, or None to skip
+                indexing.
+        """
+        csv_file.seek(0, os.SEEK_END)
+        self._csv_file = csv_file
+        self._snapshot_interval = snapshot_interval
+        self._index_writer = index_writer
+        self._buffer = io.BytesIO()
+        self._csv_writer = csv.writer(self._buffer, lineterminator='\n')
+        if csv_file.tell() == 0:
+            self._csv_writer.writerow(COLUMNS)
+            self.flush()
+        # Dict of contract id to tuple of its field values as last written.
+        self._last_values = {}
+        self._polls_since_snapshot = snapshot_interval
+
+    def write_contracts(self, timestamp, contracts):
+        """Writes the changes to contracts since the last call.
+
+        Args:
+            timestamp: Time (as a datetime) at which the contracts were
+                queried.
+            contracts: An iterable of contracts, as returned by the
+                /renter/contracts API.
+        """
+        timestamp = timestamp.strftime(_TIMESTAMP_FORMAT)
+        is_snapshot = self._polls_since_snapshot >= self._snapshot_interval
+        if is_snapshot:
+            if self._index_writer:
+                self._index_writer.add_row(
+                    timestamp,
+                    self._csv_file.tell() + self._buffer.tell())
+            self._polls_since_snapshot = 0
+        self._polls_since_snapshot += 1
+        last_values = self._last_values
+        values_by_id = {}
+        for contract in contracts:
+            contract_id = contract[u'id']
+            values = _contract_values(contract)
+            values_by_id[contract_id] = values
+            old_values = last_values.get(contract_id)
+            if is_snapshot:
+                self._write_row(timestamp, contract_id, SNAPSHOT, values)
+            elif old_values is None:
+                self._write_row(timestamp, contract_id, ADDED, values)
+            elif old_values != values:
+                self._write_row(timestamp, contract_id, CHANGED,
+                                _changed_values(old_values, values))
+        if not is_snapshot:
+            for contract_id in last_values:
+                if contract_id not in values_by_id:
+                    self._write_row(timestamp, contract_id, REMOVED,
+                                    (None,) * len(FIELDS))
+        self._last_values = values_by_id
+        self.flush()
+
+    def flush(self):
+        buffered = self._buffer.getvalue()
+        if buffered:
+            self._csv_file.write(buffered)
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        self._csv_file.flush()
+        if self._index_writer:
+            self._index_writer.flush()
+
+    def close(self):
+        """Flushes and closes the CSV file and the index writer."""
+        self.flush()
+        if self._index_writer:
+            self._index_writer.close()
+        self._csv_file.close()
+
+    def _write_row(self, timestamp, contract_id, event, values):
+        self._csv_writer.writerow((timestamp, contract_id, event) + values)
+
+
+def _contract_values(contract):
+    return tuple(_format_value(contract.get(key)) for _, key in FIELDS)
+
+
+def _format_value(value):
+    if value is None:
+        return None
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _changed_values(old_values, values):
+    return tuple(
+        None if old == new else new for old, new in zip(old_values, values))
+
+
+def contracts_at(csv_path, timestamp):
+    """Recovers the fields of every contract at a point in time.
+
+    Uses the series' snapshot index, if there is one, to start reading at
+    the last snapshot before the given time.
+
+    Args:
+        csv_path: Path to a CSV file written by ContractSeriesWriter.
+        timestamp: Time (as a datetime) of interest.
+
+    Returns:
+        A dict of contract id to a dict of field name to value, as strings,
+        for every contract in the most recent poll at or before timestamp.
+    """
+    end = timestamp.strftime(_TIMESTAMP_FORMAT)
+    contracts = {}
+    snapshot_timestamp = None
+    with open(csv_path, 'rb') as csv_file:
+        data_offset = len(csv_file.readline())
+        csv_file.seek(_snapshot_offset(csv_file, csv_path, end, data_offset))
+        for line in csv_file:
+            if not line.endswith('\n'):
+                # The writer is partway through writing this row.
+                break
+            row = next(csv.reader([line]))
+            row_timestamp, contract_id, event = row[:3]
+            if row_timestamp > end:
+                break
+            values = row[3:]
+            if event == SNAPSHOT:
+                if row_timestamp != snapshot_timestamp:
+                    contracts = {}
+                    snapshot_timestamp = row_timestamp
+                contracts[contract_id] = values
+            elif event == ADDED:
+                contracts[contract_id] = values
+            elif event == CHANGED:
+                # Fields that didn't change are written as empty values.
+                changed_values = [value if value else None for value in values]
+                contracts[contract_id] = [
+                    old if new is None else new
+                    for old, new in zip(contracts[contract_id], changed_values)
+                ]
+            elif event == REMOVED:
+                del contracts[contract_id]
+    return {
+        contract_id: dict(zip((name for name, _ in FIELDS), values))
+        for contract_id, values in contracts.iteritems()
+    }
+
+
+def _snapshot_offset(csv_file, csv_path, end, data_offset):
+    """Returns the offset of the last indexed snapshot before end."""
+    index_path = csv_index.index_path(csv_path)
+    if not os.path.exists(index_path):
+        return data_offset
+    entries = csv_index.read_entries(index_path)
+    if not entries:
+        return data_offset
+    offset = csv_index.Index(entries, data_offset).seek_offset(end)
+    # Fall back to reading from the start if the index doesn't match.
+    csv_file.seek(offset)
+    line = csv_file.readline()
+    if not line.endswith('\n') or next(csv.reader([line]))[2] != SNAPSHOT:
+        return data_offset
+    return offset
@@ -0,0 +1,217 @@
+"""Maintains a sparse timestamp index over a metrics CSV file.
+
+The index is a sidecar file next to the CSV file (metrics.csv.idx for
+metrics.csv). Every line holds the timestamp of a row and the byte offset at
+which that row starts, for one row out of every N, so a reader can seek close
+to a given time instead of scanning the CSV file from the start.
+
+This relies on rows being appended in timestamp order, which is how
+CsvSerializer writes them.
+"""
+
+import bisect
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+_INDEX_FILE_EXTENSION = '.idx'
+
+# Default number of rows between index entries.
+DEFAULT_INTERVAL = 1000
+
+# Number of characters in a timestamp written by CsvSerializer.
+_TIMESTAMP_LENGTH = len('2018-02-11T16:05:02')
+
+
+def index_path(csv_path):
+    """Returns the path of the index file for the given CSV file."""
+    return csv_path + _INDEX_FILE_EXTENSION
+
+
+class Index(object):
+    """A sparse, in-memory index of row timestamps to byte offsets."""
+
+    def __init__(self, entries, data_offset):
+        """Creates a new Index instance.
+
+        Args:
+            entries: A list of (timestamp, offset) pairs in file order, where
+                timestamp is the timestamp string of a row and offset is the
+                byte offset at which the row starts.
+            data_offset: Byte offset of the first row after the header.
+        """
+        self._timestamps = [timestamp for timestamp, _ in entries]
+        self._offsets = [offset for _, offset in entries]
+        self._data_offset = data_offset
+
+    def seek_offset(self, start):
+        """Returns an offset from which to scan for rows at or after start.
+
+        Args:
+            start: Timestamp string of the earliest row of interest.
+
+        Returns:
+            Byte offset of an indexed row that precedes every row with a
+            timestamp at or after start.
+        """
+        i = bisect.bisect_left(self._timestamps, start)
+        if i == 0:
+            return self._data_offset
+        return self._offsets[i - 1]
+
+
+class IndexWriter(object):
+    """Appends entries to an index file as rows are added to its CSV file."""
+
+    def __init__(self, index_file, interval):
+        """Creates a new IndexWriter instance.
+
+        Args:
+            index_file: File object open for appending to the index file.
+            interval: Number of rows between index entries.
+        """
+        self._index_file = index_file
+        self._interval = interval
+        # Index the first row written so that appending to a file that was
+        # written by an earlier process starts a new indexed run.
+        self._rows_since_entry = interval
+        self._pending_entries = []
+
+    def add_row(self, timestamp, offset):
+        """Records a row that was added to the CSV file.
+
+        Args:
+            timestamp: Timestamp string of the row.
+            offset: Byte offset at which the row starts in the CSV file.
+        """
+        if self._rows_since_entry >= self._interval:
+            self._pending_entries.append('%s %d\n' % (timestamp, offset))
+            self._rows_since_entry = 0
+        self._rows_since_entry += 1
+
+    def flush(self):
+        """Writes pending entries to the index file.
+
+        Call this only after the rows they point to have been flushed to the
+        CSV file, so that the index never refers to rows that aren't there.
+        """
+        if self._pending_entries:
+            self._index_file.write(''.join(self._pending_entries))
+            self._pending_entries = []
+        self._index_file.flush()
+
+    def close(self):
+        self.flush()
+        self._index_file.close()
+
+
+def open_writer(csv_path, interval):
+    """Opens an IndexWriter for a CSV file, rebuilding its index if needed.
+
+    Args:
+        csv_path: Path to the CSV file.
+        interval: Number of rows between index entries.
+
+    Returns:
+        An IndexWriter that appends to the CSV file's index.
+    """
+    load(csv_path, interval)
+    return IndexWriter(open(index_path(csv_path), 'a'), interval)
+
+
+def load(csv_path, interval):
+    """Loads the index for a CSV file, rebuilding it if missing or stale.
+
+    Args:
+        csv_path: Path to the CSV file.
+        interval: Number of rows between index entries if the index has to be
+            rebuilt.
+
+    Returns:
+        An Index for the CSV file.
+    """
+    with open(csv_path, 'rb') as csv_file:
+        data_offset = len(csv_file.readline())
+        entries = None
+        if os.path.exists(index_path(csv_path)):
+            entries = read_entries(index_path(csv_path))
+            if not _is_valid(entries, csv_file, data_offset):
+                logger.info('Index for %s is stale, rebuilding', csv_path)
+                entries = None
+        if entries is None:
+            entries = _build_entries(csv_file, data_offset, interval)
+            try:
+                _write_entries(index_path(csv_path), entries)
+            except (IOError, OSError) as e:
+                logger.warning('Failed to save index for %s: %s', csv_path, e)
+    return Index(entries, data_offset)
+
+
+def read_entries(path):
+    """Reads the entries of an index file.
+
+    Args:
+        path: Path to the index file.
+
+    Returns:
+        A list of (timestamp, offset) pairs in file order, or None if the
+        file is corrupt or its last entry is only partially written.
+    """
+    entries = []
+    with open(path) as index_file:
+        for line in index_file:
+            try:
+                timestamp, offset = line.split()
+                entries.append((timestamp, int(offset)))
+            except ValueError:
+                # A partially written final line, or a corrupt file.
+                return None
+    return entries
+
+
+def _is_valid(entries, csv_file, data_offset):
+    """Returns whether every entry points at the start of its row.
+
+    Checking only some entries would miss a CSV file whose rows were
+    rewritten in between, so this reads a few bytes at each entry, which is
+    cheap next to rebuilding the index.
+    """
+    if entries is None:
+        return False
+    csv_file.seek(0, os.SEEK_END)
+    file_size = csv_file.tell()
+    if not entries:
+        return file_size <= data_offset
+    previous_offset = data_offset - 1
+    for timestamp, offset in entries:
+        if offset <= previous_offset or offset >= file_size:
+            return False
+        # Read the end of the previous row too, to check that the entry
+        # points at the start of a row.
+        csv_file.seek(offset - 1)
+        if csv_file.read(1 + _TIMESTAMP_LENGTH) != '\n' + timestamp:
+            return False
+        previous_offset = offset
+    return True
+
+
+def _build_entries(csv_file, data_offset, interval):
+    entries = []
+    csv_file.seek(data_offset)
+    offset = data_offset
+    row_number = 0
+    for line in csv_file:
+        if row_number % interval == 0:
+            entries.append((line[:_TIMESTAMP_LENGTH], offset))
+        offset += len(line)
+        row_number += 1
+    return entries
+
+
+def _write_entries(path, entries):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as index_file:
+        for timestamp, offset in entries:
+            index_file.write('%s %d\n' % (timestamp, offset))
+    os.rename(temp_path, path)
@@ -0,0 +1,251 @@
+"""Polls a fleet of Sia nodes from a single process."""
+
+import json
+import logging
+import os
+import Queue
+import threading
+
+import recordtype
+
+import csv_index
+import serialize
+import sqlite_store
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_HOSTNAME = 'http://localhost'
+_DEFAULT_PORT = 9980
+"""Represents a single Sia node in the fleet.
+
+Fields:
+    name: Unique name of the node, used to name its output file.
+    hostname: Hostname of the Sia node to poll for metrics.
+    port: Siad API port of the Sia node.
+"""
+Node = recordtype.recordtype('Node', ['name', 'hostname', 'port'])
+
+
+def load_config(config_file):
+    """Parses a fleet config file.
+
+    The config file is a JSON list of nodes, for example:
+
+        [
+          {"name": "renter-1", "hostname": "http://10.0.0.5", "port": 9980},
+          {"name": "renter-2", "hostname": "http://10.0.0.6"}
+        ]
+
+    Args:
+        config_file: File object containing the fleet config.
+
+    Returns:
+        A list of Node instances, in the order they appear in the config.
+
+    Raises:
+        ValueError: If the config is malformed or has duplicate node names.
+    """
+    entries = json.load(config_file)
+    if not isinstance(entries, list):
+        raise ValueError('Fleet config must be a list of nodes')
+    nodes = []
+    names = set()
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get('name'):
+            raise ValueError('Every node in fleet config needs a name: %s' %
+                             json.dumps(entry))
+        name = entry['name']
+        if name in names:
+            raise ValueError('Duplicate node name in fleet config: %s' % name)
+        names.add(name)
+        nodes.append(
+            Node(
+                name=name,
+                hostname=entry.get('hostname', _DEFAULT_HOSTNAME),
+                port=int(entry.get('port', _DEFAULT_PORT))))
+    return nodes
+
+
+class NodePoller(object):
+    """Polls a single Sia node and writes its state to a serializer."""
+
+    def __init__(self, name, builder, serializer, exporter=None):
+        """Creates a new NodePoller instance.
+
+        Args:
+            name: Name of the Sia node.
+            builder: state.Builder for the Sia node.
+            serializer: Serializer to write each SiaState to.
+            exporter: Optional metrics_server.Exporter to record each
+                SiaState to.
+        """
+        self.name = name
+        self._builder = builder
+        self._serializer = serializer
+        self._exporter = exporter
+
+    def poll(self):
+        state = self._builder.build()
+        self._serializer.write_state(state)
+        if self._exporter:
+            self._exporter.write_state(state, node=self.name)
+
+
+class Poller(object):
+    """Polls a set of Sia nodes concurrently on a fixed pool of threads.
+
+    A node whose previous poll is still running when the next poll is due is
+    skipped for that round so that a slow node can't tie up every worker.
+    """
+
+    def __init__(self, node_pollers, worker_count):
+        """Creates a new Poller instance and starts its worker threads.
+
+        Args:
+            node_pollers: A list of NodePoller instances, one per node.
+            worker_count: Number of worker threads to poll nodes with.
+        """
+        self._node_pollers = node_pollers
+        self._queue = Queue.Queue()
+        self._busy_names = set()
+        self._busy_lock = threading.Lock()
+        self._workers = []
+        for _ in range(worker_count):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def poll(self):
+        """Schedules a poll of every node that is not still being polled.
+
+        Returns:
+            The number of nodes that were skipped because their previous
+            poll had not yet finished.
+        """
+        skipped_names = []
+        for node_poller in self._node_pollers:
+            with self._busy_lock:
+                if node_poller.name in self._busy_names:
+                    skipped_names.append(node_poller.name)
+                    continue
+                self._busy_names.add(node_poller.name)
+            self._queue.put(node_poller)
+        if skipped_names:
+            logger.warning('Skipped %d nodes still busy with last poll: %s',
+                           len(skipped_names), ', '.join(skipped_names))
+        return len(skipped_names)
+
+    def wait_until_idle(self):
+        """Blocks until every scheduled poll has finished."""
+        self._queue.join()
+
+    def stop(self):
+        """Waits for scheduled polls to finish, then stops the workers."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _work(self):
+        while True:
+            node_poller = self._queue.get()
+            if node_poller is None:
+                self._queue.task_done()
+                return
+            try:
+                node_poller.poll()
+            except Exception as e:
+                logger.error('Failed to poll node %s: %s', node_poller.name,
+                             e.message)
+            finally:
+                with self._busy_lock:
+                    self._busy_names.discard(node_poller.name)
+                self._queue.task_done()
+
+
+def poll_forever(
+        nodes,
+        output_dir,
+        poll_scheduler,
+        worker_count,
+        make_builder,
+        flush_policy,
+        index_interval,
+        exporter=None,
+        sqlite_path=None,
+        fieldnames=None,
+        sqlite_rows_per_transaction=sqlite_store.DEFAULT_ROWS_PER_TRANSACTION):
+    """Polls every node in the fleet, writing one CSV file per node.
+
+    Args:
+        nodes: A list of Node instances to poll.
+        output_dir: Directory in which to write each node's CSV file, named
+            after the node.
+        poll_scheduler: scheduler.Scheduler that decides when to poll.
+        worker_count: Number of nodes to poll at once.
+        make_builder: A function that takes a node's hostname and port and
+            returns a state.Builder for it.
+        flush_policy: serialize.FlushPolicy for each node's CSV file.
+        index_interval: Number of rows between entries in each node's CSV
+            index, or 0 to skip indexing.
+        exporter: Optional metrics_server.Exporter to record each node's
+            metrics to, labelled with the node's name.
+        sqlite_path: Path to a SQLite database to write every node's metrics
+            to, in place of CSV files, or None to write CSV files.
+        fieldnames: Columns to write to each new CSV file, as returned by
+            serialize.select_fieldnames, or None for the columns that are
+            always written.
+        sqlite_rows_per_transaction: Number of rows, from any node, to
+            insert into the SQLite database in each transaction.
+    """
+    csv_files = []
+    csv_serializers = []
+    index_writers = []
+    sqlite_serializer = None
+    try:
+        if sqlite_path:
+            # Every node writes through one connection, so that nodes polled
+            # at once share transactions rather than contend for the
+            # database's write lock.
+            sqlite_serializer = sqlite_store.SqliteSerializer(
+                sqlite_path, rows_per_transaction=sqlite_rows_per_transaction)
+        node_pollers = []
+        for node in nodes:
+            if sqlite_serializer:
+                node_pollers.append(
+                    NodePoller(node.name, make_builder(node.hostname,
+                                                       node.port),
+                               sqlite_serializer.for_node(node.name), exporter))
+                continue
+            csv_path = os.path.join(output_dir, node.name + '.csv')
+            csv_file = serialize.open_output_file(csv_path)
+            csv_files.append(csv_file)
+            csv_serializer = serialize.CsvSerializer(
+                csv_file, flush_policy, fieldnames=fieldnames)
+            csv_serializers.append(csv_serializer)
+            if index_interval:
+                csv_serializer.index_writer = csv_index.open_writer(
+                    csv_path, index_interval)
+                index_writers.append(csv_serializer.index_writer)
+            node_pollers.append(
+                NodePoller(node.name, make_builder(node.hostname, node.port),
+                           csv_serializer, exporter))
+        poller = Poller(node_pollers, worker_count)
+        logger.info('Polling %d nodes with %d workers', len(nodes),
+                    worker_count)
+        try:
+            for _ in xrange(1000000000):
+                poll_scheduler.wait()
+                poller.poll()
+        finally:
+            poller.stop()
+    finally:
+        if sqlite_serializer:
+            sqlite_serializer.close()
+        for csv_serializer in csv_serializers:
+            csv_serializer.flush()
+        for index_writer in index_writers:
+            index_writer.close()
+        for csv_file in csv_files:
+            csv_file.close()
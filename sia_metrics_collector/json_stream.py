@@ -0,0 +1,79 @@
+"""Parses large JSON documents incrementally."""
+
+import json
+import re
+
+# Once this many bytes of the buffer have been consumed, discard them so that
+# the buffer stays bounded no matter how long the array is.
+_MAX_CONSUMED_BYTES = 64 * 1024
+
+# When searching for the array's key, how much of the previous chunk to keep in
+# case the key is split across two chunks.
+_KEY_SEARCH_OVERLAP_BYTES = 1024
+
+_WHITESPACE_AND_COMMAS = re.compile(r'[\s,]*')
+
+
+def iter_array_items(chunks, key):
+    """Yields the elements of a JSON array one at a time as chunks arrive.
+
+    Only the element currently being parsed is held in memory, so peak memory
+    is bounded by the size of the largest element rather than the size of the
+    whole document.
+
+    Note that this looks for the first occurrence of the key in the document,
+    so the key must not appear earlier as a string value, which holds for
+    Sia's API responses.
+
+    Args:
+        chunks: An iterable of strings that together make up a JSON object.
+        key: Key of the JSON object whose value is an array. A null value is
+            treated as an empty array.
+
+    Yields:
+        Each element of the array, decoded as with json.loads.
+
+    Raises:
+        ValueError: If the key is missing or the document is malformed.
+    """
+    chunks = iter(chunks)
+    decoder = json.JSONDecoder()
+    key_pattern = re.compile(r'"%s"\s*:\s*(\[|null)' % re.escape(key))
+    buf = ''
+    match = None
+    while not match:
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError('JSON document has no array named %s' % key)
+        buf += chunk
+        match = key_pattern.search(buf)
+        # Keep enough of the tail to match a key split across chunks.
+        if not match and len(buf) > _MAX_CONSUMED_BYTES:
+            buf = buf[-_KEY_SEARCH_OVERLAP_BYTES:]
+    if match.group(1) == 'null':
+        return
+    pos = match.end()
+    while True:
+        pos = _WHITESPACE_AND_COMMAS.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        decoded = False
+        if pos < len(buf):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # A number at the end of the buffer may be truncated, so only
+                # trust an element once the character after it has arrived.
+                decoded = end < len(buf)
+            except ValueError:
+                pass
+        if not decoded:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('JSON document ended inside array %s' % key)
+            if pos > _MAX_CONSUMED_BYTES:
+                buf = buf[pos:]
+                pos = 0
+            buf += chunk
+            continue
+        yield item
+        pos = end
@@ -1,14 +1,28 @@
 #!/usr/bin/python2
 
 import argparse
-import datetime
+import functools
 import logging
-import os
-import time
+import signal
+import sys
 
 import cli
+import columnar
+import compressed
+import contract_series
+import csv_index
+import fleet
+import metrics_server
+import profiling
+import recording
+import ring_buffer
+import scheduler
+import segments
 import serialize
+import sia_client
+import sqlite_store
 import state
+import writer
 
 logger = logging.getLogger(__name__)
 
@@ -27,43 +41,198 @@ def configure_logging():
 def main(args):
     configure_logging()
     logger.info('Started runnning')
-    with _open_output_file(args.output_file) as csv_file:
-        _poll_forever(args.hostname, args.port, args.poll_frequency, csv_file)
+    # Exit normally on SIGTERM (e.g. from docker stop) so that buffered
+    # metrics get flushed to disk.
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    contract_series_writer = None
+    contract_listener = None
+    if args.contract_output_file:
+        contract_series_writer = _open_contract_series(
+            args.contract_output_file, args.contract_snapshot_interval)
+        contract_listener = contract_series_writer.write_contracts
+    recorder = None
+    if args.record_dir:
+        recorder = recording.Recorder(args.record_dir)
+    profiler = None
+    if args.profile_dir:
+        profiler = profiling.Profiler(args.profile_dir,
+                                      args.profile_snapshot_interval)
+    make_builder = functools.partial(
+        state.make_builder,
+        concurrent=args.concurrent_queries,
+        stream_files=args.stream_files,
+        incremental=args.incremental,
+        intervals=_query_intervals(args),
+        api_timeout=args.api_timeout,
+        api_retries=args.api_retries,
+        contract_listener=contract_listener,
+        recorder=recorder,
+        skip_unchanged=args.skip_unchanged,
+        deadlines=_query_deadlines(args),
+        poll_budget=_poll_budget(args),
+        profiler=profiler)
+    flush_policy = serialize.FlushPolicy(
+        max_rows=args.flush_rows,
+        max_bytes=args.flush_bytes,
+        max_interval=args.flush_interval,
+        fsync=args.fsync)
+    exporter = None
+    if args.metrics_port is not None:
+        exporter = metrics_server.Exporter()
+        metrics_server.serve(exporter, args.metrics_port)
+    poll_scheduler = scheduler.Scheduler(
+        args.poll_frequency,
+        overrun_policy=args.overrun_policy,
+        jitter=args.poll_jitter)
+    if args.fleet_config:
+        with open(args.fleet_config) as config_file:
+            nodes = fleet.load_config(config_file)
+        sqlite_path = None
+        if args.output_format == 'sqlite':
+            sqlite_path = args.output_file
+        fleet.poll_forever(nodes, args.output_dir, poll_scheduler,
+                           args.fleet_workers, make_builder, flush_policy,
+                           args.index_interval, exporter, sqlite_path,
+                           _csv_fieldnames(args),
+                           args.sqlite_rows_per_transaction)
+        return
+    builder = make_builder(args.hostname, args.port)
+    if args.output_format in ('columnar', 'compressed', 'sqlite'):
+        if args.output_format == 'columnar':
+            binary_serializer = columnar.ColumnarSerializer(
+                args.output_file, args.flush_rows)
+        elif args.output_format == 'sqlite':
+            binary_serializer = sqlite_store.SqliteSerializer(
+                args.output_file, '%s:%d' % (args.hostname, args.port),
+                args.sqlite_rows_per_transaction)
+        else:
+            binary_serializer = compressed.CompressedSerializer(
+                args.output_file, args.flush_rows, fsync=args.fsync)
+        try:
+            _poll_forever(builder, poll_scheduler, binary_serializer, exporter,
+                          args, profiler, contract_series_writer)
+        finally:
+            binary_serializer.close()
+        return
+    if args.segment_max_bytes or args.segment_max_seconds:
+        segmented_serializer = segments.SegmentedSerializer(
+            args.output_file,
+            flush_policy,
+            max_segment_bytes=args.segment_max_bytes,
+            max_segment_seconds=args.segment_max_seconds,
+            fieldnames=_csv_fieldnames(args))
+        try:
+            _poll_forever(builder, poll_scheduler, segmented_serializer,
+                          exporter, args, profiler, contract_series_writer)
+        finally:
+            segmented_serializer.close()
+        return
+    with serialize.open_output_file(args.output_file) as csv_file:
+        # Check the file's header before creating an index for it.
+        csv_serializer = serialize.CsvSerializer(
+            csv_file, flush_policy, fieldnames=_csv_fieldnames(args))
+        if args.index_interval:
+            csv_serializer.index_writer = csv_index.open_writer(
+                args.output_file, args.index_interval)
+        try:
+            _poll_forever(builder, poll_scheduler, csv_serializer, exporter,
+                          args, profiler, contract_series_writer)
+        finally:
+            if csv_serializer.index_writer:
+                csv_serializer.index_writer.close()
 
 
-def _open_output_file(output_path):
-    """Opens the output file and seeks to the end.
+def _open_contract_series(csv_path, snapshot_interval):
+    csv_file = serialize.open_output_file(csv_path)
+    index_writer = csv_index.IndexWriter(
+        open(csv_index.index_path(csv_path), 'a'), 1)
+    return contract_series.ContractSeriesWriter(csv_file, snapshot_interval,
+                                                index_writer)
 
-    CsvWriter needs the mode to either be 'r+' or 'w'.
 
-    Args:
-        output_path: Path to output file to open or create.
-    """
-    if os.path.exists(output_path):
-        return open(output_path, 'r+')
-    else:
-        return open(output_path, 'w')
+def _query_intervals(args):
+    intervals = {}
+    for group in state.METRIC_GROUPS:
+        frequency = getattr(args, group + '_frequency')
+        if frequency is not None:
+            intervals[group] = frequency
+    return intervals
+
+
+def _query_deadlines(args):
+    deadlines = {}
+    for group in state.METRIC_GROUPS:
+        deadline = getattr(args, group + '_deadline')
+        if deadline is not None:
+            deadlines[group] = deadline
+    return deadlines
+
 
+def _poll_budget(args):
+    if args.poll_budget is None or args.poll_budget <= 0:
+        return None
+    return args.poll_budget
 
-def _poll_forever(sia_hostname, sia_port, frequency, csv_file):
-    builder = state.make_builder(sia_hostname, sia_port)
-    csv_serializer = serialize.CsvSerializer(csv_file)
-    next_poll_time = datetime.datetime.utcnow()
-    for i in xrange(1000000000):
-        s = builder.build()
 
-        csv_serializer.write_state(s)
-        # Print header every 100 lines.
-        if i % 100 == 0:
-            cli.print_header()
-        cli.print_state(s)
-        next_poll_time += datetime.timedelta(seconds=frequency)
-        _wait_until(next_poll_time)
+def _csv_fieldnames(args):
+    """Returns the CSV columns to write, given the features that are on."""
+    optional_fieldnames = []
+    if args.skip_unchanged:
+        optional_fieldnames.extend(serialize.CACHE_FIELDNAMES)
+    if _query_deadlines(args) or _poll_budget(args):
+        optional_fieldnames.extend(serialize.STATUS_FIELDNAMES)
+    return serialize.select_fieldnames(optional_fieldnames)
 
 
-def _wait_until(timestamp):
-    while datetime.datetime.utcnow() < timestamp:
-        time.sleep(0.5)
+def _exit_on_signal(signum, _):
+    logger.info('Received signal %d, exiting', signum)
+    # A second SIGTERM (e.g. from an impatient supervisor) would otherwise
+    # interrupt the flush of buffered metrics on the way out.
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    sys.exit(0)
+
+
+def _poll_forever(builder,
+                  poll_scheduler,
+                  serializer,
+                  exporter,
+                  args,
+                  profiler=None,
+                  contract_series_writer=None):
+    sinks = [(serializer, 'serialize')]
+    if exporter:
+        sinks.append((exporter, 'serialize'))
+    sinks.append((cli.ConsolePrinter(), 'print'))
+    ring_buffer_writer = None
+    if args.ring_buffer_file:
+        ring_buffer_writer = ring_buffer.RingBufferWriter(
+            args.ring_buffer_file, args.ring_buffer_size)
+        sinks.append((ring_buffer_writer, 'serialize'))
+    if profiler:
+        sinks = [profiler.timed_sink(sink, phase) for sink, phase in sinks]
+        sinks.append(profiler)
+    else:
+        sinks = [sink for sink, _ in sinks]
+    queued_writer = writer.QueuedWriter(sinks, args.write_queue_size,
+                                        args.write_overflow_policy)
+    try:
+        for _ in xrange(1000000000):
+            poll_scheduler.wait()
+            if profiler:
+                profiler.begin_poll()
+                s = profiler.call(builder.build)
+                profiler.end_build(s)
+            else:
+                s = builder.build()
+            queued_writer.write_state(s)
+    finally:
+        queued_writer.close()
+        if ring_buffer_writer:
+            ring_buffer_writer.close()
+        if profiler:
+            profiler.close()
+        if contract_series_writer:
+            contract_series_writer.close()
 
 
 if __name__ == '__main__':
@@ -86,9 +255,209 @@ if __name__ == '__main__':
         type=int,
         default=60,
         help='Frequency (in seconds) to poll metrics')
+    for metric_group in state.METRIC_GROUPS:
+        parser.add_argument(
+            '--%s_frequency' % metric_group,
+            type=float,
+            help=('Frequency (in seconds) to query %s metrics, if less often '
+                  'than --poll_frequency. Polls in between reuse the most '
+                  'recent values' % metric_group))
+    for metric_group in state.METRIC_GROUPS:
+        parser.add_argument(
+            '--%s_deadline' % metric_group,
+            type=float,
+            help=('Number of seconds each poll waits for the %s query before '
+                  'writing its row without %s metrics' % (metric_group,
+                                                          metric_group)))
+    parser.add_argument(
+        '--poll_budget',
+        type=float,
+        help=('Number of seconds each poll waits for all of its queries '
+              'before writing its row with the metrics it has. By default, '
+              'polls wait for as long as Sia takes'))
+    parser.add_argument(
+        '--overrun_policy',
+        choices=scheduler.OVERRUN_POLICIES,
+        default=scheduler.SKIP,
+        help=('What to do about polls that come due while a slow poll is '
+              'still running: skip them, run one poll in place of them all '
+              '(coalesce), or run them all back to back (catch_up)'))
+    parser.add_argument(
+        '--poll_jitter',
+        type=float,
+        default=0.0,
+        help=('Maximum number of seconds to delay each poll at random, to '
+              'spread out load from collectors that start together'))
+    parser.add_argument(
+        '--api_timeout',
+        type=float,
+        default=sia_client.DEFAULT_READ_TIMEOUT,
+        help='Number of seconds to wait for Sia to respond to an API call')
+    parser.add_argument(
+        '--api_retries',
+        type=int,
+        default=sia_client.DEFAULT_RETRIES,
+        help=('Number of times to retry an API call that fails to connect or '
+              'that Sia reports as temporarily unavailable'))
+    parser.add_argument(
+        '--concurrent_queries',
+        action='store_true',
+        help='Query all Sia APIs in parallel rather than one after another')
+    parser.add_argument(
+        '--stream_files',
+        action='store_true',
+        help=('Decode the list of files incrementally to keep memory flat on '
+              'renters with many files'))
+    parser.add_argument(
+        '--skip_unchanged',
+        action='store_true',
+        help=('Reuse the metrics from an API response when Sia sends the same '
+              'response again, rather than decoding and summing it'))
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help=('Update contract and file metrics from only the contracts and '
+              'files that changed since the last poll'))
+    parser.add_argument(
+        '--flush_rows',
+        type=int,
+        default=1,
+        help='Number of rows to buffer before flushing the output file')
+    parser.add_argument(
+        '--sqlite_rows_per_transaction',
+        type=int,
+        default=sqlite_store.DEFAULT_ROWS_PER_TRANSACTION,
+        help=('Number of rows to insert into the database in each '
+              'transaction, with --output_format sqlite'))
+    parser.add_argument(
+        '--flush_bytes',
+        type=int,
+        help='Number of bytes to buffer before flushing the output file')
+    parser.add_argument(
+        '--flush_interval',
+        type=float,
+        help=('Maximum number of seconds to buffer rows before flushing the '
+              'output file'))
+    parser.add_argument(
+        '--write_queue_size',
+        type=int,
+        default=writer.DEFAULT_MAX_QUEUE_SIZE,
+        help=('Number of polls to hold for writing while the output is '
+              'slow, before --write_overflow_policy applies'))
     parser.add_argument(
-        '-o',
-        '--output_file',
-        required=True,
-        help='Path to file to write metrics')
-    main(parser.parse_args())
+        '--write_overflow_policy',
+        choices=writer.OVERFLOW_POLICIES,
+        default=writer.DROP_OLDEST,
+        help=('What to do with a poll when the write queue is full: wait '
+              'for room (block), or drop the oldest or newest poll'))
+    parser.add_argument(
+        '--fsync',
+        action='store_true',
+        help='Write flushed rows through to disk before continuing')
+    parser.add_argument(
+        '-o', '--output_file', help='Path to file to write metrics')
+    parser.add_argument(
+        '--output_format',
+        choices=('csv', 'columnar', 'compressed', 'sqlite'),
+        default='csv',
+        help=('Format in which to write metrics. For columnar, --output_file '
+              'is a directory. For sqlite, --output_file is a database that '
+              'every node in --fleet_config writes to'))
+    parser.add_argument(
+        '--segment_max_bytes',
+        type=int,
+        help=('Split CSV output into segments of about this many bytes. '
+              '--output_file is then a directory of gzipped segments'))
+    parser.add_argument(
+        '--segment_max_seconds',
+        type=int,
+        help=('Split CSV output into segments that each cover this many '
+              'seconds (e.g. 86400 for one per UTC day). --output_file is '
+              'then a directory of gzipped segments'))
+    parser.add_argument(
+        '--index_interval',
+        type=int,
+        default=csv_index.DEFAULT_INTERVAL,
+        help=('Number of rows between entries in the CSV file\'s timestamp '
+              'index. Set to 0 to disable the index'))
+    parser.add_argument(
+        '--contract_output_file',
+        help=('Path to file to write a time series of each contract\'s '
+              'fields'))
+    parser.add_argument(
+        '--contract_snapshot_interval',
+        type=int,
+        default=contract_series.DEFAULT_SNAPSHOT_INTERVAL,
+        help=('Number of polls between full snapshots of every contract in '
+              '--contract_output_file'))
+    parser.add_argument(
+        '--record_dir',
+        help=('Directory in which to record every Sia API response, so that '
+              'metrics can be rebuilt later with recording.py'))
+    parser.add_argument(
+        '--ring_buffer_file',
+        help=('Path to a memory-mapped file in which to keep the most recent '
+              'polls for local readers (see ring_buffer.py)'))
+    parser.add_argument(
+        '--ring_buffer_size',
+        type=int,
+        default=ring_buffer.DEFAULT_CAPACITY,
+        help='Number of polls to keep in --ring_buffer_file')
+    parser.add_argument(
+        '--profile_dir',
+        help=('Directory in which to record how long each phase of each poll '
+              'takes, to find out where slow polls spend their time'))
+    parser.add_argument(
+        '--profile_snapshot_interval',
+        type=int,
+        default=0,
+        help=('Number of polls between cProfile and memory snapshots in '
+              '--profile_dir. Set to 0 for no snapshots'))
+    parser.add_argument(
+        '--metrics_port',
+        type=int,
+        help=('Port on which to serve the most recent metrics in Prometheus '
+              'text format at /metrics'))
+    parser.add_argument(
+        '--fleet_config',
+        help=('Path to a JSON file listing Sia nodes to poll. Overrides '
+              '--hostname and --port'))
+    parser.add_argument(
+        '--output_dir',
+        help=('Directory in which to write one metrics file per node when '
+              'using --fleet_config'))
+    parser.add_argument(
+        '--fleet_workers',
+        type=int,
+        default=32,
+        help='Number of nodes to poll at once when using --fleet_config')
+    parsed_args = parser.parse_args()
+    if parsed_args.fleet_config and parsed_args.output_format not in ('csv',
+                                                                      'sqlite'):
+        parser.error('--fleet_config only supports csv and sqlite output')
+    if (parsed_args.fleet_config and parsed_args.output_format == 'csv' and
+            not parsed_args.output_dir):
+        parser.error('--output_dir is required with --fleet_config')
+    if parsed_args.fleet_config and parsed_args.contract_output_file:
+        parser.error('--contract_output_file is not supported with '
+                     '--fleet_config')
+    if parsed_args.fleet_config and parsed_args.record_dir:
+        parser.error('--record_dir is not supported with --fleet_config')
+    if parsed_args.fleet_config and parsed_args.profile_dir:
+        parser.error('--profile_dir is not supported with --fleet_config')
+    if parsed_args.fleet_config and parsed_args.ring_buffer_file:
+        parser.error('--ring_buffer_file is not supported with --fleet_config')
+    if parsed_args.ring_buffer_size < 1:
+        parser.error('--ring_buffer_size must be at least 1')
+    if parsed_args.sqlite_rows_per_transaction < 1:
+        parser.error('--sqlite_rows_per_transaction must be at least 1')
+    if parsed_args.contract_snapshot_interval < 1:
+        parser.error('--contract_snapshot_interval must be at least 1')
+    if (parsed_args.segment_max_bytes or parsed_args.segment_max_seconds) and (
+            parsed_args.fleet_config or parsed_args.output_format != 'csv'):
+        parser.error('Segmented output requires csv output without '
+                     '--fleet_config')
+    if ((not parsed_args.fleet_config or parsed_args.output_format == 'sqlite')
+            and not parsed_args.output_file):
+        parser.error('--output_file is required')
+    main(parsed_args)
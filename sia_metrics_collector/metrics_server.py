@@ -0,0 +1,308 @@
+"""Serves the most recent Sia metrics over HTTP in Prometheus text format.
+
+The exporter holds the metrics from the most recent poll in memory, so a
+scrape never makes any calls to Sia. Polls only record their state, and the
+page is rendered on the first scrape after a poll and cached until the next
+one, so a fleet of many nodes doesn't re-render the whole page for every
+node it polls, and a slow client never delays a poll. Scrapes render from a
+copy of the metrics, so polls don't wait for a render either.
+"""
+
+import BaseHTTPServer
+import datetime
+import logging
+import SocketServer
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (in seconds) of the buckets of each latency histogram.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+_METRICS_PATH = '/metrics'
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# SiaState fields exported as gauges and the help text of each.
+_GAUGE_FIELDS = (
+    ('contract_count', 'Number of active Sia contracts.'),
+    ('total_contract_size', 'Total size (in bytes) of all Sia contracts.'),
+    ('file_count', 'Number of files known to Sia.'),
+    ('total_file_bytes', 'Total size (in bytes) of all files known to Sia.'),
+    ('uploads_in_progress_count', 'Number of uploads currently in progress.'),
+    ('uploaded_bytes', 'Total number of bytes uploaded across all files.'),
+    ('total_contract_spending',
+     'Total amount (in hastings) spent on storage contracts.'),
+    ('contract_fee_spending', 'Total amount (in hastings) spent on fees.'),
+    ('storage_spending', 'Total amount (in hastings) spent on storage.'),
+    ('upload_spending', 'Total amount (in hastings) spent on uploads.'),
+    ('download_spending', 'Total amount (in hastings) spent on downloads.'),
+    ('remaining_renter_funds',
+     'Amount (in hastings) left to spend in the renter allowance.'),
+    ('wallet_siacoin_balance', 'Wallet balance (in hastings).'),
+    ('wallet_outgoing_siacoins',
+     'Unconfirmed outgoing Siacoins (in hastings).'),
+    ('wallet_incoming_siacoins',
+     'Unconfirmed incoming Siacoins (in hastings).'),
+    ('contracts_age', 'Seconds since the contract metrics were queried.'),
+    ('files_age', 'Seconds since the file metrics were queried.'),
+    ('wallet_age', 'Seconds since the wallet metrics were queried.'),
+    ('response_cache_hits',
+     'Number of API responses in the last poll that were unchanged.'),
+    ('response_cache_misses',
+     'Number of API responses in the last poll that changed.'),
+    ('contracts_status',
+     'Outcome of the last contracts query: 0 ok, 1 failed, 2 timed out.'),
+    ('files_status',
+     'Outcome of the last files query: 0 ok, 1 failed, 2 timed out.'),
+    ('wallet_status',
+     'Outcome of the last wallet query: 0 ok, 1 failed, 2 timed out.'),
+    ('write_queue_depth', 'Number of polls waiting to be written.'),
+    ('dropped_state_count',
+     'Number of polls dropped because the write queue was full.'),
+)
+
+# SiaState latency fields (in milliseconds) and the API endpoint of each.
+_ENDPOINT_LATENCY_FIELDS = (
+    ('contracts_api_latency', '/renter/contracts'),
+    ('files_api_latency', '/renter/files'),
+    ('wallet_api_latency', '/wallet'),
+)
+
+
+class Histogram(object):
+    """A cumulative histogram of observed values, as Prometheus expects."""
+
+    def __init__(self, buckets):
+        """Creates a new Histogram instance.
+
+        Args:
+            buckets: Sorted upper bounds of each bucket. An implicit +Inf
+                bucket follows the last one.
+        """
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper_bound in enumerate(self._buckets):
+            if value <= upper_bound:
+                self._counts[i] += 1
+                break
+        else:
+            self._counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+    def copy(self):
+        """Returns a new Histogram with the same counts."""
+        histogram = Histogram(self._buckets)
+        histogram._counts = list(self._counts)
+        histogram.total = self.total
+        histogram.count = self.count
+        return histogram
+
+    def cumulative_counts(self):
+        """Returns (upper bound, count) pairs with counts of each bucket.
+
+        Each count includes the values of every lower bucket. The final
+        upper bound is '+Inf'.
+        """
+        pairs = []
+        count = 0
+        for upper_bound, bucket_count in zip(
+                list(self._buckets) + ['+Inf'], self._counts):
+            count += bucket_count
+            pairs.append((upper_bound, count))
+        return pairs
+
+
+class Exporter(object):
+    """Keeps the latest metrics of each Sia node and renders them for scrapes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Dict of node name (or None for an unnamed node) to latest SiaState.
+        self._states = {}
+        # Dicts of (node name, endpoint) or node name to Histogram.
+        self._endpoint_latencies = {}
+        self._poll_durations = {}
+        # Rendered metrics page, or None if a state was recorded since the
+        # page was last rendered.
+        self._page = ''
+        # Number of states recorded, so that a page rendered from metrics
+        # that have since changed isn't cached.
+        self._version = 0
+
+    def write_state(self, state, node=None):
+        """Records a new SiaState for the next render of the metrics page.
+
+        Args:
+            state: The SiaState from the most recent poll.
+            node: Name of the Sia node the state came from, or None when
+                polling a single node.
+        """
+        with self._lock:
+            self._states[node] = state
+            for field, endpoint in _ENDPOINT_LATENCY_FIELDS:
+                latency = getattr(state, field)
+                if latency is not None:
+                    self._endpoint_latencies.setdefault(
+                        (node, endpoint), Histogram(LATENCY_BUCKETS)).observe(
+                            latency / 1000.0)
+            if state.api_latency is not None:
+                self._poll_durations.setdefault(
+                    node, Histogram(LATENCY_BUCKETS)).observe(
+                        state.api_latency / 1000.0)
+            self._page = None
+            self._version += 1
+
+    def page(self):
+        """Returns the metrics page in Prometheus text format."""
+        with self._lock:
+            if self._page is not None:
+                return self._page
+            version = self._version
+            # States aren't changed once recorded, but histograms are, so
+            # copy those.
+            states = dict(self._states)
+            endpoint_latencies = {
+                key: histogram.copy()
+                for key, histogram in self._endpoint_latencies.iteritems()
+            }
+            poll_durations = {
+                node: histogram.copy()
+                for node, histogram in self._poll_durations.iteritems()
+            }
+        page = self._render(states, endpoint_latencies, poll_durations)
+        with self._lock:
+            if self._version == version:
+                self._page = page
+        return page
+
+    def _render(self, states, endpoint_latencies, poll_durations):
+        lines = []
+        nodes = sorted(states)
+        for field, help_text in _GAUGE_FIELDS:
+            _append_metadata(lines, 'sia_' + field, 'gauge', help_text)
+            for node in nodes:
+                _append_sample(lines, 'sia_' + field, _node_labels(node),
+                               getattr(states[node], field))
+        _append_metadata(lines, 'sia_last_poll_timestamp_seconds', 'gauge',
+                         'Time of the most recent poll, in Unix time.')
+        for node in nodes:
+            _append_sample(lines, 'sia_last_poll_timestamp_seconds',
+                           _node_labels(node), _unix_time(
+                               states[node].timestamp))
+        _append_metadata(lines, 'sia_api_latency_seconds', 'histogram',
+                         'Time Sia took to respond to each API call.')
+        for (node,
+             endpoint), histogram in sorted(endpoint_latencies.iteritems()):
+            _append_histogram(lines, 'sia_api_latency_seconds',
+                              _node_labels(node) + [('endpoint', endpoint)],
+                              histogram)
+        _append_metadata(lines, 'sia_poll_duration_seconds', 'histogram',
+                         'Time taken to query every Sia API in a poll.')
+        for node, histogram in sorted(poll_durations.iteritems()):
+            _append_histogram(lines, 'sia_poll_duration_seconds',
+                              _node_labels(node), histogram)
+        return ''.join(lines)
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _make_handler(exporter):
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != _METRICS_PATH:
+                self.send_error(404)
+                return
+            body = exporter.page()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format_string, *args):
+            logger.debug('%s %s', self.address_string(), format_string % args)
+
+    return Handler
+
+
+def serve(exporter, port, host=''):
+    """Serves an exporter's metrics page on a background thread.
+
+    Args:
+        exporter: The Exporter to serve.
+        port: Port on which to listen. Pass 0 to pick any free port.
+        host: Address on which to listen. Defaults to every address.
+
+    Returns:
+        The running HTTP server. Its server_address attribute holds the
+        address it listens on, and its shutdown method stops it.
+    """
+    server = _ThreadingHTTPServer((host, port), _make_handler(exporter))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info('Serving metrics at http://%s:%d%s', host or '0.0.0.0',
+                server.server_address[1], _METRICS_PATH)
+    return server
+
+
+def _node_labels(node):
+    if node is None:
+        return []
+    return [('node', node)]
+
+
+def _unix_time(timestamp):
+    if timestamp is None:
+        return None
+    return (timestamp - _EPOCH).total_seconds()
+
+
+def _append_metadata(lines, name, metric_type, help_text):
+    lines.append('# HELP %s %s\n' % (name, help_text))
+    lines.append('# TYPE %s %s\n' % (name, metric_type))
+
+
+def _append_sample(lines, name, labels, value):
+    if value is None:
+        return
+    lines.append('%s%s %s\n' % (name, _format_labels(labels),
+                                _format_value(value)))
+
+
+def _append_histogram(lines, name, labels, histogram):
+    for upper_bound, count in histogram.cumulative_counts():
+        _append_sample(lines, name + '_bucket',
+                       labels + [('le', _format_value(upper_bound))], count)
+    _append_sample(lines, name + '_sum', labels, histogram.total)
+    _append_sample(lines, name + '_count', labels, histogram.count)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, _escape_label_value(value)) for key, value in labels)
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,313 @@
+"""Measures where the time of each poll goes.
+
+A Profiler times each poll's phases:
+
+    fetch: Waiting for Sia to send each API response.
+    decode: Decoding the JSON of each response.
+    aggregate: Summing contracts and files into metrics. With streamed
+        files, this includes fetching and decoding the files as well.
+    serialize: Writing the metrics to the output and the Prometheus
+        endpoint.
+    print: Printing the metrics to the console.
+
+Queries that run in parallel each add to their phases, so a poll's fetch,
+decode, and aggregate times may add up to more than the poll took. Threads
+that a build starts must run through bind, so that their timings go to the
+poll that started them, even if they finish after a later poll has begun.
+
+The timings of each poll are appended as a line of JSON to phases.jsonl in
+the profile directory. Every so often, the Profiler also runs cProfile over
+an entire poll and saves the stats (cprofile-<timestamp>.prof, readable with
+pstats), along with a count of live objects by type and the peak RSS
+(memory-<timestamp>.json), to help track down slow code and memory growth.
+
+Components that accept a profiler take None by default, in which case they
+skip timing entirely.
+"""
+
+import collections
+import contextlib
+import cProfile
+import gc
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+
+import recordtype
+
+PHASES = ('fetch', 'decode', 'aggregate', 'serialize', 'print')
+
+PHASES_FILENAME = 'phases.jsonl'
+
+_SNAPSHOT_TIMESTAMP_FORMAT = '%Y%m%dT%H%M%S'
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Number of object types to list in each memory snapshot.
+_MEMORY_SNAPSHOT_TYPES = 50
+"""Timings of a single poll's build, shared by every thread of the build.
+
+Fields:
+    seconds: Dict of build phase to the seconds spent in it.
+    profiles: List of cProfile profiles taken during the poll.
+    snapshotted: Whether to save a snapshot of the poll.
+"""
+_PollTimings = recordtype.recordtype('_PollTimings',
+                                     ['seconds', 'profiles', 'snapshotted'])
+
+
+class Profiler(object):
+    """Records the phase timings of each poll, with periodic snapshots.
+
+    A poll's life spans two threads: begin_poll, the build, and end_build
+    run on the polling thread, then its sinks (wrapped with timed_sink) and
+    finally the Profiler itself (as the last sink) run on the writer thread.
+    Each thread that times a build phase does so for the poll bound to it:
+    begin_poll binds a new poll to the polling thread, and bind carries it
+    over to the threads that the build starts.
+    """
+
+    def __init__(self, directory, snapshot_interval=0, clock=time.time):
+        """Creates a new Profiler, writing to the given directory.
+
+        Creates the directory if it does not exist.
+
+        Args:
+            directory: Path to the directory in which to write profiles.
+            snapshot_interval: Number of polls between cProfile and memory
+                snapshots, or 0 for no snapshots.
+            clock: A function that returns the current time in seconds.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._snapshot_interval = snapshot_interval
+        self._clock = clock
+        self._phases_file = open(os.path.join(directory, PHASES_FILENAME), 'a')
+        self._poll_count = 0
+        # Guards the seconds and profiles of each _PollTimings, which queries
+        # add to from their own threads.
+        self._lock = threading.Lock()
+        # Holds the _PollTimings bound to each thread, as its poll attribute.
+        self._local = threading.local()
+        # Threads that are running a profiled call, so that nested calls
+        # don't start a second profiler on the same thread.
+        self._profiling_threads = set()
+        # Dict of timestamp to the _PollTimings of polls that are built but
+        # not yet written.
+        self._pending_polls = {}
+        # Seconds spent in each phase while writing the current poll.
+        self._write_seconds = collections.defaultdict(float)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Adds the time spent in a with block to a phase of the poll."""
+        start = self._clock()
+        try:
+            yield
+        finally:
+            elapsed = self._clock() - start
+            if name in ('serialize', 'print'):
+                self._write_seconds[name] += elapsed
+            else:
+                poll = self._bound_poll()
+                if poll:
+                    with self._lock:
+                        poll.seconds[name] += elapsed
+
+    def begin_poll(self):
+        """Starts timing a poll. Call before building it."""
+        self._local.poll = _PollTimings(
+            seconds=collections.defaultdict(float),
+            profiles=[],
+            snapshotted=bool(self._snapshot_interval) and
+            (self._poll_count % self._snapshot_interval == 0))
+        self._poll_count += 1
+
+    def end_build(self, sia_state):
+        """Finishes timing the build of a poll. Call with the built state."""
+        poll = self._bound_poll()
+        if poll:
+            self._pending_polls[sia_state.timestamp] = poll
+        self._local.poll = None
+
+    def bind(self, fn):
+        """Returns fn, bound to time its phases as the current poll's.
+
+        Threads that the build starts must run their target through bind, or
+        their phases go untimed.
+        """
+        poll = self._bound_poll()
+
+        def bound(*args):
+            self._local.poll = poll
+            try:
+                return fn(*args)
+            finally:
+                self._local.poll = None
+
+        return bound
+
+    def call(self, fn, *args):
+        """Calls fn, under cProfile if the build is being snapshotted."""
+        poll = self._bound_poll()
+        if not poll:
+            return fn(*args)
+        return self._call(poll.snapshotted, poll.profiles, fn, *args)
+
+    def pending_poll(self, timestamp):
+        """Returns the _PollTimings of a poll built but not yet written.
+
+        Args:
+            timestamp: Timestamp of the poll's state.
+
+        Returns:
+            The poll's _PollTimings, or None if no poll with the timestamp is
+            waiting to be written.
+        """
+        return self._pending_polls.get(timestamp)
+
+    def timed_sink(self, sink, phase):
+        """Returns a sink that times each write to sink as the given phase."""
+        return _TimedSink(self, sink, phase)
+
+    def write_state(self, sia_state):
+        """Records the timings of a poll once every sink has written it.
+
+        Must be the last sink, after every sink wrapped by timed_sink.
+        """
+        for timestamp in list(self._pending_polls):
+            # Polls before this one were dropped without being written.
+            if timestamp < sia_state.timestamp:
+                del self._pending_polls[timestamp]
+        poll = self._pending_polls.pop(sia_state.timestamp, None)
+        phase_seconds = {}
+        if poll:
+            with self._lock:
+                phase_seconds.update(poll.seconds)
+        phase_seconds.update(self._write_seconds)
+        self._write_seconds = collections.defaultdict(float)
+        record = {'timestamp': sia_state.timestamp.strftime(_TIMESTAMP_FORMAT)}
+        for name in PHASES:
+            record[name + '_ms'] = phase_seconds.get(name, 0.0) * 1000.0
+        self._phases_file.write(json.dumps(record, sort_keys=True) + '\n')
+        if poll and poll.snapshotted:
+            with self._lock:
+                profiles = list(poll.profiles)
+            self._save_snapshot(sia_state.timestamp, profiles)
+
+    def flush(self):
+        self._phases_file.flush()
+
+    def close(self):
+        self._phases_file.close()
+
+    def _bound_poll(self):
+        """Returns the _PollTimings bound to this thread, or None."""
+        return getattr(self._local, 'poll', None)
+
+    def _call(self, profile, profiles, fn, *args):
+        thread = threading.current_thread()
+        if not profile or thread in self._profiling_threads:
+            return fn(*args)
+        profiler = cProfile.Profile()
+        self._profiling_threads.add(thread)
+        try:
+            return profiler.runcall(fn, *args)
+        finally:
+            self._profiling_threads.discard(thread)
+            with self._lock:
+                profiles.append(profiler)
+
+    def _save_snapshot(self, timestamp, profiles):
+        suffix = timestamp.strftime(_SNAPSHOT_TIMESTAMP_FORMAT)
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(
+                os.path.join(self._directory, 'cprofile-%s.prof' % suffix))
+        with open(
+                os.path.join(self._directory, 'memory-%s.json' % suffix),
+                'w') as memory_file:
+            json.dump(_memory_snapshot(), memory_file, indent=2, sort_keys=True)
+
+
+def bind(profiler, fn):
+    """Returns fn, bound to a Profiler's current poll for another thread.
+
+    Args:
+        profiler: A Profiler, or None to skip timing.
+        fn: The function that the thread will run.
+    """
+    if profiler is None:
+        return fn
+    return profiler.bind(fn)
+
+
+def phase(profiler, name):
+    """Returns a context manager that times a phase with a Profiler.
+
+    Args:
+        profiler: A Profiler, or None to skip timing.
+        name: Name of the phase, one of PHASES.
+    """
+    if profiler is None:
+        return _NULL_CONTEXT
+    return profiler.phase(name)
+
+
+class _NullContext(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _TimedSink(object):
+    """Times each write to a sink as a phase of the poll being written."""
+
+    def __init__(self, profiler, sink, phase):
+        self._profiler = profiler
+        self._sink = sink
+        self._phase = phase
+
+    def write_state(self, sia_state):
+        poll = self._profiler.pending_poll(sia_state.timestamp)
+        with self._profiler.phase(self._phase):
+            if poll:
+                self._profiler._call(poll.snapshotted, poll.profiles,
+                                     self._sink.write_state, sia_state)
+            else:
+                self._sink.write_state(sia_state)
+
+    def flush(self):
+        if hasattr(self._sink, 'flush'):
+            self._sink.flush()
+
+
+def _memory_snapshot():
+    """Returns the peak RSS and the most common types of live objects."""
+    type_counts = collections.Counter(
+        type(o).__name__ for o in gc.get_objects())
+    return {
+        'peak_rss_kb': _peak_rss_kb(),
+        'object_count': sum(type_counts.itervalues()),
+        'most_common_types': type_counts.most_common(_MEMORY_SNAPSHOT_TYPES),
+    }
+
+
+def _peak_rss_kb():
+    # Linux reports ru_maxrss in kilobytes, but OS X reports it in bytes.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss // 1024
+    return max_rss
@@ -0,0 +1,124 @@
+#!/usr/bin/python2
+"""Prints the rows of a metrics CSV file that fall within a time range."""
+
+import argparse
+import csv
+import datetime
+import sys
+
+import csv_index
+import segments
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+_TIMESTAMP_LENGTH = len('2018-02-11T16:05:02')
+_INPUT_TIMESTAMP_FORMATS = (_TIMESTAMP_FORMAT, '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+
+def read_header(csv_path):
+    """Returns the list of column names in a metrics CSV file."""
+    with open(csv_path, 'rb') as csv_file:
+        return next(csv.reader([csv_file.readline()]))
+
+
+def query_rows(csv_path, fields, start, end, index_interval):
+    """Yields the rows of a metrics CSV file that fall within a time range.
+
+    Uses the file's sparse index to skip straight to the first matching row,
+    rebuilding the index first if it is missing or stale.
+
+    Args:
+        csv_path: Path to a CSV file written by CsvSerializer.
+        fields: List of column names to include in each row.
+        start: Earliest timestamp (as a datetime) to include, or None to start
+            at the first row.
+        end: Timestamp (as a datetime) at which to stop, exclusive, or None to
+            continue to the last row.
+        index_interval: Number of rows between index entries if the index has
+            to be rebuilt.
+
+    Yields:
+        A list of the values of the requested fields for each matching row.
+
+    Raises:
+        ValueError: If the file has no column for one of the fields.
+    """
+    header = read_header(csv_path)
+    for field in fields:
+        if field not in header:
+            raise ValueError('%s has no column named %s' % (csv_path, field))
+    columns = [header.index(field) for field in fields]
+    start_timestamp = start.strftime(_TIMESTAMP_FORMAT) if start else None
+    end_timestamp = end.strftime(_TIMESTAMP_FORMAT) if end else None
+    index = csv_index.load(csv_path, index_interval)
+    with open(csv_path, 'rb') as csv_file:
+        csv_file.readline()
+        if start_timestamp:
+            csv_file.seek(index.seek_offset(start_timestamp))
+        for line in csv_file:
+            # Skip a final row that is still being written.
+            if not line.endswith('\n'):
+                break
+            timestamp = line[:_TIMESTAMP_LENGTH]
+            if start_timestamp and timestamp < start_timestamp:
+                continue
+            if end_timestamp and timestamp >= end_timestamp:
+                break
+            values = next(csv.reader([line]))
+            yield [values[i] for i in columns]
+
+
+def parse_timestamp(value):
+    """Parses a timestamp given on the command line."""
+    for timestamp_format in _INPUT_TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, timestamp_format)
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError('Invalid timestamp: %s' % value)
+
+
+def main(args):
+    if args.input_dir:
+        fields = args.fields.split(',') if args.fields else (
+            segments.read_header(args.input_dir))
+        rows = segments.query_rows(args.input_dir, fields, args.start, args.end)
+    else:
+        fields = args.fields.split(',') if args.fields else read_header(
+            args.input_file)
+        rows = query_rows(args.input_file, fields, args.start, args.end,
+                          args.index_interval)
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow(row)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Sia Metrics Query',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument(
+        '-i', '--input_file', help='Path to metrics CSV file to query')
+    input_group.add_argument(
+        '--input_dir',
+        help='Path to directory of metrics CSV segments to query')
+    parser.add_argument(
+        '--from',
+        dest='start',
+        type=parse_timestamp,
+        help='Earliest timestamp (UTC) of rows to print')
+    parser.add_argument(
+        '--to',
+        dest='end',
+        type=parse_timestamp,
+        help='Timestamp (UTC) before which to stop printing rows')
+    parser.add_argument(
+        '--fields',
+        help='Comma-separated list of columns to print. Defaults to all')
+    parser.add_argument(
+        '--index_interval',
+        type=int,
+        default=csv_index.DEFAULT_INTERVAL,
+        help='Number of rows between entries when rebuilding the index')
+    main(parser.parse_args())
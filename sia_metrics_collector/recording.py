@@ -0,0 +1,481 @@
+#!/usr/bin/python2
+"""Records raw Sia API responses and replays them into SiaState rows.
+
+SiaState holds only sums, so when the way metrics are computed changes, past
+metrics can't be recomputed from it. A recording keeps every API response
+instead, so replaying it through state.Builder regenerates the metrics with
+the current code.
+
+A recording is a directory holding:
+
+    polls.jsonl: One line per poll, with the poll's timestamp, the status of
+        each metric group's query, and for each API call, one of:
+            The hash of its response.
+            null, if the call failed.
+            "reused", if the poll reused the metrics of an earlier call
+                instead of making one (see the --*_frequency options).
+            "late", if the call didn't return before its deadline.
+    objects/: Each distinct response, gzipped, in a file named after the
+        SHA-256 hash of its JSON. A response that doesn't change between
+        polls (e.g. an idle wallet) is stored only once.
+
+Replay spreads polls across a pool of processes. Each replayed poll gets the
+timestamp and query statuses of the original poll, but as no API calls are
+made, its latency metrics are all zero. A poll that reused a group's metrics
+is rebuilt from the group's most recent response before it, with the group's
+age measured from that response's poll.
+"""
+
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+import serialize
+import state
+
+logger = logging.getLogger(__name__)
+
+POLLS_FILENAME = 'polls.jsonl'
+OBJECTS_DIRNAME = 'objects'
+
+# Sia API calls that a recording captures.
+CALLS = ('get_renter_contracts', 'get_renter_files', 'get_wallet')
+
+# Markers recorded in place of a response hash for calls that a poll didn't
+# make because it reused earlier metrics, or that returned too late.
+REUSED = 'reused'
+LATE = 'late'
+
+# Metric group that each Sia API call populates.
+_CALL_GROUPS = {
+    'get_renter_contracts': 'contracts',
+    'get_renter_files': 'files',
+    'get_wallet': 'wallet',
+}
+
+# Sia API call that returns the response of each API path.
+_PATH_CALLS = {
+    '/renter/contracts': 'get_renter_contracts',
+    '/renter/files': 'get_renter_files',
+    '/wallet': 'get_wallet',
+}
+
+# Default number of polls each replay task builds.
+DEFAULT_CHUNK_POLLS = 500
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class Recorder(object):
+    """Saves the Sia API responses of each poll to a recording."""
+
+    def __init__(self, directory):
+        """Creates a recorder, appending to the recording in a directory.
+
+        Creates the directory if it does not exist.
+
+        Args:
+            directory: Path to the recording's directory.
+        """
+        objects_dir = os.path.join(directory, OBJECTS_DIRNAME)
+        if not os.path.exists(objects_dir):
+            os.makedirs(objects_dir)
+        self._directory = directory
+        self._polls_file = open(os.path.join(directory, POLLS_FILENAME), 'a')
+        # Guards _poll_number and _pending_hashes, as a concurrent Builder
+        # makes API calls from several threads.
+        self._lock = threading.Lock()
+        # Number of the current poll, counting from 0, so that a call that
+        # returns after its poll was saved isn't attributed to a later poll.
+        self._poll_number = 0
+        # Dict of API call name to hash of its response in the current poll,
+        # or None if the call hasn't returned a response.
+        self._pending_hashes = {}
+
+    def wrap(self, sia_api):
+        """Returns a Sia API that records the responses of sia_api.
+
+        Args:
+            sia_api: An implementation of the Sia client API.
+        """
+        return _RecordingSiaApi(sia_api, self)
+
+    def save_poll(self, sia_state):
+        """Ends the current poll, saving its responses under its timestamp.
+
+        Args:
+            sia_state: The SiaState built from the poll's responses.
+        """
+        with self._lock:
+            hashes = self._pending_hashes
+            self._pending_hashes = {}
+            self._poll_number += 1
+        responses = {}
+        for call in CALLS:
+            group = _CALL_GROUPS[call]
+            if getattr(sia_state, group + '_status') == state.STATUS_TIMED_OUT:
+                responses[call] = LATE
+            elif call in hashes:
+                responses[call] = hashes[call]
+            else:
+                responses[call] = REUSED
+        self._polls_file.write(
+            json.dumps(
+                {
+                    'timestamp': sia_state.timestamp.strftime(_TIMESTAMP_FORMAT),
+                    'statuses': {
+                        group: getattr(sia_state, group + '_status')
+                        for group in state.METRIC_GROUPS
+                    },
+                    'responses': responses,
+                },
+                sort_keys=True) + '\n')
+        self._polls_file.flush()
+
+    def close(self):
+        self._polls_file.close()
+
+    def start_call(self, call):
+        """Notes that the current poll is making an API call.
+
+        Args:
+            call: Name of the API call, one of CALLS.
+
+        Returns:
+            The number of the current poll, to pass to record_response.
+        """
+        with self._lock:
+            self._pending_hashes[call] = None
+            return self._poll_number
+
+    def record_response(self, call, response, poll_number):
+        """Saves the response of an API call.
+
+        Args:
+            call: Name of the API call, one of CALLS.
+            response: The call's decoded response.
+            poll_number: Number of the poll that made the call, from
+                start_call. If that poll was already saved, the response is
+                dropped, as the poll recorded the call as late.
+        """
+        if not self._is_current(poll_number):
+            return
+        encoded = _encode(response)
+        response_hash = hashlib.sha256(encoded).hexdigest()
+        path = _object_path(self._directory, response_hash)
+        if not os.path.exists(path):
+            temp_path = self._temp_object_path(call)
+            object_file = gzip.open(temp_path, 'wb')
+            try:
+                object_file.write(encoded)
+            finally:
+                object_file.close()
+            os.rename(temp_path, path)
+        self._set_hash(call, response_hash, poll_number)
+
+    def record_items(self, call, key, items, poll_number):
+        """Saves a response made of a list of items as the items stream by.
+
+        The response is saved as record_response would save {key: items},
+        without holding every item in memory at once.
+
+        Args:
+            call: Name of the API call, one of CALLS.
+            key: Key of the response's list of items.
+            items: Iterable of the call's decoded items.
+            poll_number: Number of the poll that made the call, from
+                start_call.
+
+        Yields:
+            Each item of items. The response is saved once the last item has
+            been yielded; if items raises an error first, nothing is saved.
+        """
+        if not self._is_current(poll_number):
+            for item in items:
+                yield item
+            return
+        hasher = hashlib.sha256()
+        temp_path = self._temp_object_path(call)
+        object_file = gzip.open(temp_path, 'wb')
+
+        def write(chunk):
+            hasher.update(chunk)
+            object_file.write(chunk)
+
+        complete = False
+        try:
+            write('{%s:[' % _encode(key))
+            for i, item in enumerate(items):
+                if i:
+                    write(',')
+                write(_encode(item))
+                yield item
+            write(']}')
+            complete = True
+        finally:
+            object_file.close()
+            if not complete:
+                os.remove(temp_path)
+        response_hash = hasher.hexdigest()
+        path = _object_path(self._directory, response_hash)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.rename(temp_path, path)
+        self._set_hash(call, response_hash, poll_number)
+
+    def _is_current(self, poll_number):
+        """Returns whether poll_number is the number of the current poll."""
+        with self._lock:
+            return poll_number == self._poll_number
+
+    def _set_hash(self, call, response_hash, poll_number):
+        with self._lock:
+            if poll_number == self._poll_number:
+                self._pending_hashes[call] = response_hash
+
+    def _temp_object_path(self, call):
+        return os.path.join(self._directory, OBJECTS_DIRNAME, '%s.%d.tmp' %
+                            (call, threading.current_thread().ident))
+
+
+class _RecordingSiaApi(object):
+    """Passes Sia API calls through, recording each response."""
+
+    def __init__(self, sia_api, recorder):
+        self._sia_api = sia_api
+        self._recorder = recorder
+
+    def get_renter_contracts(self):
+        poll_number = self._recorder.start_call('get_renter_contracts')
+        return self._record('get_renter_contracts',
+                            self._sia_api.get_renter_contracts(), poll_number)
+
+    def get_renter_files(self):
+        poll_number = self._recorder.start_call('get_renter_files')
+        return self._record('get_renter_files',
+                            self._sia_api.get_renter_files(), poll_number)
+
+    def iter_renter_files(self):
+        poll_number = self._recorder.start_call('get_renter_files')
+        return self._recorder.record_items('get_renter_files', u'files',
+                                           self._sia_api.iter_renter_files(),
+                                           poll_number)
+
+    def get_wallet(self):
+        poll_number = self._recorder.start_call('get_wallet')
+        return self._record('get_wallet', self._sia_api.get_wallet(),
+                            poll_number)
+
+    def get_raw(self, path):
+        poll_number = self._recorder.start_call(_PATH_CALLS[path])
+        body = self._sia_api.get_raw(path)
+        try:
+            response = json.loads(body)
+        except ValueError:
+            response = None
+        self._record(_PATH_CALLS[path], response, poll_number)
+        return body
+
+    def _record(self, call, response, poll_number):
+        self._recorder.record_response(call, response, poll_number)
+        return response
+
+
+class _ReplaySiaApi(object):
+    """Answers Sia API calls with the recorded responses of one poll."""
+
+    def __init__(self, responses, late_calls):
+        self._responses = responses
+        self._late_calls = late_calls
+
+    def get_renter_contracts(self):
+        return self._response('get_renter_contracts')
+
+    def get_renter_files(self):
+        return self._response('get_renter_files')
+
+    def iter_renter_files(self):
+        return iter(self._response('get_renter_files')[u'files'] or [])
+
+    def get_wallet(self):
+        return self._response('get_wallet')
+
+    def _response(self, call):
+        if call in self._late_calls:
+            raise IOError('Call did not return in time when recorded')
+        if call not in self._responses:
+            raise IOError('Call failed when recorded')
+        return self._responses[call]
+
+
+def read_polls(directory):
+    """Reads the list of polls in a recording.
+
+    Args:
+        directory: Path to the recording's directory.
+
+    Returns:
+        A list of (timestamp, responses, statuses) tuples in the order they
+        were recorded, where timestamp is a datetime, responses is a dict of
+        API call name to the hash of its response (or None, REUSED, or LATE),
+        and statuses is a dict of metric group to the status of its query.
+    """
+    polls = []
+    with open(os.path.join(directory, POLLS_FILENAME)) as polls_file:
+        for line in polls_file:
+            if not line.endswith('\n'):
+                # The recorder is partway through writing this poll.
+                break
+            poll = json.loads(line)
+            polls.append((datetime.datetime.strptime(
+                poll['timestamp'], _TIMESTAMP_FORMAT), poll['responses'],
+                          poll.get('statuses', {})))
+    return polls
+
+
+def replay(directories,
+           serializer,
+           processes=None,
+           chunk_polls=DEFAULT_CHUNK_POLLS):
+    """Rebuilds the metrics of recordings and writes them to a serializer.
+
+    Args:
+        directories: Paths to the recordings' directories. Rows are written
+            in the order of the recordings, then in the order of the polls in
+            each recording.
+        serializer: Serializer to write each rebuilt SiaState to.
+        processes: Number of processes to build metrics with. Defaults to
+            the number of CPUs.
+        chunk_polls: Number of polls to send to a process at a time.
+
+    Returns:
+        The number of polls replayed.
+    """
+    tasks = []
+    for directory in directories:
+        polls = read_polls(directory)
+        # Dict of API call name to (hash, timestamp) of its most recent
+        # response before the chunk, for polls that reused its metrics.
+        last_responses = {}
+        for i in xrange(0, len(polls), chunk_polls):
+            chunk = polls[i:i + chunk_polls]
+            tasks.append((directory, chunk, dict(last_responses)))
+            for timestamp, responses, _ in chunk:
+                for call, response_hash in responses.iteritems():
+                    if response_hash not in (None, REUSED, LATE):
+                        last_responses[call] = (response_hash, timestamp)
+    pool = multiprocessing.Pool(processes)
+    poll_count = 0
+    try:
+        for states in pool.imap(_replay_chunk, tasks):
+            for state_fields in states:
+                serializer.write_state(state.SiaState(**state_fields))
+                poll_count += 1
+    finally:
+        pool.close()
+        pool.join()
+    return poll_count
+
+
+def _replay_chunk(task):
+    """Rebuilds the metrics of consecutive polls of a recording.
+
+    Runs in a worker process, so it returns each SiaState as a dict of its
+    fields, which unlike SiaState can be pickled.
+    """
+    directory, polls, last_responses = task
+    # Dict of API call name to (hash, decoded response) of the most recently
+    # read response, as most responses are the same as the last poll's.
+    decoded_responses = {}
+    states = []
+    for timestamp, hashes, statuses in polls:
+        responses = {}
+        late_calls = set()
+        # Dict of metric group to the age of metrics that the poll reused.
+        reused_ages = {}
+        for call, response_hash in hashes.iteritems():
+            if response_hash is None:
+                continue
+            if response_hash == LATE:
+                late_calls.add(call)
+                continue
+            if response_hash == REUSED:
+                if call not in last_responses:
+                    continue
+                response_hash, query_time = last_responses[call]
+                reused_ages[_CALL_GROUPS[call]] = (
+                    timestamp - query_time).total_seconds()
+            else:
+                last_responses[call] = (response_hash, timestamp)
+            if decoded_responses.get(call, (None,))[0] != response_hash:
+                decoded_responses[call] = (response_hash,
+                                           _read_object(directory,
+                                                        response_hash))
+            responses[call] = decoded_responses[call][1]
+        builder = state.Builder(
+            _ReplaySiaApi(responses, late_calls),
+            lambda timestamp=timestamp: timestamp)
+        s = builder.build()
+        for group, age in reused_ages.iteritems():
+            setattr(s, group + '_age', age)
+        for group, status in statuses.iteritems():
+            setattr(s, group + '_status', status)
+        states.append(s.as_dict())
+    return states
+
+
+def _object_path(directory, response_hash):
+    return os.path.join(directory, OBJECTS_DIRNAME, response_hash + '.json.gz')
+
+
+def _encode(response):
+    """Encodes a response as the JSON whose hash names its object."""
+    return json.dumps(response, sort_keys=True, separators=(',', ':'))
+
+
+def _read_object(directory, response_hash):
+    object_file = gzip.open(_object_path(directory, response_hash), 'rb')
+    try:
+        return json.load(object_file)
+    finally:
+        object_file.close()
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO)
+    with serialize.open_output_file(args.output_file) as csv_file:
+        serializer = serialize.CsvSerializer(
+            csv_file, serialize.FlushPolicy(max_rows=1000))
+        poll_count = replay(args.input_dir, serializer, args.processes)
+        serializer.flush()
+    logger.info('Replayed %d polls', poll_count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Sia Metrics Collector Replay',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-i',
+        '--input_dir',
+        action='append',
+        required=True,
+        help=('Path to a recording to replay. Repeat to replay several '
+              'recordings in order'))
+    parser.add_argument(
+        '-o',
+        '--output_file',
+        required=True,
+        help='Path to CSV file to append rebuilt metrics to')
+    parser.add_argument(
+        '--processes',
+        type=int,
+        help='Number of processes to replay with. Defaults to one per CPU')
+    main(parser.parse_args())
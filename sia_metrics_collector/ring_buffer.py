@@ -0,0 +1,267 @@
+"""Keeps the most recent SiaState rows in a memory-mapped ring buffer file.
+
+Local tools, such as an alerting sidecar, can attach to the file and read
+recent metrics without querying Sia or parsing the output file. The
+collector overwrites the oldest row once the buffer is full, so the file
+never grows.
+
+File layout (little-endian):
+
+    Header (4096 bytes):
+        magic: 8 bytes, 'SIARING1'.
+        record_size: uint32, size in bytes of each record.
+        capacity: uint32, number of records the buffer holds.
+        write_count: uint64, number of records written so far.
+        columns_length: uint32, length of the columns JSON that follows.
+        columns: JSON list of [name, type] pairs, as in columnar.COLUMNS.
+    Records (capacity * record_size bytes), where the Nth record written
+        (counting from 0) is in slot N % capacity:
+        sequence: uint64, 2 * (N + 1) once record N is complete, or an odd
+            number while it is being written.
+        One value per column, stored as in a columnar store.
+
+Readers never lock the file. Instead, each record is guarded by its
+sequence number, as in a seqlock: a reader reads the sequence number, the
+values, then the sequence number again, and discards the record if the
+writer started overwriting it in the meantime.
+"""
+
+import datetime
+import json
+import mmap
+import os
+import struct
+
+import columnar
+import state
+
+_MAGIC = 'SIARING1'
+_HEADER_SIZE = 4096
+_HEADER = struct.Struct('<8sIIQI')
+_WRITE_COUNT = struct.Struct('<Q')
+_WRITE_COUNT_OFFSET = 16
+_SEQUENCE = struct.Struct('<Q')
+
+# struct format of each column type.
+_FORMATS = {
+    columnar.TIMESTAMP: 'q',
+    columnar.INT64: 'q',
+    columnar.FLOAT64: 'd',
+    columnar.HASTINGS: 'QQ',
+}
+
+_INT64_NULL = -2**63
+_UINT64_MAX = 2**64 - 1
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+DEFAULT_CAPACITY = 10000
+
+
+class RingBufferWriter(object):
+    """Writes SiaState rows to a ring buffer file."""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        """Creates a writer, continuing the ring buffer at the given path.
+
+        If the file holds a ring buffer with a different capacity or
+        different columns, it is replaced with an empty one.
+
+        Args:
+            path: Path to the ring buffer file.
+            capacity: Number of records to keep.
+        """
+        self._record = _record_struct(columnar.COLUMNS)
+        self._capacity = capacity
+        if not self._can_continue(path):
+            _create_file(path, capacity, self._record.size)
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._write_count = _read_header(self._map)[3]
+
+    def write_state(self, sia_state):
+        offset = _HEADER_SIZE + (
+            self._write_count % self._capacity) * self._record.size
+        # Mark the slot as being written, so readers skip it until the final
+        # sequence number replaces this one.
+        _SEQUENCE.pack_into(self._map, offset, 2 * self._write_count + 1)
+        self._record.pack_into(self._map, offset, 2 * self._write_count + 1,
+                               *_pack_values(sia_state))
+        _SEQUENCE.pack_into(self._map, offset, 2 * (self._write_count + 1))
+        self._write_count += 1
+        _WRITE_COUNT.pack_into(self._map, _WRITE_COUNT_OFFSET,
+                               self._write_count)
+
+    def flush(self):
+        # Readers see writes to the map right away. Flushing only writes
+        # them to disk.
+        pass
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _can_continue(self, path):
+        if not os.path.exists(path) or os.path.getsize(path) != (
+                _HEADER_SIZE + self._capacity * self._record.size):
+            return False
+        with open(path, 'rb') as ring_file:
+            try:
+                _, record_size, capacity, _, columns = _parse_header(
+                    ring_file.read(_HEADER_SIZE))
+            except ValueError:
+                return False
+        return (record_size == self._record.size and
+                capacity == self._capacity and
+                columns == list(columnar.COLUMNS))
+
+
+class RingBufferReader(object):
+    """Reads recent SiaState rows from a ring buffer file."""
+
+    def __init__(self, path):
+        """Attaches to the ring buffer at the given path.
+
+        Args:
+            path: Path to a file written by RingBufferWriter.
+
+        Raises:
+            ValueError: If the file is not a ring buffer.
+        """
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, self._record_size, self._capacity, _, columns = _read_header(
+            self._map)
+        self._names, self._types = zip(*columns)
+        self._record = _record_struct(columns)
+
+    @property
+    def write_count(self):
+        """Number of records the writer has written so far."""
+        return _WRITE_COUNT.unpack_from(self._map, _WRITE_COUNT_OFFSET)[0]
+
+    def read_latest(self, count=None):
+        """Returns the most recent rows, oldest first.
+
+        Each row is read consistently, but rows that the writer overwrites
+        while they're being read are left out, so a reader that falls a
+        whole buffer behind may get fewer rows than it asked for.
+
+        Args:
+            count: Maximum number of rows to return. Defaults to every row in
+                the buffer.
+
+        Returns:
+            A list of SiaState instances.
+        """
+        write_count = self.write_count
+        if count is None or count > self._capacity:
+            count = self._capacity
+        states = []
+        for index in xrange(max(0, write_count - count), write_count):
+            values = self._read_record(index)
+            if values is not None:
+                states.append(self._unpack_state(values))
+        return states
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _read_record(self, index):
+        """Returns the values of the Nth record, or None if overwritten."""
+        offset = _HEADER_SIZE + (index % self._capacity) * self._record_size
+        expected_sequence = 2 * (index + 1)
+        values = self._record.unpack_from(self._map, offset)
+        if values[0] != expected_sequence:
+            return None
+        if _SEQUENCE.unpack_from(self._map, offset)[0] != expected_sequence:
+            return None
+        return values[1:]
+
+    def _unpack_state(self, values):
+        fields = {}
+        position = 0
+        for name, column_type in zip(self._names, self._types):
+            if column_type == columnar.HASTINGS:
+                low, high = values[position:position + 2]
+                position += 2
+                if low == _UINT64_MAX and high == _UINT64_MAX:
+                    continue
+                fields[name] = (high << 64) | low
+                continue
+            value = values[position]
+            position += 1
+            if column_type == columnar.FLOAT64:
+                # NaN, which marks a missing value, is the only float that
+                # isn't equal to itself.
+                if value == value:
+                    fields[name] = value
+            elif value != _INT64_NULL:
+                if column_type == columnar.TIMESTAMP:
+                    value = _EPOCH + datetime.timedelta(microseconds=value)
+                fields[name] = value
+        # Ignore columns that this version of SiaState doesn't have.
+        return state.SiaState(
+            **{
+                name: value
+                for name, value in fields.iteritems()
+                if name in state.SiaState._fields
+            })
+
+
+def _record_struct(columns):
+    return struct.Struct('<Q' + ''.join(
+        _FORMATS[column_type] for _, column_type in columns))
+
+
+def _pack_values(sia_state):
+    values = []
+    for name, column_type in columnar.COLUMNS:
+        value = getattr(sia_state, name)
+        if column_type == columnar.HASTINGS:
+            if value is None:
+                values.extend((_UINT64_MAX, _UINT64_MAX))
+            else:
+                values.extend((value & _UINT64_MAX, value >> 64))
+        elif column_type == columnar.FLOAT64:
+            values.append(float('nan') if value is None else value)
+        elif value is None:
+            values.append(_INT64_NULL)
+        elif column_type == columnar.TIMESTAMP:
+            delta = value - _EPOCH
+            values.append((delta.days * 86400 + delta.seconds
+                          ) * 1000000 + delta.microseconds)
+        else:
+            values.append(value)
+    return values
+
+
+def _create_file(path, capacity, record_size):
+    columns = json.dumps([list(c) for c in columnar.COLUMNS])
+    header = _HEADER.pack(_MAGIC, record_size, capacity, 0,
+                          len(columns)) + columns
+    if len(header) > _HEADER_SIZE:
+        raise ValueError('Too many columns for ring buffer header')
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as ring_file:
+        ring_file.write(header)
+        ring_file.truncate(_HEADER_SIZE + capacity * record_size)
+    os.rename(temp_path, path)
+
+
+def _read_header(ring_map):
+    return _parse_header(ring_map[:_HEADER_SIZE])
+
+
+def _parse_header(header):
+    if len(header) < _HEADER.size:
+        raise ValueError('File is too short to be a ring buffer')
+    magic, record_size, capacity, write_count, columns_length = (
+        _HEADER.unpack_from(header))
+    if magic != _MAGIC:
+        raise ValueError('File is not a ring buffer')
+    columns = [
+        tuple(c)
+        for c in json.loads(header[_HEADER.size:_HEADER.size + columns_length])
+    ]
+    return magic, record_size, capacity, write_count, columns
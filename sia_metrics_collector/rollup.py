@@ -0,0 +1,442 @@
+#!/usr/bin/python2
+"""Rolls up a metrics CSV file into per-minute, hour, and day summaries.
+
+For every numeric column, each rollup row holds the last, minimum, and maximum
+value within the period. Cumulative counters (e.g. uploaded_bytes and the
+spending columns) also get the rate of change per second since the last value
+of the previous period.
+
+Rollups are incremental: the rollup state file records how far into the CSV
+file each resolution has read, along with its still-open period at the end,
+so each run reads only the rows appended since the last run. A resolution
+added to an existing rollup starts from the beginning of the CSV file. A
+period is written once a row from a later period arrives.
+
+Values are aggregated as float64, so hastings amounts are precise to about 15
+significant digits. Requires numpy, which is an optional dependency.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# Length (in seconds) of each supported rollup period.
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+
+# Columns that only ever increase, for which rollups include a rate.
+COUNTER_COLUMNS = frozenset([
+    'uploaded_bytes',
+    'total_contract_spending',
+    'contract_fee_spending',
+    'storage_spending',
+    'upload_spending',
+    'download_spending',
+])
+
+# Number of CSV rows to read and aggregate at once.
+DEFAULT_CHUNK_ROWS = 100000
+
+_STATE_FILE_SUFFIX = '-rollup.json'
+
+
+class _Buckets(object):
+    """Aggregates of consecutive periods, one row per period.
+
+    Attributes:
+        ids: Array of period numbers (timestamp // period length).
+        mins: Array (periods x columns) of the minimum of each column.
+        maxes: Array (periods x columns) of the maximum of each column.
+        lasts: Array (periods x columns) of the last non-missing value of each
+            column.
+        last_times: Array (periods x columns) of the Unix time of each value
+            in lasts.
+    """
+
+    def __init__(self, ids, mins, maxes, lasts, last_times):
+        self.ids = ids
+        self.mins = mins
+        self.maxes = maxes
+        self.lasts = lasts
+        self.last_times = last_times
+
+    def to_json(self):
+        return {
+            'ids': self.ids.tolist(),
+            'mins': _to_json_floats(self.mins),
+            'maxes': _to_json_floats(self.maxes),
+            'lasts': _to_json_floats(self.lasts),
+            'last_times': _to_json_floats(self.last_times),
+        }
+
+    @staticmethod
+    def from_json(d):
+        return _Buckets(
+            numpy.array(d['ids'], dtype=numpy.int64),
+            _from_json_floats(d['mins']), _from_json_floats(d['maxes']),
+            _from_json_floats(d['lasts']), _from_json_floats(d['last_times']))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return _Buckets(self.ids[index], self.mins[index], self.maxes[index],
+                        self.lasts[index], self.last_times[index])
+
+
+def aggregate_chunk(times, values, period):
+    """Aggregates rows into per-period buckets with vectorized operations.
+
+    Args:
+        times: Array of row timestamps (in Unix seconds), in ascending order.
+        values: Array (rows x columns) of row values, with NaN for missing
+            values.
+        period: Length of each period in seconds.
+
+    Returns:
+        A _Buckets instance with one row per period that has any rows.
+    """
+    bucket_ids = times // period
+    starts = numpy.flatnonzero(
+        numpy.concatenate(([True], bucket_ids[1:] != bucket_ids[:-1])))
+    ends = numpy.concatenate((starts[1:], [len(times)])) - 1
+    # Index of the most recent non-missing value at or before each row.
+    row_numbers = numpy.arange(len(times))[:, numpy.newaxis]
+    last_valid_rows = numpy.maximum.accumulate(
+        numpy.where(numpy.isnan(values), -1, row_numbers), axis=0)
+    bucket_last_rows = last_valid_rows[ends]
+    has_last = bucket_last_rows >= starts[:, numpy.newaxis]
+    safe_last_rows = numpy.maximum(bucket_last_rows, 0)
+    column_numbers = numpy.arange(values.shape[1])
+    return _Buckets(
+        ids=bucket_ids[starts],
+        mins=numpy.fmin.reduceat(values, starts, axis=0),
+        maxes=numpy.fmax.reduceat(values, starts, axis=0),
+        lasts=numpy.where(has_last, values[safe_last_rows, column_numbers],
+                          numpy.nan),
+        last_times=numpy.where(has_last, times[safe_last_rows], numpy.nan))
+
+
+def merge_open_bucket(open_bucket, buckets):
+    """Merges the open bucket from a previous chunk into the next chunk.
+
+    Args:
+        open_bucket: _Buckets with a single period, the last one from the
+            previous chunk.
+        buckets: _Buckets for the next chunk, which start at or after the
+            open bucket's period.
+
+    Returns:
+        A _Buckets instance covering both, where the open bucket is combined
+        with the first bucket of the chunk if they are for the same period.
+    """
+    if open_bucket.ids[0] != buckets.ids[0]:
+        return _Buckets(*[
+            numpy.concatenate((a, b))
+            for a, b in zip(_fields(open_bucket), _fields(buckets))
+        ])
+    first = buckets[:1]
+    has_last = ~numpy.isnan(first.lasts)
+    merged = _Buckets(
+        ids=first.ids,
+        mins=numpy.fmin(open_bucket.mins, first.mins),
+        maxes=numpy.fmax(open_bucket.maxes, first.maxes),
+        lasts=numpy.where(has_last, first.lasts, open_bucket.lasts),
+        last_times=numpy.where(has_last, first.last_times,
+                               open_bucket.last_times))
+    rest = buckets[1:]
+    return _Buckets(*[
+        numpy.concatenate((a, b))
+        for a, b in zip(_fields(merged), _fields(rest))
+    ])
+
+
+def compute_rates(buckets, previous_lasts, previous_last_times):
+    """Computes the per-second rate of change for each bucket.
+
+    Args:
+        buckets: _Buckets to compute rates for.
+        previous_lasts: Array of the last values before the first bucket, or
+            NaN where unknown.
+        previous_last_times: Array of the Unix times of previous_lasts.
+
+    Returns:
+        An array (periods x columns) of rates, with NaN where there isn't
+        enough data to compute one.
+    """
+    reference_lasts = numpy.vstack((previous_lasts, buckets.lasts[:-1]))
+    reference_times = numpy.vstack((previous_last_times,
+                                    buckets.last_times[:-1]))
+    elapsed = buckets.last_times - reference_times
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rates = (buckets.lasts - reference_lasts) / elapsed
+        rates[~(elapsed > 0)] = numpy.nan
+    return rates
+
+
+class Rollup(object):
+    """Incrementally rolls up a metrics CSV file at several resolutions."""
+
+    def __init__(self, input_path, output_prefix, resolutions, chunk_rows):
+        """Creates a new Rollup instance.
+
+        Args:
+            input_path: Path to a metrics CSV file written by CsvSerializer.
+            output_prefix: Path prefix for rollup files. Rollups are written
+                to <output_prefix>-<resolution>.csv and state to
+                <output_prefix>-rollup.json.
+            resolutions: List of names of resolutions from RESOLUTIONS.
+            chunk_rows: Maximum number of CSV rows to aggregate at once.
+
+        Raises:
+            ImportError: If numpy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('Rolling up metrics requires numpy')
+        self._input_path = input_path
+        self._output_prefix = output_prefix
+        self._resolutions = resolutions
+        self._chunk_rows = chunk_rows
+
+    def run(self):
+        """Rolls up every complete row added since the last run.
+
+        Returns:
+            The number of CSV rows read.
+        """
+        with open(self._input_path, 'rb') as input_file:
+            header = next(csv.reader([input_file.readline()]))
+            columns = header[1:]
+            state = self._load_state(columns, input_file.tell())
+            self._truncate_outputs(state)
+            resolution_states = [(resolution, state['resolutions'][resolution])
+                                 for resolution in self._resolutions]
+            offset = min(resolution_state['source_offset']
+                         for _, resolution_state in resolution_states)
+            input_file.seek(offset)
+            row_count = 0
+            while True:
+                lines = _read_complete_lines(input_file, self._chunk_rows)
+                if not lines:
+                    break
+                times, values = _parse_lines(lines, len(columns))
+                line_offsets = offset + numpy.cumsum(
+                    [0] + [len(line) for line in lines[:-1]])
+                offset += sum(len(line) for line in lines)
+                for resolution, resolution_state in resolution_states:
+                    # Skip the rows that this resolution has already read.
+                    first_row = numpy.searchsorted(
+                        line_offsets, resolution_state['source_offset'])
+                    if first_row < len(lines):
+                        self._roll_up_chunk(resolution_state, resolution,
+                                            columns, times[first_row:],
+                                            values[first_row:])
+                    resolution_state['source_offset'] = offset
+                row_count += len(lines)
+                self._save_state(state)
+        return row_count
+
+    def output_path(self, resolution):
+        return '%s-%s.csv' % (self._output_prefix, resolution)
+
+    def _roll_up_chunk(self, resolution_state, resolution, columns, times,
+                       values):
+        buckets = aggregate_chunk(times, values, RESOLUTIONS[resolution])
+        if resolution_state['open_bucket']:
+            buckets = merge_open_bucket(
+                _Buckets.from_json(resolution_state['open_bucket']), buckets)
+        closed = buckets[:-1]
+        if len(closed):
+            previous_lasts = _from_json_floats(
+                [resolution_state['previous_lasts']])
+            previous_last_times = _from_json_floats(
+                [resolution_state['previous_last_times']])
+            rates = compute_rates(closed, previous_lasts, previous_last_times)
+            self._append_rows(resolution, columns, closed, rates)
+            resolution_state['previous_lasts'] = _to_json_floats(
+                closed.lasts[-1])
+            resolution_state['previous_last_times'] = _to_json_floats(
+                closed.last_times[-1])
+        resolution_state['open_bucket'] = buckets[-1:].to_json()
+
+    def _append_rows(self, resolution, columns, buckets, rates):
+        path = self.output_path(resolution)
+        is_new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        counter_columns = [
+            i for i, column in enumerate(columns) if column in COUNTER_COLUMNS
+        ]
+        timestamps = (buckets.ids * RESOLUTIONS[resolution]
+                     ).astype('datetime64[s]').astype(str).tolist()
+        # Interleave each column's last, min, and max, then append the rates.
+        values = numpy.hstack((numpy.dstack(
+            (buckets.lasts, buckets.mins, buckets.maxes)).reshape(
+                len(buckets), -1), rates[:, counter_columns])).tolist()
+        with open(path, 'ab') as output_file:
+            writer = csv.writer(output_file, lineterminator='\n')
+            if is_new_file:
+                writer.writerow(_output_header(columns))
+            for timestamp, row_values in zip(timestamps, values):
+                writer.writerow(
+                    [timestamp] + [_format_value(v) for v in row_values])
+
+    def _state_path(self):
+        return self._output_prefix + _STATE_FILE_SUFFIX
+
+    def _load_state(self, columns, data_offset):
+        if os.path.exists(self._state_path()):
+            with open(self._state_path()) as state_file:
+                state = json.load(state_file)
+            if state['columns'] != columns:
+                raise ValueError('Rollup state in %s is for different columns' %
+                                 self._state_path())
+            if 'source_offset' in state:
+                # Older states record a single offset for every resolution.
+                source_offset = state.pop('source_offset')
+                for resolution_state in state['resolutions'].itervalues():
+                    resolution_state['source_offset'] = source_offset
+        else:
+            state = {
+                'columns': columns,
+                'resolutions': {},
+            }
+        for resolution in self._resolutions:
+            state['resolutions'].setdefault(
+                resolution, {
+                    'source_offset': data_offset,
+                    'open_bucket': None,
+                    'output_size': 0,
+                    'previous_lasts': [None] * len(columns),
+                    'previous_last_times': [None] * len(columns),
+                })
+        return state
+
+    def _truncate_outputs(self, state):
+        # Discard rows written after the state was last saved, which the
+        # upcoming run will write again.
+        for resolution in self._resolutions:
+            path = self.output_path(resolution)
+            if os.path.exists(path):
+                with open(path, 'ab') as output_file:
+                    output_file.truncate(
+                        state['resolutions'][resolution]['output_size'])
+
+    def _save_state(self, state):
+        for resolution in self._resolutions:
+            path = self.output_path(resolution)
+            state['resolutions'][resolution]['output_size'] = (
+                os.path.getsize(path) if os.path.exists(path) else 0)
+        temp_path = self._state_path() + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.rename(temp_path, self._state_path())
+
+
+def _fields(buckets):
+    return (buckets.ids, buckets.mins, buckets.maxes, buckets.lasts,
+            buckets.last_times)
+
+
+def _read_complete_lines(input_file, max_lines):
+    lines = []
+    for _ in xrange(max_lines):
+        line = input_file.readline()
+        if not line.endswith('\n'):
+            # Leave a row that is still being written for the next run.
+            input_file.seek(-len(line), os.SEEK_CUR)
+            break
+        lines.append(line)
+    return lines
+
+
+def _parse_lines(lines, column_count):
+    rows = list(csv.reader(lines))
+    for row in rows:
+        if len(row) != column_count + 1:
+            raise ValueError('Expected %d columns, but row has %d: %s' %
+                             (column_count + 1, len(row), ','.join(row)))
+    fields = numpy.array(rows)
+    times = fields[:, 0].astype('datetime64[s]').astype(numpy.int64)
+    values = fields[:, 1:]
+    values[values == ''] = 'nan'
+    return times, values.astype(numpy.float64)
+
+
+def _output_header(columns):
+    header = ['timestamp']
+    for column in columns:
+        header.extend([column + '_last', column + '_min', column + '_max'])
+    for column in columns:
+        if column in COUNTER_COLUMNS:
+            header.append(column + '_rate')
+    return header
+
+
+def _format_value(value):
+    # NaN is the only value that isn't equal to itself.
+    if value != value:
+        return ''
+    return repr(value)
+
+
+def _to_json_floats(a):
+    return numpy.where(numpy.isnan(a), None, a).tolist()
+
+
+def _from_json_floats(a):
+    return numpy.array(a, dtype=numpy.float64)
+
+
+def _parse_resolutions(value):
+    resolutions = value.split(',')
+    for resolution in resolutions:
+        if resolution not in RESOLUTIONS:
+            raise argparse.ArgumentTypeError(
+                'Unknown resolution %r, expected one of: %s' %
+                (resolution, ', '.join(sorted(RESOLUTIONS))))
+    return resolutions
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO)
+    rollup = Rollup(args.input_file, args.output_prefix, args.resolutions,
+                    args.chunk_rows)
+    logger.info('Rolled up %d rows', rollup.run())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Sia Metrics Rollup',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-i',
+        '--input_file',
+        required=True,
+        help='Path to metrics CSV file to roll up')
+    parser.add_argument(
+        '-o',
+        '--output_prefix',
+        required=True,
+        help='Path prefix for rollup CSV files and rollup state')
+    parser.add_argument(
+        '--resolutions',
+        type=_parse_resolutions,
+        default='minute,hour,day',
+        help='Comma-separated list of rollup periods to compute')
+    parser.add_argument(
+        '--chunk_rows',
+        type=int,
+        default=DEFAULT_CHUNK_ROWS,
+        help='Number of rows to aggregate at once')
+    main(parser.parse_args())
@@ -0,0 +1,118 @@
+"""Schedules polls at a fixed interval without drifting."""
+
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Overrun policies, which decide what to do about polls that came due while
+# the previous poll was still running.
+#
+# Skip the overdue polls and wait for the next deadline that is still ahead.
+SKIP = 'skip'
+# Run a single poll right away in place of all the overdue polls.
+COALESCE = 'coalesce'
+# Run every overdue poll, back to back, until the schedule catches up.
+CATCH_UP = 'catch_up'
+
+OVERRUN_POLICIES = (SKIP, COALESCE, CATCH_UP)
+
+
+class Scheduler(object):
+    """Waits for each poll's deadline on a fixed grid of deadlines.
+
+    Deadlines fall at exact multiples of the interval after the first poll,
+    so time spent polling doesn't push later polls back. Each wait is a
+    single sleep until the next deadline.
+
+    Attributes:
+        missed_count: Number of deadlines that passed while a poll was still
+            running.
+    """
+
+    def __init__(self,
+                 interval,
+                 overrun_policy=SKIP,
+                 jitter=0.0,
+                 clock=time.time,
+                 sleep=time.sleep,
+                 random_fn=random.random):
+        """Creates a new Scheduler instance.
+
+        Args:
+            interval: Number of seconds between deadlines.
+            overrun_policy: One of OVERRUN_POLICIES, deciding what to do when
+                one or more deadlines pass while a poll is running.
+            jitter: Maximum number of seconds to add to each deadline at
+                random, so that collectors started at the same time don't
+                all poll at once. Jitter delays a poll but never shifts the
+                deadlines that follow it.
+            clock: A function that returns the current time in seconds.
+            sleep: A function that sleeps for a given number of seconds.
+            random_fn: A function that returns a random float in [0, 1).
+
+        Raises:
+            ValueError: If the interval is not positive, the overrun policy
+                is unknown, or the jitter is not between 0 and the interval.
+        """
+        if interval <= 0:
+            raise ValueError('Interval must be positive: %s' % interval)
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError('Unknown overrun policy: %s' % overrun_policy)
+        if not 0 <= jitter < interval:
+            raise ValueError(
+                'Jitter must be at least 0 and less than the interval: %s' %
+                jitter)
+        self._interval = interval
+        self._overrun_policy = overrun_policy
+        self._jitter = jitter
+        self._clock = clock
+        self._sleep = sleep
+        self._random_fn = random_fn
+        self._deadline = None
+        self.missed_count = 0
+
+    def wait(self):
+        """Blocks until the next poll is due.
+
+        The first call returns right away, and sets the first deadline.
+        """
+        now = self._clock()
+        if self._deadline is None:
+            self._deadline = now
+            return
+        self._deadline += self._interval
+        if now > self._deadline:
+            self._handle_overrun(now)
+        elif self._deadline - now > self._interval:
+            # The system clock went backwards, so restart the schedule rather
+            # than sleeping until the clock gets back to the old deadline.
+            logger.warning('Clock went back %.1fs, restarting poll schedule',
+                           self._deadline - self._interval - now)
+            self._deadline = now
+        delay = self._deadline - now
+        if self._jitter:
+            delay += self._random_fn() * self._jitter
+        if delay > 0:
+            self._sleep(delay)
+
+    def _handle_overrun(self, now):
+        # Number of deadlines that have passed since the last poll.
+        overdue_count = int((now - self._deadline) // self._interval) + 1
+        if self._overrun_policy == CATCH_UP:
+            # Only the deadline being run late counts here, as each of the
+            # others is counted when its own turn comes.
+            self.missed_count += 1
+            logger.warning('Poll is %.1fs behind schedule, catching up',
+                           now - self._deadline)
+            return
+        self.missed_count += overdue_count
+        if self._overrun_policy == COALESCE:
+            self._deadline += (overdue_count - 1) * self._interval
+            action = 'polling once now'
+        else:
+            self._deadline += overdue_count * self._interval
+            action = 'waiting for the next deadline'
+        logger.warning('Poll overran %d deadlines, %s (%d missed in total)',
+                       overdue_count, action, self.missed_count)
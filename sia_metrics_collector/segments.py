@@ -0,0 +1,338 @@
+"""Writes metrics CSV output as a directory of bounded, rotating segments.
+
+Each segment is an ordinary metrics CSV file, named after the timestamp of
+its first row (e.g. metrics-20180211T160502.csv). The serializer starts a new
+segment once the current one reaches a size limit or crosses into a new
+period (e.g. a new UTC day), and gzips closed segments on a background thread
+so that polling never waits on compression.
+
+A manifest (manifest.json) lists every segment's file, the timestamps of its
+first and last rows, and its row count, so readers can open only the segments
+that overlap the time range they want. The segment still being written has an
+end of null.
+"""
+
+import csv
+import datetime
+import gzip
+import json
+import logging
+import os
+import Queue
+import shutil
+import threading
+
+import serialize
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'manifest.json'
+
+_SEGMENT_FILENAME_FORMAT = 'metrics-%Y%m%dT%H%M%S.csv'
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+_TIMESTAMP_LENGTH = len('2018-02-11T16:05:02')
+_GZIP_EXTENSION = '.gz'
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class SegmentedSerializer(object):
+    """Serializes SiaState to a directory of rotating CSV segments."""
+
+    def __init__(self,
+                 directory,
+                 flush_policy=None,
+                 max_segment_bytes=None,
+                 max_segment_seconds=None,
+                 compress=True,
+                 fieldnames=None):
+        """Creates a serializer, writing segments to the given directory.
+
+        Creates the directory if it does not exist. If a previous process
+        left a segment open, the serializer continues appending to it, and
+        resumes compressing any closed segments it didn't get to.
+
+        Args:
+            directory: Path to the directory of segments.
+            flush_policy: serialize.FlushPolicy for each segment.
+            max_segment_bytes: Number of bytes after which to start a new
+                segment, or None for no size limit.
+            max_segment_seconds: Length of the period that each segment
+                covers, or None for no time limit. Periods are aligned to
+                the Unix epoch, so 86400 starts a new segment every UTC
+                midnight.
+            compress: If True, gzips each segment once it is closed.
+            fieldnames: Columns to write to each new segment, as returned by
+                serialize.select_fieldnames, or None for the columns that
+                are always written.
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._flush_policy = flush_policy
+        self._max_segment_bytes = max_segment_bytes
+        self._max_segment_seconds = max_segment_seconds
+        self._compress = compress
+        self._fieldnames = fieldnames
+        # Guards the manifest, which the compression thread also updates.
+        self._manifest_lock = threading.Lock()
+        self._segments = read_manifest(directory)
+        self._active_file = None
+        self._active_serializer = None
+        self._active_period = None
+        self._active_row_count = 0
+        self._last_timestamp = None
+        self._compression_queue = Queue.Queue()
+        self._compression_thread = threading.Thread(target=self._compress_all)
+        self._compression_thread.daemon = True
+        self._compression_thread.start()
+        if self._segments and self._segments[-1]['end'] is None:
+            self._resume_segment(self._segments[-1])
+        for segment in self._segments:
+            if segment['end'] is not None and not segment['file'].endswith(
+                    _GZIP_EXTENSION):
+                self._queue_compression(segment)
+
+    def write_state(self, state):
+        if self._should_rotate(state.timestamp):
+            self._close_segment()
+        if self._active_serializer is None:
+            self._open_segment(state.timestamp)
+        self._active_serializer.write_state(state)
+        self._active_row_count += 1
+        self._last_timestamp = state.timestamp.strftime(_TIMESTAMP_FORMAT)
+
+    def flush(self):
+        if self._active_serializer:
+            self._active_serializer.flush()
+
+    def close(self):
+        """Flushes the open segment and waits for compression to finish.
+
+        The open segment stays open in the manifest, so the next serializer
+        for the directory appends to it.
+        """
+        if self._active_serializer:
+            self._active_serializer.flush()
+            self._active_file.close()
+            self._active_serializer = None
+        self._compression_queue.put(None)
+        self._compression_thread.join()
+
+    def _should_rotate(self, timestamp):
+        if self._active_serializer is None:
+            return False
+        if self._max_segment_bytes is not None and (self._active_serializer.size
+                                                    >= self._max_segment_bytes):
+            return True
+        if self._max_segment_seconds is not None and (self._period(timestamp) !=
+                                                      self._active_period):
+            return True
+        return False
+
+    def _period(self, timestamp):
+        if self._max_segment_seconds is None:
+            return None
+        delta = timestamp - _EPOCH
+        return (delta.days * 86400 + delta.seconds) // self._max_segment_seconds
+
+    def _open_segment(self, timestamp):
+        filename = _unused_filename(
+            self._directory, timestamp.strftime(_SEGMENT_FILENAME_FORMAT))
+        segment = {
+            'file': filename,
+            'start': timestamp.strftime(_TIMESTAMP_FORMAT),
+            'end': None,
+            'rows': 0,
+        }
+        self._active_file = serialize.open_output_file(
+            os.path.join(self._directory, filename))
+        self._active_serializer = serialize.CsvSerializer(
+            self._active_file, self._flush_policy, fieldnames=self._fieldnames)
+        self._active_period = self._period(timestamp)
+        self._active_row_count = 0
+        with self._manifest_lock:
+            self._segments.append(segment)
+            self._write_manifest()
+
+    def _resume_segment(self, segment):
+        path = os.path.join(self._directory, segment['file'])
+        self._active_row_count, self._last_timestamp = _read_rows_summary(path)
+        self._active_file = serialize.open_output_file(path)
+        self._active_serializer = serialize.CsvSerializer(
+            self._active_file, self._flush_policy, fieldnames=self._fieldnames)
+        self._active_period = self._period(
+            datetime.datetime.strptime(segment['start'], _TIMESTAMP_FORMAT))
+
+    def _close_segment(self):
+        self._active_serializer.flush()
+        self._active_file.close()
+        self._active_serializer = None
+        with self._manifest_lock:
+            segment = self._segments[-1]
+            segment['end'] = self._last_timestamp or segment['start']
+            segment['rows'] = self._active_row_count
+            self._write_manifest()
+        self._queue_compression(segment)
+
+    def _queue_compression(self, segment):
+        if self._compress:
+            self._compression_queue.put(segment)
+
+    def _compress_all(self):
+        while True:
+            segment = self._compression_queue.get()
+            if segment is None:
+                return
+            try:
+                self._compress_segment(segment)
+            except Exception as e:
+                logger.error('Failed to compress segment %s: %s',
+                             segment['file'], e)
+
+    def _compress_segment(self, segment):
+        path = os.path.join(self._directory, segment['file'])
+        compressed_path = path + _GZIP_EXTENSION
+        temp_path = compressed_path + '.tmp'
+        with open(path, 'rb') as input_file:
+            output_file = gzip.open(temp_path, 'wb')
+            try:
+                shutil.copyfileobj(input_file, output_file)
+            finally:
+                output_file.close()
+        os.rename(temp_path, compressed_path)
+        with self._manifest_lock:
+            segment['file'] += _GZIP_EXTENSION
+            self._write_manifest()
+        os.remove(path)
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self._directory, MANIFEST_FILENAME)
+        temp_path = manifest_path + '.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump({'segments': self._segments}, manifest_file, indent=2)
+        os.rename(temp_path, manifest_path)
+
+
+def read_manifest(directory):
+    """Reads the list of segments in a directory of segments.
+
+    Args:
+        directory: Path to the directory of segments.
+
+    Returns:
+        A list of dicts, one per segment in the order they were written, each
+        with the segment's file name, the timestamps of its first and last
+        rows (start and end), and its row count (rows). The open segment has
+        an end of None and a row count of 0.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)['segments']
+
+
+def find_segments(directory, start=None, end=None):
+    """Returns the paths of segments that may hold rows in a time range.
+
+    Args:
+        directory: Path to the directory of segments.
+        start: Earliest timestamp (as a datetime) of interest, or None.
+        end: Timestamp (as a datetime) at which the range ends, exclusive, or
+            None.
+    """
+    start_timestamp = start.strftime(_TIMESTAMP_FORMAT) if start else None
+    end_timestamp = end.strftime(_TIMESTAMP_FORMAT) if end else None
+    paths = []
+    for segment in read_manifest(directory):
+        if start_timestamp and segment['end'] is not None and (segment['end'] <
+                                                               start_timestamp):
+            continue
+        if end_timestamp and segment['start'] >= end_timestamp:
+            continue
+        paths.append(os.path.join(directory, segment['file']))
+    return paths
+
+
+def read_header(directory):
+    """Returns the list of column names in the first segment of a directory.
+
+    Returns:
+        The column names, or an empty list if the directory has no segments.
+    """
+    paths = find_segments(directory)
+    if not paths:
+        return []
+    with _open_segment_file(paths[0]) as segment_file:
+        return next(csv.reader([segment_file.readline()]))
+
+
+def query_rows(directory, fields, start=None, end=None):
+    """Yields the rows of a directory of segments within a time range.
+
+    Reads only the segments that the manifest says overlap the range.
+
+    Args:
+        directory: Path to the directory of segments.
+        fields: List of column names to include in each row.
+        start: Earliest timestamp (as a datetime) to include, or None to start
+            at the first row.
+        end: Timestamp (as a datetime) at which to stop, exclusive, or None to
+            continue to the last row.
+
+    Yields:
+        A list of the values of the requested fields for each matching row.
+        A field that the row's segment has no column for (e.g. a segment
+        written by an older version) has an empty value.
+    """
+    start_timestamp = start.strftime(_TIMESTAMP_FORMAT) if start else None
+    end_timestamp = end.strftime(_TIMESTAMP_FORMAT) if end else None
+    for path in find_segments(directory, start, end):
+        with _open_segment_file(path) as segment_file:
+            header = next(csv.reader([segment_file.readline()]))
+            columns = [
+                header.index(field) if field in header else None
+                for field in fields
+            ]
+            for line in segment_file:
+                # Skip a final row that is still being written.
+                if not line.endswith('\n'):
+                    break
+                timestamp = line[:_TIMESTAMP_LENGTH]
+                if start_timestamp and timestamp < start_timestamp:
+                    continue
+                if end_timestamp and timestamp >= end_timestamp:
+                    return
+                values = next(csv.reader([line]))
+                yield ['' if i is None else values[i] for i in columns]
+
+
+def _open_segment_file(path):
+    if path.endswith(_GZIP_EXTENSION):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _unused_filename(directory, filename):
+    """Appends a counter to filename if a file already has that name."""
+    base, extension = os.path.splitext(filename)
+    suffix = 1
+    while (os.path.exists(os.path.join(directory, filename)) or
+           os.path.exists(os.path.join(directory, filename + _GZIP_EXTENSION))):
+        filename = '%s-%d%s' % (base, suffix, extension)
+        suffix += 1
+    return filename
+
+
+def _read_rows_summary(path):
+    """Returns the row count and last row's timestamp of an open segment."""
+    row_count = 0
+    last_line = None
+    with open(path, 'rb') as segment_file:
+        segment_file.readline()
+        for line in segment_file:
+            row_count += 1
+            last_line = line
+    if last_line is None:
+        return 0, None
+    return row_count, last_line[:_TIMESTAMP_LENGTH]
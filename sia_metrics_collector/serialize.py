@@ -1,52 +1,216 @@
 import csv
+import io
+import logging
+import operator
+import os
+import time
+
+import recordtype
+
+logger = logging.getLogger(__name__)
 
 # Constant for Python's file seek() function.
 _FROM_FILE_END = 2
 
+# SiaState fields in the order of the CSV file's columns, when every column
+# is written. The write queue's metrics are left out, as they're exported
+# over HTTP for watching the collector itself.
+_FIELDNAMES = (
+    'timestamp',
+    'contract_count',
+    'file_count',
+    'uploads_in_progress_count',
+    'total_contract_size',
+    'total_file_bytes',
+    'uploaded_bytes',
+    'total_contract_spending',
+    'contract_fee_spending',
+    'storage_spending',
+    'upload_spending',
+    'download_spending',
+    'remaining_renter_funds',
+    'wallet_siacoin_balance',
+    'wallet_outgoing_siacoins',
+    'wallet_incoming_siacoins',
+    'api_latency',
+    'contracts_api_latency',
+    'files_api_latency',
+    'wallet_api_latency',
+    'contracts_age',
+    'files_age',
+    'wallet_age',
+    'response_cache_hits',
+    'response_cache_misses',
+    'contracts_status',
+    'files_status',
+    'wallet_status',
+)
+
+# Optional columns, which have values only when the feature that fills them
+# is enabled. A new file gets them only if the caller asks for them.
+#
+# Filled when the Builder skips unchanged responses.
+CACHE_FIELDNAMES = ('response_cache_hits', 'response_cache_misses')
+# Filled when queries have deadlines.
+STATUS_FIELDNAMES = ('contracts_status', 'files_status', 'wallet_status')
+
+_OPTIONAL_FIELDNAMES = CACHE_FIELDNAMES + STATUS_FIELDNAMES
+"""Controls how often a CsvSerializer flushes buffered rows to disk.
+
+A CsvSerializer flushes as soon as any one of the limits is reached. Limits
+set to None are ignored. The interval is checked only when a row is written,
+so it bounds how stale the file is for as long as rows keep arriving.
+
+Fields:
+    max_rows: Number of rows to buffer before flushing.
+    max_bytes: Number of bytes to buffer before flushing.
+    max_interval: Number of seconds since the last flush after which to
+        flush.
+    fsync: If True, asks the OS to write flushed data through to disk,
+        rather than only handing it to the OS.
+"""
+FlushPolicy = recordtype.recordtype('FlushPolicy',
+                                    [('max_rows', 1), ('max_bytes', None),
+                                     ('max_interval', None), ('fsync', False)])
+
+
+def select_fieldnames(optional_fieldnames=()):
+    """Returns the columns to write to a new CSV file.
+
+    Args:
+        optional_fieldnames: Optional columns to include, such as
+            CACHE_FIELDNAMES. Every other column is always included.
+    """
+    return tuple(
+        name for name in _FIELDNAMES
+        if name not in _OPTIONAL_FIELDNAMES or name in optional_fieldnames)
+
+
+def open_output_file(output_path):
+    """Opens the output file for a CsvSerializer.
+
+    CsvSerializer needs the mode to either be 'r+' or 'w'.
+
+    Args:
+        output_path: Path to output file to open or create.
+    """
+    if os.path.exists(output_path):
+        return open(output_path, 'r+')
+    else:
+        return open(output_path, 'w')
+
 
 class CsvSerializer(object):
-    """Serializes SiaState to a CSV file."""
+    """Serializes SiaState to a CSV file.
+
+    Appending to a file written by an older version keeps writing the
+    columns in the file's header, so every row lines up with the header.
 
-    def __init__(self, csv_file):
+    Attributes:
+        fieldnames: Tuple of the columns written to the file.
+        index_writer: A csv_index.IndexWriter to record the offset of rows
+            in, or None to skip indexing.
+    """
+
+    def __init__(self,
+                 csv_file,
+                 flush_policy=None,
+                 time_fn=time.time,
+                 index_writer=None,
+                 fieldnames=None):
         """Creates a serializer, wriiting to the given file.
 
         Args:
             csv_file: Output file to write CSV to. If file is empty,
                 CsvSerializer will write a header row. Caller must open the file
                 in either 'w' or 'r+' mode, as 'a' will not let us detect
-                whether to write a header on Windows.
+                whether to write a header on Windows, nor read the header of
+                an existing file.
+            flush_policy: FlushPolicy that controls how many rows to buffer
+                before writing them to csv_file. Defaults to flushing after
+                every row.
+            time_fn: A function that returns the current time in seconds.
+            index_writer: A csv_index.IndexWriter to record the offset of
+                rows in, or None to skip indexing.
+            fieldnames: Columns to write to a new file, as returned by
+                select_fieldnames. Defaults to the columns that are always
+                written.
+
+        Raises:
+            ValueError: If the file is not a metrics CSV file.
         """
+        if fieldnames is None:
+            fieldnames = select_fieldnames()
         _seek_to_end_of_file(csv_file)
         is_empty_file = _is_empty_file(csv_file)
+        if is_empty_file:
+            self.fieldnames = fieldnames
+        else:
+            self.fieldnames = _read_header(csv_file)
+            _warn_of_missing_fieldnames(csv_file, fieldnames, self.fieldnames)
+        # Returns a tuple of every field of a SiaState but the timestamp, in
+        # column order.
+        self._get_non_timestamp_fields = _fields_getter(self.fieldnames[1:])
         self._csv_file = csv_file
-        self._csv_writer = csv.DictWriter(
-            csv_file,
-            fieldnames=[
-                'timestamp',
-                'contract_count',
-                'file_count',
-                'uploads_in_progress_count',
-                'total_contract_size',
-                'total_file_bytes',
-                'uploaded_bytes',
-                'total_contract_spending',
-                'contract_fee_spending',
-                'storage_spending',
-                'upload_spending',
-                'download_spending',
-                'remaining_renter_funds',
-                'wallet_siacoin_balance',
-                'wallet_outgoing_siacoins',
-                'wallet_incoming_siacoins',
-                'api_latency',
-            ],
-            lineterminator='\n')
+        self.index_writer = index_writer
+        # Offset in csv_file at which the next flush will write.
+        self._file_offset = csv_file.tell()
+        self._flush_policy = flush_policy or FlushPolicy()
+        self._time_fn = time_fn
+        self._last_flush_time = time_fn()
+        self._buffered_rows = 0
+        self._buffer = io.BytesIO()
+        self._csv_writer = csv.writer(self._buffer, lineterminator='\n')
         if is_empty_file:
-            self._csv_writer.writeheader()
+            self._csv_writer.writerow(self.fieldnames)
+            self.flush()
+
+    @property
+    def size(self):
+        """Size in bytes of the CSV file, including buffered rows."""
+        return self._file_offset + self._buffer.tell()
 
     def write_state(self, state):
-        self._csv_writer.writerow(_state_to_dict(state))
+        timestamp = state.timestamp.strftime('%Y-%m-%dT%H:%M:%S')
+        if self.index_writer:
+            self.index_writer.add_row(timestamp,
+                                      self._file_offset + self._buffer.tell())
+        # Write fields straight from state rather than building a dict of
+        # them, which DictWriter would then turn back into a list.
+        self._csv_writer.writerow(
+            (timestamp,) + self._get_non_timestamp_fields(state))
+        self._buffered_rows += 1
+        if self._should_flush():
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered rows to the file and flushes it."""
+        buffered = self._buffer.getvalue()
+        if buffered:
+            self._csv_file.write(buffered)
+            self._file_offset += len(buffered)
+            self._buffer.seek(0)
+            self._buffer.truncate()
         self._csv_file.flush()
+        if self._flush_policy.fsync:
+            os.fsync(self._csv_file.fileno())
+        if self.index_writer:
+            self.index_writer.flush()
+        self._buffered_rows = 0
+        self._last_flush_time = self._time_fn()
+
+    def _should_flush(self):
+        policy = self._flush_policy
+        if policy.max_rows is not None and (self._buffered_rows >=
+                                            policy.max_rows):
+            return True
+        if policy.max_bytes is not None and (self._buffer.tell() >=
+                                             policy.max_bytes):
+            return True
+        if policy.max_interval is not None and (
+                self._time_fn() - self._last_flush_time >= policy.max_interval):
+            return True
+        return False
 
 
 def _seek_to_end_of_file(file_handle):
@@ -57,7 +221,43 @@ def _is_empty_file(file_handle):
     return file_handle.tell() == 0
 
 
-def _state_to_dict(state):
-    d = state.as_dict()
-    d['timestamp'] = state.timestamp.strftime('%Y-%m-%dT%H:%M:%S')
-    return d
+def _read_header(csv_file):
+    """Reads the columns of an existing CSV file.
+
+    Leaves the file positioned at its end.
+
+    Raises:
+        ValueError: If the file is not a metrics CSV file.
+    """
+    csv_file.seek(0)
+    header = tuple(next(csv.reader([csv_file.readline()]), []))
+    _seek_to_end_of_file(csv_file)
+    if header[:1] != ('timestamp',):
+        raise ValueError('%s is not a metrics CSV file' % _file_name(csv_file))
+    return header
+
+
+def _warn_of_missing_fieldnames(csv_file, wanted_fieldnames, fieldnames):
+    missing_fieldnames = [
+        name for name in wanted_fieldnames if name not in fieldnames
+    ]
+    if missing_fieldnames:
+        logger.warning(
+            '%s was written by an older version, so it will not store %s. '
+            'Write to a new file to keep them.', _file_name(csv_file),
+            ', '.join(missing_fieldnames))
+
+
+def _fields_getter(fieldnames):
+    """Returns a function that returns the given fields of a SiaState.
+
+    Columns that a SiaState has no field for, such as those a newer version
+    added to the file, are left empty.
+    """
+    if len(fieldnames) > 1 and all(name in _FIELDNAMES for name in fieldnames):
+        return operator.attrgetter(*fieldnames)
+    return lambda state: tuple(getattr(state, name, None) for name in fieldnames)
+
+
+def _file_name(csv_file):
+    return getattr(csv_file, 'name', 'The CSV file')
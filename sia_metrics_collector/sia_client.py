@@ -0,0 +1,157 @@
+"""Clients for the Sia API."""
+
+import requests
+from requests import adapters
+from requests.packages.urllib3.util import retry
+
+import json_stream
+import profiling
+
+# Size (in bytes) of each chunk to read from a streaming API response.
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Default number of seconds to wait to connect to Sia, and for Sia to send
+# each part of a response.
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+
+# Default number of times to retry a failed API call.
+DEFAULT_RETRIES = 2
+
+# Seconds to wait before the first retry. Each later retry waits twice as
+# long as the one before.
+_RETRY_BACKOFF_FACTOR = 0.25
+
+# HTTP statuses that mean Sia is temporarily unable to respond.
+_RETRY_STATUSES = (502, 503, 504)
+
+# Maximum number of connections to keep open to Sia. Builder makes at most
+# one call to each of its three APIs at once.
+_MAX_CONNECTIONS = 3
+
+_HEADERS = {'User-agent': 'Sia-Agent'}
+
+
+class SiaClient(object):
+    """A client for the Sia API that reuses connections between calls.
+
+    Unlike pysia, which opens a new connection for every call, SiaClient
+    keeps a small pool of keep-alive connections open to Sia. It is safe to
+    call from multiple threads.
+
+    Responses that Sia sends with an error status are returned like any
+    other, as Sia describes the error in the JSON body.
+    """
+
+    def __init__(self,
+                 host='http://localhost',
+                 port=9980,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES,
+                 profiler=None):
+        """Creates a new SiaClient instance.
+
+        Args:
+            host: Hostname of the Sia node, including the scheme.
+            port: Siad API port of the Sia node.
+            connect_timeout: Number of seconds to wait to connect to Sia.
+            read_timeout: Number of seconds to wait for Sia to send each part
+                of a response.
+            retries: Number of times to retry a call that fails to connect or
+                that Sia answers with a 502, 503, or 504 status.
+            profiler: A profiling.Profiler to time the fetch and decode
+                phases of each call with, or None.
+        """
+        self._url_base = '%s:%s' % (host, port)
+        self._timeout = (connect_timeout, read_timeout)
+        self._profiler = profiler
+        self._session = requests.Session()
+        self._session.headers.update(_HEADERS)
+        adapter = adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=_MAX_CONNECTIONS,
+            max_retries=retry.Retry(
+                total=retries,
+                backoff_factor=_RETRY_BACKOFF_FACTOR,
+                status_forcelist=_RETRY_STATUSES,
+                raise_on_status=False))
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def get_renter_contracts(self):
+        return self._get('/renter/contracts')
+
+    def get_renter_files(self):
+        return self._get('/renter/files')
+
+    def get_wallet(self):
+        return self._get('/wallet')
+
+    def get_raw(self, path):
+        """Calls a Sia API without decoding its response.
+
+        Args:
+            path: Path of the API to call, e.g. /wallet.
+
+        Returns:
+            The body of Sia's response, as a string.
+
+        Raises:
+            requests.RequestException: If the call fails to connect or times
+                out on every attempt.
+        """
+        with profiling.phase(self._profiler, 'fetch'):
+            return self._session.get(
+                self._url_base + path, timeout=self._timeout).content
+
+    def iter_renter_files(self):
+        """Yields each file known to Sia without loading the full response.
+
+        pysia and get_renter_files decode each response in full, which for
+        /renter/files means holding every file known to Sia in memory at
+        once. This instead decodes the response body as it arrives.
+
+        Yields:
+            Each file in the "files" list of the /renter/files response.
+
+        Raises:
+            ValueError: If the response does not contain a list of files.
+        """
+        response = self._session.get(
+            self._url_base + '/renter/files',
+            timeout=self._timeout,
+            stream=True)
+        try:
+            for f in json_stream.iter_array_items(
+                    response.iter_content(_STREAM_CHUNK_SIZE), u'files'):
+                yield f
+        finally:
+            response.close()
+
+    def close(self):
+        """Closes every connection to Sia."""
+        self._session.close()
+
+    def _get(self, path):
+        """Calls a Sia API.
+
+        Args:
+            path: Path of the API to call.
+
+        Returns:
+            The decoded JSON body of Sia's response, or None if the body is
+            not valid JSON.
+
+        Raises:
+            requests.RequestException: If the call fails to connect or times
+                out on every attempt.
+        """
+        with profiling.phase(self._profiler, 'fetch'):
+            response = self._session.get(
+                self._url_base + path, timeout=self._timeout)
+        with profiling.phase(self._profiler, 'decode'):
+            try:
+                return response.json()
+            except ValueError:
+                return None
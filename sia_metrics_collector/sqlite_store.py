@@ -0,0 +1,219 @@
+"""Stores SiaState rows in an indexed SQLite database.
+
+The database has a single table, metrics, with a node column naming the Sia
+node each row came from, followed by one column per SiaState field.
+Timestamps are stored as text in the same format as the CSV output, which
+sorts in time order. Hastings amounts are stored as decimal text, as they
+overflow SQLite's 64-bit integers; CAST them to REAL to do arithmetic on
+them.
+
+The database runs in write-ahead log (WAL) mode, so readers such as
+dashboards can query it while the collector is writing, without blocking the
+collector or seeing partly written batches.
+"""
+
+import datetime
+import sqlite3
+import threading
+
+import columnar
+import state
+
+TABLE_NAME = 'metrics'
+
+# Default number of rows to insert in each transaction. Each commit has to
+# write the WAL, so inserting one row at a time is far slower.
+DEFAULT_ROWS_PER_TRANSACTION = 10
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# SQLite type of each columnar column type.
+_SQL_TYPES = {
+    columnar.TIMESTAMP: 'TEXT',
+    columnar.INT64: 'INTEGER',
+    columnar.FLOAT64: 'REAL',
+    columnar.HASTINGS: 'TEXT',
+}
+
+_FIELDNAMES = tuple(name for name, _ in columnar.COLUMNS)
+_HASTINGS_FIELDS = frozenset(name for name, column_type in columnar.COLUMNS
+                             if column_type == columnar.HASTINGS)
+
+
+class SqliteSerializer(object):
+    """Serializes SiaState to a SQLite database.
+
+    To write the rows of several nodes, e.g. of a fleet, through a single
+    connection, write each node's rows through the serializer that for_node
+    returns. Rows of every node are buffered and inserted together.
+    """
+
+    def __init__(self,
+                 path,
+                 node=None,
+                 rows_per_transaction=DEFAULT_ROWS_PER_TRANSACTION):
+        """Creates a serializer, appending to the database at the given path.
+
+        Creates the database if it does not exist, and adds columns for any
+        SiaState fields that an older database lacks.
+
+        Args:
+            path: Path to the SQLite database file.
+            node: Name of the Sia node whose metrics write_state writes,
+                stored in each row's node column, or None to write only
+                through for_node.
+            rows_per_transaction: Number of rows to buffer before inserting
+                them all in a single transaction.
+        """
+        # Rows may be written from a different thread than the one that
+        # opened the database (e.g. by a writer.QueuedWriter), or from
+        # several threads at once (e.g. by the nodes of a fleet), so _lock
+        # guards the connection and _buffered_rows.
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode, a crash can lose the last transactions but never
+        # corrupts the database, so there's no need to sync every commit.
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        _create_or_update_table(self._connection)
+        self._node = node
+        self._rows_per_transaction = rows_per_transaction
+        self._insert_sql = 'INSERT INTO %s (node, %s) VALUES (?, %s)' % (
+            TABLE_NAME, ', '.join(_FIELDNAMES), ', '.join(
+                '?' for _ in _FIELDNAMES))
+        self._buffered_rows = []
+
+    def for_node(self, node):
+        """Returns a serializer that writes the rows of a node through this one.
+
+        Args:
+            node: Name of the Sia node, stored in each row's node column.
+        """
+        return _NodeSerializer(self, node)
+
+    def write_state(self, sia_state):
+        self.write_node_state(self._node, sia_state)
+
+    def write_node_state(self, node, sia_state):
+        """Writes a SiaState of the given node."""
+        row = (node,) + tuple(
+            _to_sql(name, getattr(sia_state, name)) for name in _FIELDNAMES)
+        with self._lock:
+            self._buffered_rows.append(row)
+            if len(self._buffered_rows) >= self._rows_per_transaction:
+                self._insert_buffered_rows()
+
+    def flush(self):
+        """Inserts all buffered rows in a single transaction."""
+        with self._lock:
+            self._insert_buffered_rows()
+
+    def close(self):
+        with self._lock:
+            self._insert_buffered_rows()
+            self._connection.close()
+
+    def _insert_buffered_rows(self):
+        if not self._buffered_rows:
+            return
+        with self._connection:
+            self._connection.executemany(self._insert_sql, self._buffered_rows)
+        self._buffered_rows = []
+
+
+class _NodeSerializer(object):
+    """Writes the rows of one node through a shared SqliteSerializer."""
+
+    def __init__(self, serializer, node):
+        self._serializer = serializer
+        self._node = node
+
+    def write_state(self, sia_state):
+        self._serializer.write_node_state(self._node, sia_state)
+
+    def flush(self):
+        self._serializer.flush()
+
+
+def iter_states(path, node=None, start=None, end=None):
+    """Reads rows from a database written by SqliteSerializer.
+
+    Args:
+        path: Path to the SQLite database file.
+        node: Name of the Sia node whose rows to read, or None for every
+            node's rows.
+        start: Earliest timestamp (as a datetime) to include, or None to start
+            at the first row.
+        end: Timestamp (as a datetime) at which to stop, exclusive, or None to
+            continue to the last row.
+
+    Yields:
+        A (node, SiaState) pair for each matching row, in timestamp order.
+    """
+    conditions = []
+    parameters = []
+    if node is not None:
+        conditions.append('node = ?')
+        parameters.append(node)
+    if start is not None:
+        conditions.append('timestamp >= ?')
+        parameters.append(start.strftime(_TIMESTAMP_FORMAT))
+    if end is not None:
+        conditions.append('timestamp < ?')
+        parameters.append(end.strftime(_TIMESTAMP_FORMAT))
+    sql = 'SELECT node, %s FROM %s' % (', '.join(_FIELDNAMES), TABLE_NAME)
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY timestamp, rowid'
+    connection = sqlite3.connect(path)
+    try:
+        for row in connection.execute(sql, parameters):
+            yield row[0], state.SiaState(
+                **{
+                    name: _from_sql(name, value)
+                    for name, value in zip(_FIELDNAMES, row[1:])
+                })
+    finally:
+        connection.close()
+
+
+def _create_or_update_table(connection):
+    with connection:
+        existing_columns = set(
+            row[1]
+            for row in connection.execute('PRAGMA table_info(%s)' % TABLE_NAME))
+        if not existing_columns:
+            connection.execute('CREATE TABLE %s (node TEXT NOT NULL, %s)' %
+                               (TABLE_NAME, ', '.join(
+                                   '%s %s' % (name, _SQL_TYPES[column_type])
+                                   for name, column_type in columnar.COLUMNS)))
+        else:
+            for name, column_type in columnar.COLUMNS:
+                if name not in existing_columns:
+                    connection.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                                       (TABLE_NAME, name,
+                                        _SQL_TYPES[column_type]))
+        connection.execute('CREATE INDEX IF NOT EXISTS %s_timestamp ON %s '
+                           '(timestamp)' % (TABLE_NAME, TABLE_NAME))
+        connection.execute('CREATE INDEX IF NOT EXISTS %s_node_timestamp ON %s '
+                           '(node, timestamp)' % (TABLE_NAME, TABLE_NAME))
+
+
+def _to_sql(name, value):
+    if value is None:
+        return None
+    if name == 'timestamp':
+        return value.strftime(_TIMESTAMP_FORMAT)
+    if name in _HASTINGS_FIELDS:
+        return str(value)
+    return value
+
+
+def _from_sql(name, value):
+    if value is None:
+        return None
+    if name == 'timestamp':
+        return datetime.datetime.strptime(value, _TIMESTAMP_FORMAT)
+    if name in _HASTINGS_FIELDS:
+        return long(value)
+    return value
@@ -1,16 +1,83 @@
 import recordtype
 import datetime
+import hashlib
+import itertools
 import json
 import logging
+import threading
 
-import pysia
+import aggregate
+import profiling
+import sia_client
 
 logger = logging.getLogger(__name__)
 
 
-def make_builder(sia_hostname, sia_port):
-    """Makes a Builder using production mode defaults."""
-    return Builder(pysia.Sia(sia_hostname, sia_port), datetime.datetime.utcnow)
+def make_builder(sia_hostname,
+                 sia_port,
+                 concurrent=False,
+                 stream_files=False,
+                 incremental=False,
+                 intervals=None,
+                 api_timeout=sia_client.DEFAULT_READ_TIMEOUT,
+                 api_retries=sia_client.DEFAULT_RETRIES,
+                 contract_listener=None,
+                 recorder=None,
+                 skip_unchanged=False,
+                 deadlines=None,
+                 poll_budget=None,
+                 profiler=None,
+                 time_fn=datetime.datetime.utcnow):
+    """Makes a Builder using production mode defaults.
+
+    Args:
+        sia_hostname: Hostname of Sia node to query.
+        sia_port: Siad API port of the Sia node.
+        concurrent: If True, the Builder queries all Sia APIs in parallel.
+        stream_files: If True, the Builder decodes the list of files
+            incrementally instead of loading it into memory all at once.
+        incremental: If True, the Builder updates contract and file metrics
+            from only the contracts and files that changed since the last
+            build.
+        intervals: A dict of metric group (one of METRIC_GROUPS) to the
+            minimum number of seconds between queries for that group.
+        api_timeout: Number of seconds to wait for Sia to send each part of
+            a response.
+        api_retries: Number of times to retry a failed API call.
+        contract_listener: A function to call with each build's timestamp
+            and the contracts it queried.
+        recorder: A recording.Recorder to save every API response to.
+        skip_unchanged: If True, the Builder reuses a metric group's sums
+            while Sia's response for it stays the same.
+        deadlines: A dict of metric group to the number of seconds a build
+            waits for that group's query.
+        poll_budget: Number of seconds a build waits for all of its queries.
+        profiler: A profiling.Profiler to time each phase of a build with.
+        time_fn: A function that returns the current time as a UTC datetime.
+    """
+    sia_api = sia_client.SiaClient(
+        sia_hostname,
+        sia_port,
+        read_timeout=api_timeout,
+        retries=api_retries,
+        profiler=profiler)
+    build_listener = None
+    if recorder:
+        sia_api = recorder.wrap(sia_api)
+        build_listener = recorder.save_poll
+    return Builder(
+        sia_api,
+        time_fn,
+        concurrent=concurrent,
+        stream_files=stream_files,
+        incremental=incremental,
+        intervals=intervals,
+        contract_listener=contract_listener,
+        build_listener=build_listener,
+        skip_unchanged=skip_unchanged,
+        deadlines=deadlines,
+        poll_budget=poll_budget,
+        profiler=profiler)
 
 
 """Represents a set of Sia metrics at a moment in time.
@@ -49,6 +116,31 @@ Fields:
     wallet_incoming_siacoins: Unconfirmed incoming Siacoins (in hastings).
     api_latency: Time (in milliseconds) it took for Sia to respond to
         all API calls.
+    contracts_api_latency: Time (in milliseconds) it took for Sia to
+        respond to the /renter/contracts API call.
+    files_api_latency: Time (in milliseconds) it took for Sia to respond
+        to the /renter/files API call.
+    wallet_api_latency: Time (in milliseconds) it took for Sia to respond
+        to the /wallet API call.
+    contracts_age: Time (in seconds) since the contract metrics were queried.
+        This is 0 unless they were reused from an earlier build.
+    files_age: Time (in seconds) since the file metrics were queried.
+    wallet_age: Time (in seconds) since the wallet metrics were queried.
+    response_cache_hits: Number of API responses that were identical to the
+        previous response, so their metrics were reused rather than
+        recomputed. None unless the Builder skips unchanged responses.
+    response_cache_misses: Number of API responses that changed since the
+        previous response, or that had no previous response.
+    contracts_status: Outcome of the contracts query: STATUS_OK,
+        STATUS_FAILED, or STATUS_TIMED_OUT. None unless the Builder has
+        deadlines, or if the build reused earlier contract metrics.
+    files_status: Outcome of the files query.
+    wallet_status: Outcome of the wallet query.
+    write_queue_depth: Number of earlier states still waiting to be written
+        when this one was queued. None unless written by a
+        writer.QueuedWriter.
+    dropped_state_count: Number of states the writer.QueuedWriter has
+        dropped because its queue was full.
 """
 SiaState = recordtype.recordtype(
     'SiaState', [
@@ -69,101 +161,619 @@ SiaState = recordtype.recordtype(
         'wallet_outgoing_siacoins',
         'wallet_incoming_siacoins',
         'api_latency',
+        'contracts_api_latency',
+        'files_api_latency',
+        'wallet_api_latency',
+        'contracts_age',
+        'files_age',
+        'wallet_age',
+        'response_cache_hits',
+        'response_cache_misses',
+        'contracts_status',
+        'files_status',
+        'wallet_status',
+        'write_queue_depth',
+        'dropped_state_count',
     ],
     default=None)
 SiaState.as_dict = SiaState._asdict
 
+# SiaState fields that are sums of contract fields, in the order that
+# _contract_values returns them.
+_CONTRACT_SUM_FIELDS = (
+    'total_contract_size',
+    'total_contract_spending',
+    'contract_fee_spending',
+    'storage_spending',
+    'upload_spending',
+    'download_spending',
+    'remaining_renter_funds',
+)
+
+# SiaState fields that are sums of file fields, in the order that _file_values
+# returns them.
+_FILE_SUM_FIELDS = (
+    'total_file_bytes',
+    'uploaded_bytes',
+    'uploads_in_progress_count',
+)
+
+# Groups of metrics that each come from a single Sia API query.
+METRIC_GROUPS = ('contracts', 'files', 'wallet')
+
+# SiaState fields populated by each metric group.
+_GROUP_FIELDS = {
+    'contracts': ('contract_count',) + _CONTRACT_SUM_FIELDS,
+    'files': ('file_count',) + _FILE_SUM_FIELDS,
+    'wallet': ('wallet_siacoin_balance', 'wallet_outgoing_siacoins',
+               'wallet_incoming_siacoins'),
+}
+
+# Path of the Sia API that each metric group comes from.
+_GROUP_PATHS = {
+    'contracts': '/renter/contracts',
+    'files': '/renter/files',
+    'wallet': '/wallet',
+}
+
+# Values of the <group>_status fields of SiaState. They are numbers rather
+# than names so that they fit the numeric columns of every output format.
+STATUS_OK = 0
+STATUS_FAILED = 1
+STATUS_TIMED_OUT = 2
+"""What a single query of a metric group produced.
+
+Each query fills a result of its own rather than the Builder's fields, and
+the build merges the result once the query returns, so a query that misses
+its deadline changes nothing that later builds read.
+
+Fields:
+    state: SiaState holding the group's metrics and the query's latency.
+    sums: aggregate.IncrementalSum of the group's contracts or files, which
+        the query updates, or None if the Builder is not incremental.
+    changes: aggregate.Changes counting the contracts or files that changed.
+    contracts: (active, inactive) lists of the contracts the query read, if
+        the Builder has a contract listener.
+    cache_hit: For a group whose responses are hashed, whether the response
+        was the same as the last one, or None if the query failed before
+        getting a response.
+    response: For a group whose responses are hashed, the (hash, field
+        values, contracts) to reuse for the next identical response, or
+        None to reuse nothing.
+"""
+_QueryResult = recordtype.recordtype('_QueryResult', [
+    'state', ('sums', None), ('changes', None), ('contracts', None),
+    ('cache_hit', None), ('response', None)
+])
+
+# A metric group is due for a query if its interval has passed, give or take
+# this much, so that small timing jitter between builds doesn't push a query
+# back by a whole poll.
+_INTERVAL_TOLERANCE = datetime.timedelta(milliseconds=500)
+
 
 class Builder(object):
-    """Builds a SiaState object by querying the Sia API."""
+    """Builds a SiaState object by querying the Sia API.
+
+    Attributes:
+        contract_changes: An aggregate.Changes instance counting the
+            contracts that changed in the most recent build, or None if the
+            Builder is not incremental or has not yet read contracts.
+        file_changes: An aggregate.Changes instance counting the files that
+            changed in the most recent build, or None if the Builder is not
+            incremental or has not yet read files.
+    """
 
-    def __init__(self, sia_api, time_fn):
+    def __init__(self,
+                 sia_api,
+                 time_fn,
+                 concurrent=False,
+                 stream_files=False,
+                 incremental=False,
+                 intervals=None,
+                 contract_listener=None,
+                 build_listener=None,
+                 skip_unchanged=False,
+                 deadlines=None,
+                 poll_budget=None,
+                 profiler=None):
         """Creates a new Builder instance.
 
         Args:
             sia_api: An implementation of the Sia client API.
             time_fn: A function that returns the current time.
+            concurrent: If True, queries each Sia API on its own thread so
+                that a build takes as long as the slowest API call rather
+                than the sum of all of them. sia_api must be safe to call
+                from multiple threads.
+            stream_files: If True, reads files from sia_api's
+                iter_renter_files method, which yields files one at a time,
+                so that memory use stays flat no matter how many files Sia
+                holds.
+            incremental: If True, caches the fields of each contract (by id)
+                and file (by siapath) between builds and adjusts the sums
+                only for those that were added, removed, or changed.
+            intervals: A dict of metric group (one of METRIC_GROUPS) to the
+                minimum number of seconds between queries for that group.
+                Builds in between reuse the group's metrics from the last
+                successful query and report their age. Groups not in the
+                dict are queried on every build.
+            contract_listener: A function to call after each build that
+                queried contracts successfully, with the build's timestamp
+                and an iterable of every active and inactive contract, as
+                returned by the /renter/contracts API.
+            build_listener: A function to call with each SiaState that the
+                Builder builds.
+            skip_unchanged: If True, fetches each response through sia_api's
+                get_raw method and hashes it. If a response is byte for byte
+                the same as the group's previous response, reuses the
+                metrics computed from that response instead of decoding and
+                summing it again. Doesn't apply to files if stream_files is
+                True, as hashing the response means reading all of it.
+            deadlines: A dict of metric group (one of METRIC_GROUPS) to the
+                maximum number of seconds to wait for that group's query.
+            poll_budget: Maximum number of seconds to wait for all of a
+                build's queries.
+            profiler: A profiling.Profiler to time the decode and aggregate
+                phases of each query with, and to run queries under when it
+                takes a snapshot, or None.
+
+        If deadlines or poll_budget is set, each query runs on its own
+        thread, and a build that runs out of time returns without the
+        queries that are still running. Their metrics are left empty and
+        their status is STATUS_TIMED_OUT, and their results are dropped when
+        they return. A group isn't queried again until its late query
+        returns, so a hung API call ties up one thread at most.
+
+        Raises:
+            ValueError: If intervals or deadlines contains an unknown metric
+                group.
         """
+        intervals = intervals or {}
+        deadlines = deadlines or {}
+        for group in itertools.chain(intervals, deadlines):
+            if group not in METRIC_GROUPS:
+                raise ValueError('Unknown metric group: %s' % group)
         self._sia_api = sia_api
         self._time_fn = time_fn
+        self._concurrent = concurrent
+        self._stream_files = stream_files
+        self._contract_sums = None
+        self._file_sums = None
+        if incremental:
+            self._contract_sums = aggregate.IncrementalSum(
+                len(_CONTRACT_SUM_FIELDS))
+            self._file_sums = aggregate.IncrementalSum(len(_FILE_SUM_FIELDS))
+        self._intervals = {
+            group: datetime.timedelta(seconds=seconds)
+            for group, seconds in intervals.iteritems()
+        }
+        # Dict of metric group to (time of build, field values) from the most
+        # recent successful query of that group.
+        self._last_queries = {}
+        self._contract_listener = contract_listener
+        self._build_listener = build_listener
+        # Active and inactive contracts from the current build's query, or
+        # None if the build didn't query contracts.
+        self._queried_contracts = None
+        # Dict of metric group to the function that populates state from a
+        # decoded response, for groups whose responses are hashed.
+        self._hashed_groups = {}
+        if skip_unchanged:
+            self._hashed_groups['contracts'] = self._apply_contracts_response
+            self._hashed_groups['wallet'] = self._apply_wallet_response
+            if not stream_files:
+                self._hashed_groups['files'] = self._apply_files_response
+        # Dict of metric group to (hash, field values, contracts) from the
+        # group's most recent successful response. The contracts are kept
+        # only for the contracts group, and only if there's a listener.
+        self._last_responses = {}
+        # Dict of metric group to whether its response in the current build
+        # was unchanged.
+        self._cache_results = {}
+        self._deadlines = deadlines
+        self._poll_budget = poll_budget
+        self._has_deadlines = bool(deadlines) or poll_budget is not None
+        # Dict of metric group to the thread that last ran its query, when
+        # the Builder has deadlines.
+        self._query_threads = {}
+        self._profiler = profiler
+        self.contract_changes = None
+        self.file_changes = None
 
     def build(self):
         """Builds a SiaState object representing the current state of Sia."""
         state = SiaState()
+        self._queried_contracts = None
+        self._cache_results = {}
         queries_start_time = self._time_fn()
-        state_population_fns = (self._populate_contract_metrics,
-                                self._populate_file_metrics,
-                                self._populate_wallet_metrics,
-                                self._populate_timestamp)
-        for fn in state_population_fns:
-            try:
-                fn(state)
-            except Exception as e:
-                logging.error('Error when calling %s: %s', fn.__name__,
-                              e.message)
-                continue
+        all_queries = (
+            ('contracts', self._populate_contract_metrics,
+             'contracts_api_latency'),
+            ('files', self._populate_file_metrics, 'files_api_latency'),
+            ('wallet', self._populate_wallet_metrics, 'wallet_api_latency'),
+        )
+        queries = []
+        for group, fn, latency_field in all_queries:
+            if self._is_due(group, queries_start_time):
+                queries.append((group, fn, latency_field))
+            else:
+                self._reuse_last_query(state, group, queries_start_time)
+        if self._has_deadlines:
+            finished_groups = self._run_queries_within_deadlines(
+                state, queries, queries_start_time)
+        else:
+            finished_groups = self._run_queries(state, queries)
+        for group in finished_groups:
+            self._save_query(state, group, queries_start_time)
+        if self._hashed_groups:
+            hits = self._cache_results.values()
+            state.response_cache_hits = sum(1 for hit in hits if hit)
+            state.response_cache_misses = len(hits) - state.response_cache_hits
+        self._populate_timestamp(state)
         state.api_latency = (
             self._time_fn() - queries_start_time).total_seconds() * 1000.0
+        if self._contract_listener and self._queried_contracts:
+            self._contract_listener(state.timestamp,
+                                    itertools.chain(*self._queried_contracts))
+            self._queried_contracts = None
+        if self._build_listener:
+            self._build_listener(state)
         return state
 
+    def _is_due(self, group, now):
+        if group not in self._intervals or group not in self._last_queries:
+            return True
+        query_time, _ = self._last_queries[group]
+        return now - query_time >= self._intervals[group] - _INTERVAL_TOLERANCE
+
+    def _reuse_last_query(self, state, group, now):
+        query_time, values = self._last_queries[group]
+        _set_fields(state, _GROUP_FIELDS[group], values)
+        setattr(state, group + '_age', (now - query_time).total_seconds())
+
+    def _save_query(self, state, group, now):
+        values = tuple(getattr(state, field) for field in _GROUP_FIELDS[group])
+        if all(value is None for value in values):
+            # The query failed, so try again on the next build.
+            return
+        self._last_queries[group] = (now, values)
+        setattr(state, group + '_age', 0.0)
+
+    def _new_result(self, group):
+        """Returns a _QueryResult for a query of the given group to fill."""
+        sums = {
+            'contracts': self._contract_sums,
+            'files': self._file_sums,
+        }.get(group)
+        return _QueryResult(state=SiaState(), sums=sums)
+
+    def _sums_to_update(self, result):
+        """Returns the IncrementalSum that a query should update."""
+        if self._has_deadlines:
+            # Update a copy, so that a query that misses its deadline leaves
+            # the Builder's sums as they were.
+            result.sums = result.sums.copy()
+        return result.sums
+
+    def _run_query(self, result, group, fn, latency_field):
+        """Runs a single query, recording its latency.
+
+        Args:
+            result: _QueryResult to fill with the query's results.
+            group: Metric group that the query populates.
+            fn: Function that queries a Sia API and fills a _QueryResult
+                with the results.
+            latency_field: Name of the SiaState field in which to store the
+                time (in milliseconds) that fn took to run.
+        """
+        query_start_time = self._time_fn()
+        try:
+            if self._profiler:
+                self._profiler.call(self._query, result, group, fn)
+            else:
+                self._query(result, group, fn)
+        except Exception as e:
+            logging.error('Error when calling %s: %s', fn.__name__, e.message)
+        setattr(result.state, latency_field,
+                (self._time_fn() - query_start_time).total_seconds() * 1000.0)
+
+    def _merge_result(self, state, group, result, latency_field):
+        """Applies a finished query's results to state and to the Builder.
+
+        Only ever called on the thread that calls build, so queries never
+        change the Builder's own fields while they run.
+        """
+        fields = _GROUP_FIELDS[group]
+        _set_fields(state, fields,
+                    [getattr(result.state, field) for field in fields])
+        setattr(state, latency_field, getattr(result.state, latency_field))
+        if group == 'contracts':
+            if result.sums is not None:
+                self._contract_sums = result.sums
+                self.contract_changes = result.changes
+            self._queried_contracts = result.contracts
+        elif group == 'files' and result.sums is not None:
+            self._file_sums = result.sums
+            self.file_changes = result.changes
+        if result.cache_hit is not None:
+            self._cache_results[group] = result.cache_hit
+            if result.response is None:
+                self._last_responses.pop(group, None)
+            else:
+                self._last_responses[group] = result.response
+
+    def _run_queries(self, state, queries):
+        """Runs queries and merges their results into state.
+
+        Returns:
+            A list of the groups that were queried.
+        """
+        running = [(group, fn, latency_field, self._new_result(group))
+                   for group, fn, latency_field in queries]
+        if self._concurrent:
+            threads = [
+                threading.Thread(
+                    target=profiling.bind(self._profiler, self._run_query),
+                    args=(result, group, fn, latency_field))
+                for group, fn, latency_field, result in running
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            for group, fn, latency_field, result in running:
+                self._run_query(result, group, fn, latency_field)
+        for group, _, latency_field, result in running:
+            self._merge_result(state, group, result, latency_field)
+        return [group for group, _, _, _ in running]
+
+    def _run_queries_within_deadlines(self, state, queries, start_time):
+        """Runs queries on their own threads, waiting up to their deadlines.
+
+        Each query fills a _QueryResult of its own, which is merged into
+        state and the Builder only if the query returns in time. A late
+        query's result is dropped, so it can't change a state after its
+        build has returned it, or the sums and cached responses that later
+        builds read.
+
+        Args:
+            state: SiaState instance to populate.
+            queries: List of (group, fn, latency_field) tuples of the queries
+                to run, as _run_query takes them.
+            start_time: Time (from time_fn) at which the build started.
+
+        Returns:
+            A list of the groups whose queries returned in time.
+        """
+        wait_start = self._time_fn()
+        running = []
+        for group, fn, latency_field in queries:
+            thread = self._query_threads.get(group)
+            if thread and thread.is_alive():
+                logger.warning(
+                    'Skipping %s query, as the last one has not returned',
+                    group)
+                setattr(state, group + '_status', STATUS_TIMED_OUT)
+                continue
+            result = self._new_result(group)
+            thread = threading.Thread(
+                target=profiling.bind(self._profiler, self._run_query),
+                args=(result, group, fn, latency_field))
+            # Don't let a hung API call keep the process from exiting.
+            thread.daemon = True
+            thread.start()
+            self._query_threads[group] = thread
+            running.append((group, latency_field, result, thread))
+        finished_groups = []
+        for group, latency_field, result, thread in running:
+            thread.join(self._time_left(group, wait_start))
+            if thread.is_alive():
+                logger.error('%s query did not return before its deadline',
+                             group)
+                setattr(state, group + '_status', STATUS_TIMED_OUT)
+                setattr(state, latency_field,
+                        (self._time_fn() - start_time).total_seconds() * 1000.0)
+                continue
+            self._merge_result(state, group, result, latency_field)
+            if all(
+                    getattr(state, field) is None
+                    for field in _GROUP_FIELDS[group]):
+                setattr(state, group + '_status', STATUS_FAILED)
+            else:
+                setattr(state, group + '_status', STATUS_OK)
+            finished_groups.append(group)
+        return finished_groups
+
+    def _time_left(self, group, wait_start):
+        """Returns the seconds left to wait for a query, or None for no limit.
+
+        Args:
+            group: Metric group of the query.
+            wait_start: Time (from time_fn) at which the build started
+                waiting for its queries.
+        """
+        timeouts = [
+            timeout for timeout in (self._deadlines.get(group),
+                                    self._poll_budget) if timeout is not None
+        ]
+        if not timeouts:
+            return None
+        elapsed = (self._time_fn() - wait_start).total_seconds()
+        return max(0.0, min(timeouts) - elapsed)
+
+    def _query(self, result, group, fn):
+        if group in self._hashed_groups:
+            self._populate_unless_unchanged(result, group)
+        else:
+            fn(result)
+
     def _populate_timestamp(self, state):
         state.timestamp = self._time_fn()
 
-    def _populate_contract_metrics(self, state):
+    def _populate_unless_unchanged(self, result, group):
+        """Fills result from a hashed response, reusing unchanged metrics.
+
+        Args:
+            result: _QueryResult to fill.
+            group: Metric group to query.
+        """
+        body = self._sia_api.get_raw(_GROUP_PATHS[group])
+        body_hash = hashlib.sha1(body).digest()
+        last_response = self._last_responses.get(group)
+        if last_response and last_response[0] == body_hash:
+            _, values, contracts = last_response
+            _set_fields(result.state, _GROUP_FIELDS[group], values)
+            result.contracts = contracts
+            if result.sums is not None:
+                result.changes = aggregate.Changes()
+            result.cache_hit = True
+            result.response = last_response
+            return
+        # Until the response is decoded, don't reuse the metrics of an
+        # earlier one.
+        result.cache_hit = False
+        with profiling.phase(self._profiler, 'decode'):
+            try:
+                response = json.loads(body)
+            except ValueError:
+                response = None
+        with profiling.phase(self._profiler, 'aggregate'):
+            self._hashed_groups[group](result, response)
+        values = tuple(
+            getattr(result.state, field) for field in _GROUP_FIELDS[group])
+        if all(value is None for value in values):
+            # Don't reuse the metrics of a response that Sia sent in error.
+            return
+        result.response = (body_hash, values, result.contracts)
+
+    def _populate_contract_metrics(self, result):
         response = self._sia_api.get_renter_contracts()
+        with profiling.phase(self._profiler, 'aggregate'):
+            self._apply_contracts_response(result, response)
+
+    def _apply_contracts_response(self, result, response):
         if not response or not response.has_key(u'activecontracts'):
             logger.error('Failed to query contracts information: %s',
                          json.dumps(response))
             return
         active_contracts = response[u'activecontracts']
         inactive_contracts = response[u'inactivecontracts']
+        self._sum_contracts(result, active_contracts, inactive_contracts)
+        if self._contract_listener:
+            result.contracts = (active_contracts, inactive_contracts)
+
+    def _sum_contracts(self, result, active_contracts, inactive_contracts):
+        state = result.state
+        if result.sums is not None:
+            sums = self._sums_to_update(result)
+            result.changes = sums.update(
+                (contract[u'id'],
+                 _contract_values(contract)) for contract in itertools.chain(
+                     active_contracts, inactive_contracts))
+            state.contract_count = len(sums)
+            _set_fields(state, _CONTRACT_SUM_FIELDS, sums.totals)
+            return
         state.contract_count = len(active_contracts) + len(inactive_contracts)
-        state.total_contract_size = 0
-        state.total_contract_spending = 0
-        state.contract_fee_spending = 0
-        state.storage_spending = 0
-        state.upload_spending = 0
-        state.download_spending = 0
-        state.remaining_renter_funds = 0
-        for contract in (active_contracts + inactive_contracts):
-            state.total_contract_size += long(contract[u'size'])
-            state.total_contract_spending += long(contract[u'totalcost'])
-            state.contract_fee_spending += long(contract[u'fees'])
-            state.storage_spending += long(contract[u'StorageSpending'])
-            state.upload_spending += long(contract[u'uploadspending'])
-            state.download_spending += long(contract[u'downloadspending'])
-            state.remaining_renter_funds += long(contract[u'renterfunds'])
-
-    def _populate_file_metrics(self, state):
-        response = self._sia_api.get_renter_files()
+        # Sum into locals rather than state's fields, and chain the contract
+        # lists rather than concatenating them, to keep the loop from
+        # allocating anything beyond the values it parses.
+        total_contract_size = 0
+        total_contract_spending = 0
+        contract_fee_spending = 0
+        storage_spending = 0
+        upload_spending = 0
+        download_spending = 0
+        remaining_renter_funds = 0
+        for contract in itertools.chain(active_contracts, inactive_contracts):
+            total_contract_size += long(contract[u'size'])
+            total_contract_spending += long(contract[u'totalcost'])
+            contract_fee_spending += long(contract[u'fees'])
+            storage_spending += long(contract[u'StorageSpending'])
+            upload_spending += long(contract[u'uploadspending'])
+            download_spending += long(contract[u'downloadspending'])
+            remaining_renter_funds += long(contract[u'renterfunds'])
+        state.total_contract_size = total_contract_size
+        state.total_contract_spending = total_contract_spending
+        state.contract_fee_spending = contract_fee_spending
+        state.storage_spending = storage_spending
+        state.upload_spending = upload_spending
+        state.download_spending = download_spending
+        state.remaining_renter_funds = remaining_renter_funds
+
+    def _populate_file_metrics(self, result):
+        if self._stream_files:
+            with profiling.phase(self._profiler, 'aggregate'):
+                self._sum_files(result, self._sia_api.iter_renter_files())
+        else:
+            response = self._sia_api.get_renter_files()
+            with profiling.phase(self._profiler, 'aggregate'):
+                self._apply_files_response(result, response)
+
+    def _apply_files_response(self, result, response):
         if not response or not response.has_key(u'files'):
             logger.error('Failed to query file information: %s',
                          json.dumps(response))
             return
-        files = response[u'files']
-        state.file_count = 0
-        state.total_file_bytes = 0
-        state.uploaded_bytes = 0
-        state.uploads_in_progress_count = 0
-        if not files:
+        self._sum_files(result, response[u'files'] or [])
+
+    def _sum_files(self, result, files):
+        state = result.state
+        if result.sums is not None:
+            sums = self._sums_to_update(result)
+            result.changes = sums.update(
+                (f[u'siapath'], _file_values(f)) for f in files)
+            state.file_count = len(sums)
+            _set_fields(state, _FILE_SUM_FIELDS, sums.totals)
             return
+        file_count = 0
+        total_file_bytes = 0
+        uploaded_bytes = 0
+        uploads_in_progress_count = 0
         for f in files:
-            state.file_count += 1
-            state.total_file_bytes += long(f[u'filesize']) * (
+            file_count += 1
+            total_file_bytes += long(f[u'filesize']) * (
                 f[u'uploadprogress'] / 100.0)
-            state.uploaded_bytes += f[u'uploadedbytes']
+            uploaded_bytes += f[u'uploadedbytes']
             if f[u'uploadprogress'] < 100:
-                state.uploads_in_progress_count += 1
+                uploads_in_progress_count += 1
+        state.file_count = file_count
+        state.total_file_bytes = total_file_bytes
+        state.uploaded_bytes = uploaded_bytes
+        state.uploads_in_progress_count = uploads_in_progress_count
 
-    def _populate_wallet_metrics(self, state):
+    def _populate_wallet_metrics(self, result):
         response = self._sia_api.get_wallet()
+        with profiling.phase(self._profiler, 'aggregate'):
+            self._apply_wallet_response(result, response)
+
+    def _apply_wallet_response(self, result, response):
         if not response or not response.has_key(u'confirmedsiacoinbalance'):
             logger.error('Failed to query wallet information: %s',
                          json.dumps(response))
             return
+        state = result.state
         state.wallet_siacoin_balance = long(
             response[u'confirmedsiacoinbalance'])
         state.wallet_outgoing_siacoins = long(
             response[u'unconfirmedoutgoingsiacoins'])
         state.wallet_incoming_siacoins = long(
             response[u'unconfirmedincomingsiacoins'])
+
+
+def _contract_values(contract):
+    return (long(contract[u'size']), long(contract[u'totalcost']),
+            long(contract[u'fees']), long(contract[u'StorageSpending']),
+            long(contract[u'uploadspending']),
+            long(contract[u'downloadspending']), long(contract[u'renterfunds']))
+
+
+def _file_values(f):
+    return (long(f[u'filesize']) * (f[u'uploadprogress'] / 100.0),
+            f[u'uploadedbytes'], 1 if f[u'uploadprogress'] < 100 else 0)
+
+
+def _set_fields(state, fields, values):
+    for field, value in zip(fields, values):
+        setattr(state, field, value)
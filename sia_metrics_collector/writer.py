@@ -0,0 +1,153 @@
+"""Writes SiaState to a set of sinks on a thread of its own.
+
+Writing a row can stall, e.g. on a slow network mount or a blocked stdout. A
+QueuedWriter takes each SiaState from the polling thread, puts it on a
+bounded queue, and returns right away, so a stalled sink never delays the
+next poll. A writer thread drains the queue into every sink in turn.
+
+If the queue fills up, the writer's overflow policy decides whether the
+polling thread waits for room or a SiaState is dropped. Each SiaState that
+passes through the queue records the queue's depth and the number of states
+dropped so far, so a backlog shows up in the metrics themselves.
+"""
+
+import logging
+import Queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Overflow policies, which decide what happens to a SiaState that arrives
+# while the queue is full.
+#
+# Wait until the writer thread makes room.
+BLOCK = 'block'
+# Drop the oldest SiaState in the queue to make room for the new one.
+DROP_OLDEST = 'drop_oldest'
+# Drop the new SiaState.
+DROP_NEWEST = 'drop_newest'
+
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+DEFAULT_MAX_QUEUE_SIZE = 1000
+
+# Seconds to wait for room in the queue at a time under the BLOCK policy. In
+# Python 2, a put with no timeout can't be interrupted by a signal, so the
+# polling thread waits in short steps to let a SIGTERM handler run.
+_PUT_TIMEOUT_SECONDS = 0.5
+
+# Queue item that asks the writer thread to stop.
+_STOP = object()
+
+
+class QueuedWriter(object):
+    """Fans SiaState out to a set of sinks from a writer thread.
+
+    write_state, flush, and close should all be called from the same thread.
+
+    Attributes:
+        dropped_count: Number of states dropped because the queue was full.
+    """
+
+    def __init__(self,
+                 sinks,
+                 max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                 overflow_policy=DROP_OLDEST):
+        """Creates a new QueuedWriter and starts its writer thread.
+
+        Args:
+            sinks: A list of objects with a write_state method, such as
+                serializers or a metrics_server.Exporter, to write each
+                SiaState to in order. Sinks that have a flush method are
+                flushed when the writer is flushed or closed.
+            max_queue_size: Number of states the queue holds before the
+                overflow policy applies.
+            overflow_policy: One of OVERFLOW_POLICIES.
+
+        Raises:
+            ValueError: If the queue size is not positive or the overflow
+                policy is unknown.
+        """
+        if max_queue_size <= 0:
+            raise ValueError('Queue size must be positive: %s' % max_queue_size)
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: %s' % overflow_policy)
+        self._sinks = sinks
+        self._overflow_policy = overflow_policy
+        self._queue = Queue.Queue(max_queue_size)
+        self.dropped_count = 0
+        self._thread = threading.Thread(target=self._write_all)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        """Number of states waiting for the writer thread."""
+        return self._queue.qsize()
+
+    def write_state(self, state):
+        """Queues a SiaState to write to every sink.
+
+        Sets the state's write_queue_depth and dropped_state_count fields
+        before queueing it.
+        """
+        state.write_queue_depth = self._queue.qsize()
+        state.dropped_state_count = self.dropped_count
+        if self._overflow_policy == BLOCK:
+            while True:
+                try:
+                    self._queue.put(state, timeout=_PUT_TIMEOUT_SECONDS)
+                    return
+                except Queue.Full:
+                    pass
+        while True:
+            try:
+                self._queue.put_nowait(state)
+                return
+            except Queue.Full:
+                pass
+            if self._overflow_policy == DROP_NEWEST:
+                self._count_drop()
+                return
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._count_drop()
+            except Queue.Empty:
+                # The writer thread made room in the meantime.
+                pass
+
+    def flush(self):
+        """Waits for every queued state to be written, then flushes sinks."""
+        self._queue.join()
+        for sink in self._sinks:
+            if hasattr(sink, 'flush'):
+                sink.flush()
+
+    def close(self):
+        """Writes every queued state, flushes sinks, and stops the thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+        for sink in self._sinks:
+            if hasattr(sink, 'flush'):
+                sink.flush()
+
+    def _count_drop(self):
+        self.dropped_count += 1
+        logger.warning('Write queue is full, dropped %d states so far',
+                       self.dropped_count)
+
+    def _write_all(self):
+        while True:
+            state = self._queue.get()
+            try:
+                if state is _STOP:
+                    return
+                for sink in self._sinks:
+                    try:
+                        sink.write_state(state)
+                    except Exception as e:
+                        logger.error('Failed to write state to %s: %s',
+                                     type(sink).__name__, e)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,62 @@
+"""Fixtures shared by the tests of the collector's output formats."""
+
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from sia_metrics_collector import state
+
+
+def make_state(minute=0, **fields):
+    """Makes a SiaState with typical values.
+
+    Args:
+        minute: Minute past 2018-02-11 16:00 UTC at which the state was
+            polled.
+        **fields: Values for fields of the state, in place of the typical
+            values.
+    """
+    values = {
+        'timestamp': datetime.datetime(2018, 2, 11, 16, minute, 2),
+        'contract_count': 5,
+        'total_file_bytes': 4444.5,
+        'upload_spending': 35,
+        'wallet_siacoin_balance': 75 * 10**27,
+        'api_latency': 5.0,
+    }
+    values.update(fields)
+    return state.SiaState(**values)
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Test case that gives each test its own temporary directory."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assertStatesEqual(self, expected, actual):
+        self.assertEqual([s.as_dict() for s in expected],
+                         [s.as_dict() for s in actual])
+
+
+class RoundTripTests(object):
+    """Tests that every output format that can be read back must pass.
+
+    Mix into a TempDirTestCase that implements write_states, which writes a
+    list of states to a new file, and read_states, which reads them back.
+    """
+
+    def test_reads_back_written_rows(self):
+        states = [
+            make_state(0),
+            make_state(1, upload_spending=3 * 10**27, api_latency=7.25),
+            make_state(2, upload_spending=None),
+            state.SiaState(timestamp=datetime.datetime(2018, 2, 11, 16, 3, 2)),
+        ]
+        self.write_states(states)
+
+        self.assertStatesEqual(states, self.read_states())
@@ -0,0 +1,74 @@
+import unittest
+
+from sia_metrics_collector import aggregate
+
+
+class IncrementalSumTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sums = aggregate.IncrementalSum(2)
+
+    def test_sums_are_zero_before_first_update(self):
+        self.assertEqual((0, 0), self.sums.totals)
+        self.assertEqual(0, len(self.sums))
+
+    def test_first_update_adds_every_entity(self):
+        changes = self.sums.update([('a', (1, 10)), ('b', (2, 20))])
+
+        self.assertEqual((3, 30), self.sums.totals)
+        self.assertEqual(2, len(self.sums))
+        self.assertEqual(
+            aggregate.Changes(added_count=2, removed_count=0, changed_count=0),
+            changes)
+
+    def test_unchanged_update_reports_no_changes(self):
+        self.sums.update([('a', (1, 10)), ('b', (2, 20))])
+
+        changes = self.sums.update([('b', (2, 20)), ('a', (1, 10))])
+
+        self.assertEqual((3, 30), self.sums.totals)
+        self.assertEqual(aggregate.Changes(), changes)
+
+    def test_copy_updates_independently(self):
+        self.sums.update([('a', (1, 10))])
+
+        copy = self.sums.copy()
+        copy.update([('a', (1, 10)), ('b', (2, 20))])
+
+        self.assertEqual((1, 10), self.sums.totals)
+        self.assertEqual(1, len(self.sums))
+        self.assertEqual((3, 30), copy.totals)
+
+    def test_applies_added_removed_and_changed_entities(self):
+        self.sums.update([('a', (1, 10)), ('b', (2, 20)), ('c', (3, 30))])
+
+        changes = self.sums.update([('a', (1, 10)), ('b', (5, 25)),
+                                    ('d', (100, 200))])
+
+        self.assertEqual((106, 235), self.sums.totals)
+        self.assertEqual(3, len(self.sums))
+        self.assertEqual(
+            aggregate.Changes(added_count=1, removed_count=1, changed_count=1),
+            changes)
+
+    def test_empty_update_removes_every_entity(self):
+        self.sums.update([('a', (0.1, 10)), ('b', (0.2, 20))])
+
+        changes = self.sums.update([])
+
+        self.assertEqual((0, 0), self.sums.totals)
+        self.assertEqual(0, len(self.sums))
+        self.assertEqual(2, changes.removed_count)
+
+    def test_keeps_totals_consistent_when_entities_raise_exception(self):
+        self.sums.update([('a', (1, 10)), ('b', (2, 20))])
+
+        def failing_entities():
+            yield ('a', (4, 40))
+            raise ValueError('dummy truncated response')
+
+        with self.assertRaises(ValueError):
+            self.sums.update(failing_entities())
+
+        self.assertEqual((6, 60), self.sums.totals)
+        self.assertEqual(2, len(self.sums))
@@ -0,0 +1,123 @@
+import json
+import os
+import unittest
+
+from benchmarks import fake_siad
+from benchmarks import run_benchmarks
+from benchmarks import soak
+
+
+class RenderResponsesTest(unittest.TestCase):
+
+    def test_renders_requested_number_of_files_and_contracts(self):
+        responses = fake_siad.render_responses(
+            fake_siad.Workload(file_count=7, contract_count=3))
+
+        self.assertEqual(
+            3, len(
+                json.loads(responses['/renter/contracts'])['activecontracts']))
+        self.assertEqual(7, len(
+            json.loads(responses['/renter/files'])['files']))
+        self.assertIn('confirmedsiacoinbalance', json.loads(
+            responses['/wallet']))
+
+    def test_renders_same_responses_for_same_seed(self):
+        self.assertEqual(
+            fake_siad.render_responses(fake_siad.Workload(seed=5)),
+            fake_siad.render_responses(fake_siad.Workload(seed=5)))
+
+
+class CompareTest(unittest.TestCase):
+
+    def make_result(self, file_count, polls_per_second, peak_rss_kb):
+        return {
+            'workload': {
+                'file_count': file_count,
+                'contract_count': 10,
+                'latency': 0.0,
+                'seed': 0,
+            },
+            'polls_per_second': polls_per_second,
+            'peak_rss_kb': peak_rss_kb,
+        }
+
+    def test_compares_workloads_in_both_runs(self):
+        comparisons = run_benchmarks.compare(
+            [self.make_result(10, 50.0, 300),
+             self.make_result(1000, 5.0, 400)],
+            [self.make_result(10, 100.0, 200)])
+
+        self.assertEqual([(self.make_result(10, 0, 0)['workload'], 0.5, 1.5)],
+                         comparisons)
+
+
+class SoakTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_siad.FakeSiad(fake_siad.Workload())
+        self.server.start()
+        self.options = {
+            'polls': 20,
+            'warmup_polls': 10,
+            'sample_interval': 10,
+            'poll_frequency': 60,
+            'poll_seconds': 1.0,
+            'sleep_overshoot_seconds': 0.0,
+            'concurrent_queries': False,
+            'csv_file': os.devnull,
+            'max_rss_growth_kb': 10 * 1024,
+            'max_fd_growth': 0,
+            'max_thread_growth': 0,
+            'max_drift_seconds': 0.001,
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_samples_resources_through_soak(self):
+        result = soak.run_soak(self.server.port, self.options)
+
+        self.assertEqual([0, 10, 20], [s['poll'] for s in result['samples']])
+        self.assertEqual(0.0, result['max_drift_seconds'])
+        self.assertEqual(0, result['missed_deadlines'])
+        self.assertEqual(20 * 60, result['simulated_seconds'])
+
+    def test_polls_stay_on_schedule_when_polls_overrun(self):
+        self.options['poll_seconds'] = 90.0
+
+        result = soak.run_soak(self.server.port, self.options)
+
+        self.assertGreater(result['missed_deadlines'], 0)
+        self.assertAlmostEqual(0.0, result['max_drift_seconds'])
+
+    def test_drift_stays_within_sleep_overshoot(self):
+        self.options['sleep_overshoot_seconds'] = 0.0005
+
+        result = soak.run_soak(self.server.port, self.options)
+
+        self.assertGreater(result['max_drift_seconds'], 0.0)
+        self.assertLessEqual(result['max_drift_seconds'], 0.0005)
+        self.assertEqual([], soak.check_thresholds(result, self.options))
+
+    def test_fails_drift_check_when_sleeps_overshoot_too_far(self):
+        self.options['sleep_overshoot_seconds'] = 0.5
+
+        result = soak.run_soak(self.server.port, self.options)
+
+        self.assertGreater(result['max_drift_seconds'], 0.001)
+        self.assertIn('A poll strayed',
+                      soak.check_thresholds(result, self.options)[0])
+
+    def test_reports_exceeded_thresholds(self):
+        result = {
+            'rss_growth_kb': 20 * 1024,
+            'fd_growth': 0,
+            'thread_growth': None,
+            'max_drift_seconds': 0.5,
+        }
+
+        self.assertEqual([
+            'RSS grew by 20480 KB (threshold 10240)',
+            'A poll strayed 0.500000s from its deadline (threshold 0.001)'
+        ], soak.check_thresholds(result, self.options))
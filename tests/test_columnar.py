@@ -0,0 +1,149 @@
+import datetime
+import json
+import math
+import os
+import struct
+import unittest
+
+from sia_metrics_collector import columnar
+from sia_metrics_collector import state
+from tests import helpers
+
+
+def _remove_columns_after(store_dir, column_count):
+    """Makes a store look like one written by a version with fewer columns."""
+    with open(os.path.join(store_dir, 'schema.json'), 'w') as schema_file:
+        json.dump({
+            'columns': [list(c) for c in columnar.COLUMNS[:column_count]]
+        }, schema_file)
+    for name, _ in columnar.COLUMNS[column_count:]:
+        os.remove(os.path.join(store_dir, name + '.col'))
+
+
+class ColumnarSerializerTest(helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(ColumnarSerializerTest, self).setUp()
+        self.store_dir = os.path.join(self.temp_dir, 'metrics')
+
+    def read_column_file(self, name):
+        with open(os.path.join(self.store_dir, name + '.col'), 'rb') as f:
+            return f.read()
+
+    def test_writes_fixed_width_values_to_each_column(self):
+        serializer = columnar.ColumnarSerializer(self.store_dir)
+        serializer.write_state(helpers.make_state(2, upload_spending=35))
+        serializer.close()
+
+        self.assertEqual('\x05\x00\x00\x00\x00\x00\x00\x00',
+                         self.read_column_file('contract_count'))
+        self.assertEqual(('\x23\x00\x00\x00\x00\x00\x00\x00'
+                          '\x00\x00\x00\x00\x00\x00\x00\x00'),
+                         self.read_column_file('upload_spending'))
+        self.assertEqual('\x00\x00\x00\x00\x00\x00\x00\x80',
+                         self.read_column_file('file_count'))
+        self.assertEqual('\xff' * 16,
+                         self.read_column_file('download_spending'))
+
+    def test_discards_partial_row_when_reopened(self):
+        serializer = columnar.ColumnarSerializer(self.store_dir)
+        serializer.write_state(helpers.make_state(2, upload_spending=35))
+        serializer.close()
+        with open(os.path.join(self.store_dir, 'contract_count.col'),
+                  'ab') as f:
+            f.write('\x06\x00\x00\x00\x00\x00\x00\x00')
+
+        serializer = columnar.ColumnarSerializer(self.store_dir)
+        serializer.write_state(helpers.make_state(7, upload_spending=36))
+        serializer.close()
+
+        self.assertEqual(('\x05\x00\x00\x00\x00\x00\x00\x00'
+                          '\x05\x00\x00\x00\x00\x00\x00\x00'),
+                         self.read_column_file('contract_count'))
+
+    def test_adds_columns_missing_from_older_store(self):
+        serializer = columnar.ColumnarSerializer(self.store_dir)
+        serializer.write_state(helpers.make_state(2, upload_spending=35))
+        serializer.close()
+        _remove_columns_after(self.store_dir, 20)
+
+        serializer = columnar.ColumnarSerializer(self.store_dir)
+        serializer.write_state(
+            state.SiaState(
+                timestamp=datetime.datetime(2018, 2, 11, 16, 5, 7),
+                contracts_age=60.0))
+        serializer.close()
+
+        contracts_ages = struct.unpack('<dd',
+                                       self.read_column_file('contracts_age'))
+        self.assertTrue(math.isnan(contracts_ages[0]))
+        self.assertEqual(60.0, contracts_ages[1])
+        with open(os.path.join(self.store_dir, 'schema.json')) as schema_file:
+            self.assertEqual(
+                len(columnar.COLUMNS), len(json.load(schema_file)['columns']))
+
+    def test_rejects_store_with_unknown_columns(self):
+        columnar.ColumnarSerializer(self.store_dir).close()
+        with open(os.path.join(self.store_dir, 'schema.json'), 'w') as f:
+            json.dump({'columns': [['timestamp', 'int64']]}, f)
+
+        with self.assertRaises(ValueError):
+            columnar.ColumnarSerializer(self.store_dir)
+
+    def test_rejects_hastings_that_overflow_128_bits(self):
+        serializer = columnar.ColumnarSerializer(self.store_dir)
+
+        with self.assertRaises(ValueError):
+            serializer.write_state(
+                helpers.make_state(2, upload_spending=2**128))
+
+
+@unittest.skipIf(columnar.numpy is None, 'numpy is not installed')
+class ColumnarReaderTest(helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(ColumnarReaderTest, self).setUp()
+        self.store_dir = os.path.join(self.temp_dir, 'metrics')
+
+    def test_reads_back_written_columns(self):
+        serializer = columnar.ColumnarSerializer(self.store_dir)
+        serializer.write_state(helpers.make_state(2, upload_spending=35))
+        serializer.write_state(
+            helpers.make_state(7, upload_spending=3 * 10**27))
+        serializer.close()
+
+        reader = columnar.ColumnarReader(self.store_dir)
+
+        self.assertEqual(2, reader.row_count)
+        self.assertEqual([
+            columnar.numpy.datetime64('2018-02-11T16:02:02'),
+            columnar.numpy.datetime64('2018-02-11T16:07:02')
+        ], list(reader.column('timestamp')))
+        self.assertEqual([5, 5], list(reader.column('contract_count')))
+        self.assertEqual([4444.5, 4444.5],
+                         list(reader.column('total_file_bytes')))
+        self.assertEqual([35.0, 3e27], list(reader.column('upload_spending')))
+        self.assertTrue(
+            all(math.isnan(v) for v in reader.column('download_spending')))
+
+    def test_reads_empty_store(self):
+        columnar.ColumnarSerializer(self.store_dir).close()
+
+        columns = columnar.ColumnarReader(self.store_dir).columns(
+            ['timestamp', 'upload_spending'])
+
+        self.assertEqual(0, len(columns['timestamp']))
+        self.assertEqual(0, len(columns['upload_spending']))
+
+    def test_reads_columns_missing_from_older_store(self):
+        serializer = columnar.ColumnarSerializer(self.store_dir)
+        serializer.write_state(helpers.make_state(2, upload_spending=35))
+        serializer.close()
+        _remove_columns_after(self.store_dir, 20)
+
+        reader = columnar.ColumnarReader(self.store_dir)
+
+        self.assertEqual(1, reader.row_count)
+        self.assertEqual([5], list(reader.column('contract_count')))
+        self.assertTrue(math.isnan(reader.column('contracts_age')[0]))
+        self.assertEqual([-2**63], list(reader.column('write_queue_depth')))
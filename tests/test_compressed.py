@@ -0,0 +1,214 @@
+import datetime
+import os
+
+import mock
+
+from sia_metrics_collector import columnar
+from sia_metrics_collector import compressed
+from sia_metrics_collector import serialize
+from sia_metrics_collector import state
+from tests import helpers
+
+
+class CompressedSerializerTest(helpers.RoundTripTests, helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(CompressedSerializerTest, self).setUp()
+        self.path = os.path.join(self.temp_dir, 'metrics.smc')
+
+    def write_states(self, states):
+        # Seals some of the rows into a block and leaves the rest in the tail.
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_block=3)
+        for s in states:
+            serializer.write_state(s)
+        serializer.close()
+
+    def read_states(self):
+        return compressed.iter_states(self.path)
+
+    def test_reads_back_rows_without_timestamps(self):
+        self.write_states([state.SiaState()])
+
+        self.assertStatesEqual([state.SiaState()], self.read_states())
+
+    def test_keeps_unsealed_rows_when_reopened(self):
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_block=3)
+        serializer.write_state(helpers.make_state(0, upload_spending=35))
+        serializer.write_state(helpers.make_state(1, upload_spending=36))
+        serializer.close()
+
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_block=3)
+        serializer.write_state(helpers.make_state(2, upload_spending=37))
+        serializer.write_state(helpers.make_state(3, upload_spending=38))
+        serializer.close()
+
+        self.assertStatesEqual(
+            [helpers.make_state(m, upload_spending=35 + m) for m in range(4)],
+            compressed.iter_states(self.path))
+        self.assertTrue(os.path.exists(compressed.tail_path(self.path)))
+
+    def test_holds_rows_until_flush(self):
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_flush=2)
+        serializer.write_state(helpers.make_state(0, upload_spending=35))
+
+        self.assertEqual([], list(compressed.iter_states(self.path)))
+
+        serializer.write_state(helpers.make_state(1, upload_spending=36))
+
+        self.assertEqual(2, len(list(compressed.iter_states(self.path))))
+
+    def test_discards_partially_written_block_when_reopened(self):
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_block=2)
+        for minute in range(4):
+            serializer.write_state(
+                helpers.make_state(minute, upload_spending=35))
+        serializer.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_block=2)
+        serializer.write_state(helpers.make_state(9, upload_spending=35))
+        serializer.close()
+
+        self.assertStatesEqual([
+            helpers.make_state(0, upload_spending=35),
+            helpers.make_state(1, upload_spending=35),
+            helpers.make_state(9, upload_spending=35)
+        ], compressed.iter_states(self.path))
+
+    def test_ignores_tail_of_rows_that_were_already_sealed(self):
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_block=2)
+        serializer.write_state(helpers.make_state(0, upload_spending=35))
+        with open(compressed.tail_path(self.path), 'rb') as f:
+            stale_tail = f.read()
+        serializer.write_state(helpers.make_state(1, upload_spending=35))
+        serializer.close()
+        with open(compressed.tail_path(self.path), 'wb') as f:
+            f.write(stale_tail)
+
+        self.assertEqual(2, len(list(compressed.iter_states(self.path))))
+
+    def test_flush_appends_only_new_rows_to_tail(self):
+        serializer = compressed.CompressedSerializer(self.path)
+        serializer.write_state(helpers.make_state(0, upload_spending=35))
+        with open(compressed.tail_path(self.path), 'rb') as f:
+            first_tail = f.read()
+        serializer.write_state(helpers.make_state(1, upload_spending=36))
+        serializer.close()
+        with open(compressed.tail_path(self.path), 'rb') as f:
+            second_tail = f.read()
+
+        self.assertTrue(second_tail.startswith(first_tail))
+        self.assertStatesEqual([
+            helpers.make_state(0, upload_spending=35),
+            helpers.make_state(1, upload_spending=36)
+        ], compressed.iter_states(self.path))
+
+    def test_discards_partially_written_tail_block_when_reopened(self):
+        serializer = compressed.CompressedSerializer(self.path)
+        serializer.write_state(helpers.make_state(0, upload_spending=35))
+        serializer.write_state(helpers.make_state(1, upload_spending=36))
+        serializer.close()
+        with open(compressed.tail_path(self.path), 'r+b') as f:
+            f.truncate(os.path.getsize(compressed.tail_path(self.path)) - 1)
+
+        serializer = compressed.CompressedSerializer(self.path)
+        serializer.write_state(helpers.make_state(9, upload_spending=37))
+        serializer.close()
+
+        self.assertStatesEqual([
+            helpers.make_state(0, upload_spending=35),
+            helpers.make_state(9, upload_spending=37)
+        ], compressed.iter_states(self.path))
+
+    def test_reads_and_appends_to_file_with_fewer_columns(self):
+        older_columns = [
+            c for c in columnar.COLUMNS if c[0] != 'wallet_siacoin_balance'
+        ]
+        with mock.patch.object(columnar, 'COLUMNS', older_columns):
+            serializer = compressed.CompressedSerializer(
+                self.path, rows_per_block=2)
+            serializer.write_state(helpers.make_state(0, upload_spending=35))
+            serializer.close()
+
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_block=2)
+        serializer.write_state(helpers.make_state(1, upload_spending=36))
+        serializer.write_state(helpers.make_state(2, upload_spending=37))
+        serializer.close()
+
+        expected = [
+            helpers.make_state(m, upload_spending=35 + m) for m in range(3)
+        ]
+        for s in expected:
+            s.wallet_siacoin_balance = None
+        self.assertStatesEqual(expected, compressed.iter_states(self.path))
+
+    def test_rejects_file_of_another_format(self):
+        with open(self.path, 'w') as f:
+            f.write('timestamp,contract_count\n')
+
+        with self.assertRaises(ValueError):
+            compressed.CompressedSerializer(self.path)
+
+    def test_steady_polls_take_few_bytes_per_row(self):
+        serializer = compressed.CompressedSerializer(
+            self.path, rows_per_flush=1000)
+        start = datetime.datetime(2018, 2, 11)
+        for i in range(1000):
+            serializer.write_state(
+                state.SiaState(
+                    timestamp=start + datetime.timedelta(minutes=i),
+                    contract_count=50,
+                    file_count=20,
+                    total_contract_size=9 * 10**12,
+                    uploaded_bytes=900 * 10**9 + i * 10**6,
+                    upload_spending=35 * 10**24 + i * 10**21,
+                    wallet_siacoin_balance=75 * 10**27))
+        serializer.close()
+
+        self.assertLess(
+            os.path.getsize(compressed.tail_path(self.path)), 1000 * 2)
+
+
+class ConvertCsvTest(helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(ConvertCsvTest, self).setUp()
+        self.csv_path = os.path.join(self.temp_dir, 'metrics.csv')
+        self.path = os.path.join(self.temp_dir, 'metrics.smc')
+
+    def test_converts_rows_written_by_csv_serializer(self):
+        states = [
+            helpers.make_state(0, upload_spending=35),
+            helpers.make_state(1, upload_spending=3 * 10**27)
+        ]
+        with open(self.csv_path, 'w') as csv_file:
+            serializer = serialize.CsvSerializer(csv_file)
+            for s in states:
+                serializer.write_state(s)
+
+        self.assertEqual(2, compressed.convert_csv(self.csv_path, self.path))
+        self.assertEqual(
+            [s.as_dict() for s in states],
+            [s.as_dict() for s in compressed.iter_states(self.path)])
+
+    def test_stores_columns_missing_from_csv_as_missing_values(self):
+        with open(self.csv_path, 'w') as csv_file:
+            csv_file.write('timestamp,contract_count\n'
+                           '2018-02-11T16:05:02,5\n')
+
+        compressed.convert_csv(self.csv_path, self.path)
+
+        self.assertEqual([
+            state.SiaState(
+                timestamp=datetime.datetime(2018, 2, 11, 16, 5, 2),
+                contract_count=5).as_dict()
+        ], [s.as_dict() for s in compressed.iter_states(self.path)])
@@ -0,0 +1,183 @@
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from sia_metrics_collector import contract_series
+from sia_metrics_collector import csv_index
+
+
+def make_contract(contract_id, size=100, total_cost='500'):
+    return {
+        u'id': contract_id,
+        u'netaddress': u'host-%s.example.com:9982' % contract_id,
+        u'size': size,
+        u'totalcost': total_cost,
+        u'fees': u'5',
+        u'StorageSpending': u'0',
+        u'uploadspending': u'0',
+        u'downloadspending': u'0',
+        u'renterfunds': u'495',
+    }
+
+
+def poll_time(minute):
+    return datetime.datetime(2018, 2, 11, 16, minute, 0)
+
+
+_HEADER = ('timestamp,contract_id,event,host,size,total_cost,fees,'
+           'storage_spending,upload_spending,download_spending,'
+           'renter_funds\n')
+
+
+class ContractSeriesWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.csv_file = io.BytesIO()
+        self.index_file = io.BytesIO()
+        self.writer = contract_series.ContractSeriesWriter(
+            self.csv_file,
+            snapshot_interval=3,
+            index_writer=csv_index.IndexWriter(self.index_file, 1))
+
+    def test_writes_snapshot_then_changes(self):
+        self.writer.write_contracts(
+            poll_time(0),
+            [make_contract('a'), make_contract('b')])
+        self.writer.write_contracts(
+            poll_time(1), [
+                make_contract('a', size=200),
+                make_contract('b'),
+                make_contract('c')
+            ])
+        self.writer.write_contracts(
+            poll_time(2), [
+                make_contract('a', size=200),
+                make_contract('c', total_cost='600')
+            ])
+
+        self.assertEqual(_HEADER + '2018-02-11T16:00:00,a,snapshot,'
+                         'host-a.example.com:9982,100,500,5,0,0,0,495\n'
+                         '2018-02-11T16:00:00,b,snapshot,'
+                         'host-b.example.com:9982,100,500,5,0,0,0,495\n'
+                         '2018-02-11T16:01:00,a,changed,,200,,,,,,\n'
+                         '2018-02-11T16:01:00,c,added,'
+                         'host-c.example.com:9982,100,500,5,0,0,0,495\n'
+                         '2018-02-11T16:02:00,c,changed,,,600,,,,,\n'
+                         '2018-02-11T16:02:00,b,removed,,,,,,,,\n',
+                         self.csv_file.getvalue())
+
+    def test_writes_snapshot_every_interval_polls(self):
+        for minute in range(7):
+            self.writer.write_contracts(poll_time(minute), [make_contract('a')])
+
+        snapshot_times = [
+            line.split(',')[0]
+            for line in self.csv_file.getvalue().splitlines()
+            if ',snapshot,' in line
+        ]
+        self.assertEqual([
+            '2018-02-11T16:00:00', '2018-02-11T16:03:00', '2018-02-11T16:06:00'
+        ], snapshot_times)
+
+    def test_indexes_each_snapshot(self):
+        self.writer.write_contracts(poll_time(0), [make_contract('a')])
+        self.writer.write_contracts(poll_time(1), [make_contract('b')])
+        self.writer.write_contracts(poll_time(2), [make_contract('c')])
+        self.writer.write_contracts(poll_time(3), [make_contract('d')])
+
+        contents = self.csv_file.getvalue()
+        self.assertEqual('2018-02-11T16:00:00 %d\n'
+                         '2018-02-11T16:03:00 %d\n' %
+                         (len(_HEADER),
+                          contents.index('2018-02-11T16:03:00,d,snapshot')),
+                         self.index_file.getvalue())
+
+    def test_does_not_rewrite_header_when_appending(self):
+        csv_file = io.BytesIO(_HEADER)
+
+        writer = contract_series.ContractSeriesWriter(csv_file)
+        writer.write_contracts(poll_time(0), [])
+
+        self.assertEqual(_HEADER, csv_file.getvalue())
+
+    def test_closes_csv_and_index_files(self):
+        self.writer.write_contracts(poll_time(0), [make_contract('a')])
+
+        self.writer.close()
+
+        self.assertTrue(self.csv_file.closed)
+        self.assertTrue(self.index_file.closed)
+
+
+class ContractsAtTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.temp_dir, 'contracts.csv')
+        with open(self.csv_path, 'w') as csv_file, open(
+                csv_index.index_path(self.csv_path), 'w') as index_file:
+            writer = contract_series.ContractSeriesWriter(
+                csv_file,
+                snapshot_interval=2,
+                index_writer=csv_index.IndexWriter(index_file, 1))
+            writer.write_contracts(poll_time(0), [make_contract('a')])
+            writer.write_contracts(
+                poll_time(1),
+                [make_contract('a', size=200),
+                 make_contract('b')])
+            writer.write_contracts(poll_time(2), [make_contract('b')])
+            writer.write_contracts(
+                poll_time(3),
+                [make_contract('b', total_cost='600'),
+                 make_contract('c')])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assertContractsAt(self, expected, minute):
+        self.assertEqual(
+            expected, {
+                contract_id: (fields['size'], fields['total_cost'])
+                for contract_id, fields in contract_series.contracts_at(
+                    self.csv_path, poll_time(minute)).iteritems()
+            })
+
+    def test_applies_changes_after_snapshot(self):
+        self.assertContractsAt({'a': ('100', '500')}, 0)
+        self.assertContractsAt({'a': ('200', '500'), 'b': ('100', '500')}, 1)
+        self.assertContractsAt({'b': ('100', '500')}, 2)
+        self.assertContractsAt({'b': ('100', '600'), 'c': ('100', '500')}, 3)
+
+    def test_returns_all_fields(self):
+        self.assertEqual({
+            'a': {
+                'host': 'host-a.example.com:9982',
+                'size': '100',
+                'total_cost': '500',
+                'fees': '5',
+                'storage_spending': '0',
+                'upload_spending': '0',
+                'download_spending': '0',
+                'renter_funds': '495',
+            }
+        }, contract_series.contracts_at(self.csv_path, poll_time(0)))
+
+    def test_returns_nothing_before_first_poll(self):
+        self.assertEqual({},
+                         contract_series.contracts_at(self.csv_path,
+                                                      datetime.datetime(
+                                                          2018, 2, 11)))
+
+    def test_reads_without_index(self):
+        os.remove(csv_index.index_path(self.csv_path))
+
+        self.assertContractsAt({'b': ('100', '600'), 'c': ('100', '500')}, 3)
+
+    def test_ignores_index_that_does_not_point_to_snapshot(self):
+        with open(csv_index.index_path(self.csv_path), 'w') as index_file:
+            index_file.write('2018-02-11T16:00:00 3\n')
+
+        self.assertContractsAt({'b': ('100', '600'), 'c': ('100', '500')}, 3)
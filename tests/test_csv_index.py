@@ -0,0 +1,117 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from sia_metrics_collector import csv_index
+
+_CSV_CONTENTS = ('timestamp,contract_count\n'
+                 '2018-02-11T16:05:00,1\n'
+                 '2018-02-11T16:06:00,2\n'
+                 '2018-02-11T16:07:00,3\n'
+                 '2018-02-11T16:08:00,4\n'
+                 '2018-02-11T16:09:00,5\n')
+
+
+class IndexWriterTest(unittest.TestCase):
+
+    def test_writes_entry_every_interval_rows(self):
+        index_file = io.BytesIO()
+        writer = csv_index.IndexWriter(index_file, interval=2)
+
+        for i in range(5):
+            writer.add_row('2018-02-11T16:0%d:00' % i, 100 + i * 10)
+        writer.flush()
+
+        self.assertEqual(('2018-02-11T16:00:00 100\n'
+                          '2018-02-11T16:02:00 120\n'
+                          '2018-02-11T16:04:00 140\n'), index_file.getvalue())
+
+    def test_holds_entries_until_flush(self):
+        index_file = io.BytesIO()
+        writer = csv_index.IndexWriter(index_file, interval=2)
+
+        writer.add_row('2018-02-11T16:00:00', 100)
+
+        self.assertEqual('', index_file.getvalue())
+
+
+class LoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.temp_dir, 'metrics.csv')
+        with open(self.csv_path, 'w') as csv_file:
+            csv_file.write(_CSV_CONTENTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_index_file(self):
+        with open(csv_index.index_path(self.csv_path)) as index_file:
+            return index_file.read()
+
+    def write_index_file(self, contents):
+        with open(csv_index.index_path(self.csv_path), 'w') as index_file:
+            index_file.write(contents)
+
+    def test_builds_missing_index(self):
+        index = csv_index.load(self.csv_path, interval=2)
+
+        self.assertEqual(('2018-02-11T16:05:00 25\n'
+                          '2018-02-11T16:07:00 69\n'
+                          '2018-02-11T16:09:00 113\n'), self.read_index_file())
+        self.assertEqual(25, index.seek_offset('2018-02-11T16:05:00'))
+        self.assertEqual(25, index.seek_offset('2018-02-11T16:07:00'))
+        self.assertEqual(69, index.seek_offset('2018-02-11T16:08:00'))
+        self.assertEqual(113, index.seek_offset('2018-02-11T17:00:00'))
+
+    def test_uses_valid_existing_index(self):
+        self.write_index_file('2018-02-11T16:05:00 25\n'
+                              '2018-02-11T16:08:00 91\n')
+
+        index = csv_index.load(self.csv_path, interval=2)
+
+        self.assertEqual(91, index.seek_offset('2018-02-11T16:09:00'))
+        self.assertEqual(('2018-02-11T16:05:00 25\n'
+                          '2018-02-11T16:08:00 91\n'), self.read_index_file())
+
+    def test_rebuilds_index_with_offset_past_end_of_file(self):
+        self.write_index_file('2018-02-11T16:05:00 25\n'
+                              '2018-02-11T16:10:00 500\n')
+
+        csv_index.load(self.csv_path, interval=2)
+
+        self.assertEqual(('2018-02-11T16:05:00 25\n'
+                          '2018-02-11T16:07:00 69\n'
+                          '2018-02-11T16:09:00 113\n'), self.read_index_file())
+
+    def test_rebuilds_index_that_points_at_wrong_row(self):
+        self.write_index_file('2018-02-11T16:05:00 25\n'
+                              '2018-02-11T16:08:00 69\n')
+
+        csv_index.load(self.csv_path, interval=2)
+
+        self.assertEqual(('2018-02-11T16:05:00 25\n'
+                          '2018-02-11T16:07:00 69\n'
+                          '2018-02-11T16:09:00 113\n'), self.read_index_file())
+
+    def test_rebuilds_index_with_middle_entry_at_wrong_offset(self):
+        self.write_index_file('2018-02-11T16:05:00 25\n'
+                              '2018-02-11T16:07:00 70\n'
+                              '2018-02-11T16:09:00 113\n')
+
+        csv_index.load(self.csv_path, interval=2)
+
+        self.assertEqual(('2018-02-11T16:05:00 25\n'
+                          '2018-02-11T16:07:00 69\n'
+                          '2018-02-11T16:09:00 113\n'), self.read_index_file())
+
+    def test_rebuilds_corrupt_index(self):
+        self.write_index_file('2018-02-11T16:05:00 25\n' '2018-02-11T16:0')
+
+        csv_index.load(self.csv_path, interval=4)
+
+        self.assertEqual(('2018-02-11T16:05:00 25\n'
+                          '2018-02-11T16:09:00 113\n'), self.read_index_file())
@@ -0,0 +1,108 @@
+import io
+import threading
+import unittest
+
+import mock
+
+from sia_metrics_collector import fleet
+
+
+class LoadConfigTest(unittest.TestCase):
+
+    def test_loads_nodes_with_default_hostname_and_port(self):
+        nodes = fleet.load_config(
+            io.BytesIO("""
+[
+  {"name": "renter-1", "hostname": "http://10.0.0.5", "port": 9981},
+  {"name": "renter-2"}
+]
+"""))
+
+        self.assertEqual([
+            fleet.Node(name='renter-1', hostname='http://10.0.0.5', port=9981),
+            fleet.Node(name='renter-2', hostname='http://localhost', port=9980),
+        ], nodes)
+
+    def test_rejects_node_without_name(self):
+        with self.assertRaises(ValueError):
+            fleet.load_config(io.BytesIO('[{"hostname": "http://10.0.0.5"}]'))
+
+    def test_rejects_duplicate_node_names(self):
+        with self.assertRaises(ValueError):
+            fleet.load_config(
+                io.BytesIO('[{"name": "renter-1"}, {"name": "renter-1"}]'))
+
+    def test_rejects_config_that_is_not_a_list(self):
+        with self.assertRaises(ValueError):
+            fleet.load_config(io.BytesIO('{"name": "renter-1"}'))
+
+
+class PollerTest(unittest.TestCase):
+
+    def test_writes_state_of_every_node(self):
+        builders = [mock.Mock(), mock.Mock()]
+        serializers = [mock.Mock(), mock.Mock()]
+        poller = fleet.Poller(
+            [
+                fleet.NodePoller('renter-1', builders[0], serializers[0]),
+                fleet.NodePoller('renter-2', builders[1], serializers[1]),
+            ],
+            worker_count=2)
+
+        self.assertEqual(0, poller.poll())
+        poller.stop()
+
+        serializers[0].write_state.assert_called_once_with(
+            builders[0].build.return_value)
+        serializers[1].write_state.assert_called_once_with(
+            builders[1].build.return_value)
+
+    def test_skips_node_that_is_still_busy(self):
+        build_started = threading.Event()
+        release_build = threading.Event()
+        slow_builder = mock.Mock()
+
+        def slow_build():
+            build_started.set()
+            release_build.wait()
+
+        slow_builder.build.side_effect = slow_build
+        poller = fleet.Poller(
+            [fleet.NodePoller('slow', slow_builder, mock.Mock())],
+            worker_count=2)
+
+        poller.poll()
+        build_started.wait()
+        skipped_count = poller.poll()
+        release_build.set()
+        poller.stop()
+
+        self.assertEqual(1, skipped_count)
+        self.assertEqual(1, slow_builder.build.call_count)
+
+    def test_keeps_polling_after_node_raises_exception(self):
+        failing_builder = mock.Mock()
+        failing_builder.build.side_effect = ValueError('dummy build error')
+        poller = fleet.Poller(
+            [fleet.NodePoller('renter-1', failing_builder, mock.Mock())],
+            worker_count=1)
+
+        poller.poll()
+        poller.wait_until_idle()
+        poller.poll()
+        poller.stop()
+
+        self.assertEqual(2, failing_builder.build.call_count)
+
+    def test_records_state_of_each_node_to_exporter(self):
+        builder = mock.Mock()
+        exporter = mock.Mock()
+        poller = fleet.Poller(
+            [fleet.NodePoller('renter-1', builder, mock.Mock(), exporter)],
+            worker_count=1)
+
+        poller.poll()
+        poller.stop()
+
+        exporter.write_state.assert_called_once_with(
+            builder.build.return_value, node='renter-1')
@@ -0,0 +1,76 @@
+import unittest
+
+from sia_metrics_collector import json_stream
+
+
+def _split_into_chunks(s, chunk_size):
+    return [s[i:i + chunk_size] for i in range(0, len(s), chunk_size)]
+
+
+class IterArrayItemsTest(unittest.TestCase):
+
+    def test_yields_each_item_in_array(self):
+        document = '{"files": [{"filesize": 900}, {"filesize": 800}]}'
+
+        self.assertEqual([{
+            u'filesize': 900
+        }, {
+            u'filesize': 800
+        }], list(json_stream.iter_array_items([document], u'files')))
+
+    def test_yields_same_items_regardless_of_chunk_size(self):
+        document = ('{"files": [\n'
+                    '  {"siapath": "a/b.txt", "filesize": 900},\n'
+                    '  {"siapath": "c.txt", "filesize": 12345678},\n'
+                    '  7, null, "]"\n'
+                    ']}')
+        expected = [{
+            u'siapath': u'a/b.txt',
+            u'filesize': 900
+        }, {
+            u'siapath': u'c.txt',
+            u'filesize': 12345678
+        }, 7, None, u']']
+
+        for chunk_size in range(1, len(document) + 1):
+            self.assertEqual(expected,
+                             list(
+                                 json_stream.iter_array_items(
+                                     _split_into_chunks(document, chunk_size),
+                                     u'files')))
+
+    def test_yields_nothing_for_empty_array(self):
+        self.assertEqual([],
+                         list(
+                             json_stream.iter_array_items(['{"files": [ ]}'],
+                                                          u'files')))
+
+    def test_yields_nothing_for_null_array(self):
+        self.assertEqual([],
+                         list(
+                             json_stream.iter_array_items(['{"files": null}'],
+                                                          u'files')))
+
+    def test_raises_when_key_is_missing(self):
+        with self.assertRaises(ValueError):
+            list(
+                json_stream.iter_array_items(['{"message": "dummy error"}'],
+                                             u'files'))
+
+    def test_raises_when_document_is_truncated(self):
+        with self.assertRaises(ValueError):
+            list(
+                json_stream.iter_array_items(
+                    ['{"files": [{"filesize": 900}, {"files'], u'files'))
+
+    def test_handles_more_items_than_fit_in_buffer(self):
+        item_count = 20000
+        chunks = (['{"files": ['] +
+                  ['{"filesize": %d},' % i for i in range(item_count - 1)] +
+                  ['{"filesize": %d}]}' % (item_count - 1)])
+
+        self.assertEqual(
+            range(item_count), [
+                f[u'filesize']
+                for f in json_stream.iter_array_items(chunks, u'files')
+            ])
@@ -0,0 +1,138 @@
+import datetime
+import unittest
+import urllib2
+
+import mock
+
+from sia_metrics_collector import metrics_server
+from sia_metrics_collector import state
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_counts_are_cumulative(self):
+        histogram = metrics_server.Histogram((1.0, 2.0))
+        histogram.observe(0.5)
+        histogram.observe(1.0)
+        histogram.observe(1.5)
+        histogram.observe(3.0)
+
+        self.assertEqual([(1.0, 2), (2.0, 3), ('+Inf', 4)],
+                         histogram.cumulative_counts())
+        self.assertEqual(6.0, histogram.total)
+        self.assertEqual(4, histogram.count)
+
+
+class ExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = state.SiaState(
+            timestamp=datetime.datetime(2018, 2, 11, 16, 5, 2),
+            contract_count=5,
+            upload_spending=8 * pow(10, 24),
+            api_latency=300.0,
+            contracts_api_latency=20.0,
+            files_api_latency=250.0,
+            wallet_api_latency=30.0)
+
+    def test_page_is_empty_before_first_state(self):
+        self.assertEqual('', metrics_server.Exporter().page())
+
+    def test_renders_latest_state(self):
+        exporter = metrics_server.Exporter()
+        exporter.write_state(self.state)
+        page = exporter.page()
+
+        self.assertIn('# TYPE sia_contract_count gauge\n'
+                      'sia_contract_count 5\n', page)
+        self.assertIn('sia_upload_spending 8000000000000000000000000\n', page)
+        self.assertIn('sia_last_poll_timestamp_seconds 1518365102.0\n', page)
+        # Fields without a value are left out.
+        self.assertNotIn('\nsia_file_count ', page)
+
+    def test_renders_latency_histograms(self):
+        exporter = metrics_server.Exporter()
+        exporter.write_state(self.state)
+        exporter.write_state(self.state)
+        page = exporter.page()
+
+        self.assertIn('sia_api_latency_seconds_bucket'
+                      '{endpoint="/renter/files",le="0.25"} 2\n', page)
+        self.assertIn('sia_api_latency_seconds_bucket'
+                      '{endpoint="/renter/files",le="0.1"} 0\n', page)
+        self.assertIn('sia_api_latency_seconds_count{endpoint="/wallet"} 2\n',
+                      page)
+        self.assertIn('sia_poll_duration_seconds_bucket{le="+Inf"} 2\n', page)
+        self.assertIn('sia_poll_duration_seconds_sum 0.6\n', page)
+
+    def test_labels_metrics_by_node(self):
+        exporter = metrics_server.Exporter()
+        exporter.write_state(self.state, node='renter-1')
+        exporter.write_state(
+            state.SiaState(contract_count=7, api_latency=10.0), node='renter-2')
+        page = exporter.page()
+
+        self.assertIn('sia_contract_count{node="renter-1"} 5\n'
+                      'sia_contract_count{node="renter-2"} 7\n', page)
+        self.assertIn('sia_poll_duration_seconds_count{node="renter-2"} 1\n',
+                      page)
+
+    def test_renders_page_once_per_change(self):
+        exporter = metrics_server.Exporter()
+        with mock.patch.object(
+                exporter, '_render', wraps=exporter._render) as mock_render:
+            for i in range(100):
+                exporter.write_state(self.state, node='renter-%d' % i)
+            exporter.page()
+            exporter.page()
+
+            self.assertEqual(1, mock_render.call_count)
+
+            exporter.write_state(self.state, node='renter-0')
+
+            self.assertIn('sia_contract_count{node="renter-0"} 5\n',
+                          exporter.page())
+            self.assertEqual(2, mock_render.call_count)
+
+    def test_records_states_while_page_renders(self):
+        exporter = metrics_server.Exporter()
+        exporter.write_state(self.state)
+        render = exporter._render
+
+        def render_during_poll(*args):
+            # A poll that arrives mid-render must neither wait for the render
+            # nor be hidden by it.
+            exporter.write_state(state.SiaState(contract_count=7))
+            return render(*args)
+
+        with mock.patch.object(
+                exporter, '_render', side_effect=render_during_poll):
+            self.assertIn('sia_contract_count 5\n', exporter.page())
+
+        self.assertIn('sia_contract_count 7\n', exporter.page())
+
+
+class ServeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.exporter = metrics_server.Exporter()
+        self.exporter.write_state(state.SiaState(contract_count=5))
+        self.server = metrics_server.serve(
+            self.exporter, port=0, host='127.0.0.1')
+        self.url_base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_serves_metrics_page(self):
+        response = urllib2.urlopen(self.url_base + '/metrics')
+
+        self.assertEqual(metrics_server.CONTENT_TYPE,
+                         response.info().getheader('Content-Type'))
+        self.assertEqual(self.exporter.page(), response.read())
+
+    def test_returns_not_found_for_other_paths(self):
+        with self.assertRaises(urllib2.HTTPError) as context:
+            urllib2.urlopen(self.url_base + '/')
+        self.assertEqual(404, context.exception.code)
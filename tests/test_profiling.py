@@ -0,0 +1,146 @@
+import datetime
+import json
+import os
+import pstats
+import threading
+
+import mock
+
+from sia_metrics_collector import profiling
+from sia_metrics_collector import state
+from tests import helpers
+
+
+class SinkStub(object):
+
+    def __init__(self):
+        self.states = []
+
+    def write_state(self, s):
+        self.states.append(s)
+
+
+class ProfilerTest(helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(ProfilerTest, self).setUp()
+        self.seconds = 0
+
+        # Each call to the clock advances it by one second, so each timed
+        # block takes one second.
+        def clock():
+            self.seconds += 1
+            return self.seconds
+
+        self.clock = clock
+
+    def read_phases(self):
+        with open(os.path.join(self.temp_dir,
+                               profiling.PHASES_FILENAME)) as phases_file:
+            return [json.loads(line) for line in phases_file]
+
+    def poll(self, profiler, s, sinks):
+        profiler.begin_poll()
+        profiler.call(lambda: None)
+        with profiler.phase('fetch'):
+            pass
+        with profiler.phase('aggregate'):
+            pass
+        with profiler.phase('aggregate'):
+            pass
+        profiler.end_build(s)
+        for sink in sinks:
+            sink.write_state(s)
+        profiler.write_state(s)
+
+    def test_records_time_of_each_phase_of_each_poll(self):
+        profiler = profiling.Profiler(self.temp_dir, clock=self.clock)
+        sink = SinkStub()
+        timed_sink = profiler.timed_sink(sink, 'serialize')
+        self.poll(profiler, helpers.make_state(0), [timed_sink])
+        self.poll(profiler, helpers.make_state(1), [timed_sink])
+        profiler.close()
+
+        self.assertEqual([{
+            'timestamp': '2018-02-11T16:%02d:02' % minute,
+            'fetch_ms': 1000.0,
+            'decode_ms': 0.0,
+            'aggregate_ms': 2000.0,
+            'serialize_ms': 1000.0,
+            'print_ms': 0.0,
+        } for minute in range(2)], self.read_phases())
+        self.assertEqual(2, len(sink.states))
+
+    def test_saves_snapshots_at_interval(self):
+        profiler = profiling.Profiler(
+            self.temp_dir, snapshot_interval=2, clock=self.clock)
+        timed_sink = profiler.timed_sink(SinkStub(), 'print')
+        for minute in range(3):
+            self.poll(profiler, helpers.make_state(minute), [timed_sink])
+        profiler.close()
+
+        self.assertEqual([
+            'cprofile-20180211T160002.prof', 'cprofile-20180211T160202.prof',
+            'memory-20180211T160002.json', 'memory-20180211T160202.json',
+            profiling.PHASES_FILENAME
+        ], sorted(os.listdir(self.temp_dir)))
+        stats = pstats.Stats(
+            os.path.join(self.temp_dir, 'cprofile-20180211T160002.prof'))
+        self.assertTrue(
+            any(function_name == 'write_state'
+                for _, _, function_name in stats.stats))
+        with open(os.path.join(self.temp_dir,
+                               'memory-20180211T160002.json')) as memory_file:
+            self.assertIn('most_common_types', json.load(memory_file))
+
+    def test_forgets_polls_that_were_never_written(self):
+        profiler = profiling.Profiler(self.temp_dir, clock=self.clock)
+        profiler.begin_poll()
+        profiler.end_build(helpers.make_state(0))
+        self.poll(profiler, helpers.make_state(1), [])
+        profiler.close()
+
+        self.assertEqual(['2018-02-11T16:01:02'],
+                         [p['timestamp'] for p in self.read_phases()])
+
+    def test_times_late_threads_as_the_poll_that_started_them(self):
+        profiler = profiling.Profiler(self.temp_dir, clock=self.clock)
+
+        def fetch():
+            with profiler.phase('fetch'):
+                pass
+
+        profiler.begin_poll()
+        late_fetch = profiler.bind(fetch)
+        profiler.end_build(helpers.make_state(0))
+        profiler.begin_poll()
+        # The first poll's query returns while the second poll is building.
+        thread = threading.Thread(target=late_fetch)
+        thread.start()
+        thread.join()
+        profiler.end_build(helpers.make_state(1))
+        profiler.write_state(helpers.make_state(0))
+        profiler.write_state(helpers.make_state(1))
+        profiler.close()
+
+        self.assertEqual([1000.0, 0.0],
+                         [p['fetch_ms'] for p in self.read_phases()])
+
+    def test_builder_times_aggregation_of_each_query(self):
+        profiler = profiling.Profiler(self.temp_dir, clock=self.clock)
+        mock_sia_api = mock.Mock()
+        mock_sia_api.get_renter_contracts.return_value = {}
+        mock_sia_api.get_renter_files.return_value = {u'files': None}
+        mock_sia_api.get_wallet.return_value = {}
+        builder = state.Builder(
+            mock_sia_api,
+            lambda: datetime.datetime(2018, 2, 11, 16, 0, 2),
+            profiler=profiler)
+
+        profiler.begin_poll()
+        s = builder.build()
+        profiler.end_build(s)
+        profiler.write_state(s)
+        profiler.close()
+
+        self.assertEqual(3000.0, self.read_phases()[0]['aggregate_ms'])
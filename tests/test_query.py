@@ -0,0 +1,86 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from sia_metrics_collector import query
+
+_CSV_CONTENTS = ('timestamp,contract_count,file_count\n'
+                 '2018-02-11T23:58:00,1,10\n'
+                 '2018-02-11T23:59:00,2,20\n'
+                 '2018-02-12T00:00:00,3,30\n'
+                 '2018-02-12T00:01:00,4,40\n'
+                 '2018-02-12T00:02:00,5,50\n'
+                 '2018-02-12T00:03:00,6,')
+
+
+class QueryRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.temp_dir, 'metrics.csv')
+        with open(self.csv_path, 'w') as csv_file:
+            csv_file.write(_CSV_CONTENTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_returns_rows_within_time_range(self):
+        self.assertEqual(
+            [['2018-02-11T23:59:00', '2'], ['2018-02-12T00:00:00', '3']],
+            list(
+                query.query_rows(
+                    self.csv_path, ['timestamp', 'contract_count'],
+                    datetime.datetime(2018, 2, 11, 23, 59),
+                    datetime.datetime(2018, 2, 12, 0, 1),
+                    index_interval=2)))
+
+    def test_returns_rows_from_start_of_day(self):
+        self.assertEqual([['30'], ['40'], ['50']],
+                         list(
+                             query.query_rows(
+                                 self.csv_path, ['file_count'],
+                                 datetime.datetime(2018, 2, 12),
+                                 None,
+                                 index_interval=1)))
+
+    def test_returns_rows_until_end(self):
+        self.assertEqual([['1'], ['2']],
+                         list(
+                             query.query_rows(
+                                 self.csv_path, ['contract_count'],
+                                 None,
+                                 datetime.datetime(2018, 2, 12),
+                                 index_interval=2)))
+
+    def test_returns_no_rows_for_range_after_end_of_file(self):
+        self.assertEqual([],
+                         list(
+                             query.query_rows(
+                                 self.csv_path, ['contract_count'],
+                                 datetime.datetime(2018, 3, 1),
+                                 None,
+                                 index_interval=2)))
+
+    def test_raises_for_unknown_field(self):
+        with self.assertRaises(ValueError):
+            list(
+                query.query_rows(
+                    self.csv_path, ['dummy_field'],
+                    None,
+                    None,
+                    index_interval=2))
+
+
+class ParseTimestampTest(unittest.TestCase):
+
+    def test_parses_supported_formats(self):
+        self.assertEqual(
+            datetime.datetime(2018, 2, 12, 1, 2, 3),
+            query.parse_timestamp('2018-02-12T01:02:03'))
+        self.assertEqual(
+            datetime.datetime(2018, 2, 12, 1, 2, 3),
+            query.parse_timestamp('2018-02-12 01:02:03'))
+        self.assertEqual(
+            datetime.datetime(2018, 2, 12), query.parse_timestamp('2018-02-12'))
@@ -0,0 +1,227 @@
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+
+from sia_metrics_collector import recording
+from sia_metrics_collector import state
+
+_CONTRACTS = {
+    u'activecontracts': [{
+        u'id': u'a',
+        u'totalcost': u'200000',
+        u'fees': u'10000',
+        u'StorageSpending': u'2000',
+        u'uploadspending': u'800',
+        u'downloadspending': u'60',
+        u'renterfunds': u'3',
+        u'size': 22,
+    }],
+    u'inactivecontracts': [],
+}
+_WALLET = {
+    u'confirmedsiacoinbalance': u'900',
+    u'unconfirmedoutgoingsiacoins': u'35',
+    u'unconfirmedincomingsiacoins': u'92',
+}
+
+
+class SerializerStub(object):
+
+    def __init__(self):
+        self.states = []
+
+    def write_state(self, s):
+        self.states.append(s)
+
+
+class RecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.recording_dir = os.path.join(self.temp_dir, 'recording')
+        self.mock_sia_api = mock.Mock()
+        self.mock_sia_api.get_renter_contracts.return_value = _CONTRACTS
+        self.mock_sia_api.get_wallet.return_value = _WALLET
+        self.times = []
+        self.recorder = recording.Recorder(self.recording_dir)
+        self.builder = state.Builder(
+            self.recorder.wrap(self.mock_sia_api),
+            lambda: self.times[0],
+            build_listener=self.recorder.save_poll)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def build(self, timestamp, file_count):
+        self.times = [timestamp]
+        self.mock_sia_api.get_renter_files.return_value = {
+            u'files': [{
+                u'filesize': 900,
+                u'uploadedbytes': 50,
+                u'uploadprogress': 90,
+            }] * file_count
+        }
+        return self.builder.build()
+
+    def test_stores_each_distinct_response_once(self):
+        self.build(datetime.datetime(2018, 2, 11, 16, 5, 2), file_count=1)
+        self.build(datetime.datetime(2018, 2, 11, 16, 6, 2), file_count=2)
+
+        polls = recording.read_polls(self.recording_dir)
+        self.assertEqual([
+            datetime.datetime(2018, 2, 11, 16, 5, 2),
+            datetime.datetime(2018, 2, 11, 16, 6, 2)
+        ], [timestamp for timestamp, _, _ in polls])
+        self.assertEqual(polls[0][1]['get_wallet'], polls[1][1]['get_wallet'])
+        self.assertNotEqual(polls[0][1]['get_renter_files'],
+                            polls[1][1]['get_renter_files'])
+        self.assertEqual(4,
+                         len(
+                             os.listdir(
+                                 os.path.join(self.recording_dir,
+                                              recording.OBJECTS_DIRNAME))))
+
+    def test_records_failed_call_as_null(self):
+        self.mock_sia_api.get_wallet.side_effect = ValueError('dummy error')
+
+        self.build(datetime.datetime(2018, 2, 11, 16, 5, 2), file_count=1)
+
+        _, responses, _ = recording.read_polls(self.recording_dir)[0]
+        self.assertIsNone(responses['get_wallet'])
+
+    def test_records_streamed_files_as_their_full_response(self):
+        files = [{u'filesize': 900, u'uploadedbytes': 50}, {u'filesize': 2}]
+        self.mock_sia_api.iter_renter_files.return_value = iter(files)
+        self.mock_sia_api.get_renter_files.return_value = {u'files': files}
+        sia_api = self.recorder.wrap(self.mock_sia_api)
+
+        streamed = list(sia_api.iter_renter_files())
+        self.recorder.save_poll(
+            state.SiaState(timestamp=datetime.datetime(2018, 2, 11, 16, 5, 2)))
+        sia_api.get_renter_files()
+        self.recorder.save_poll(
+            state.SiaState(timestamp=datetime.datetime(2018, 2, 11, 16, 6, 2)))
+
+        self.assertEqual(files, streamed)
+        polls = recording.read_polls(self.recording_dir)
+        self.assertEqual(polls[0][1]['get_renter_files'],
+                         polls[1][1]['get_renter_files'])
+        objects_dir = os.path.join(self.recording_dir,
+                                   recording.OBJECTS_DIRNAME)
+        object_file = gzip.open(
+            os.path.join(objects_dir,
+                         polls[0][1]['get_renter_files'] + '.json.gz'))
+        try:
+            self.assertEqual({u'files': files}, json.load(object_file))
+        finally:
+            object_file.close()
+        self.assertEqual(1, len(os.listdir(objects_dir)))
+
+    def test_drops_streamed_files_that_fail_partway(self):
+
+        def iter_files():
+            yield {u'filesize': 900}
+            raise ValueError('dummy error')
+
+        self.mock_sia_api.iter_renter_files.return_value = iter_files()
+        sia_api = self.recorder.wrap(self.mock_sia_api)
+
+        with self.assertRaises(ValueError):
+            list(sia_api.iter_renter_files())
+        self.recorder.save_poll(
+            state.SiaState(timestamp=datetime.datetime(2018, 2, 11, 16, 5, 2)))
+
+        _, responses, _ = recording.read_polls(self.recording_dir)[0]
+        self.assertIsNone(responses['get_renter_files'])
+        self.assertEqual([],
+                         os.listdir(
+                             os.path.join(self.recording_dir,
+                                          recording.OBJECTS_DIRNAME)))
+
+    def test_replays_recordings_into_same_metrics(self):
+        built_states = []
+        for minute in range(5):
+            built_states.append(
+                self.build(
+                    datetime.datetime(2018, 2, 11, 16, minute, 2),
+                    file_count=minute))
+        self.mock_sia_api.get_wallet.side_effect = ValueError('dummy error')
+        built_states.append(
+            self.build(datetime.datetime(2018, 2, 11, 16, 5, 2), file_count=1))
+        self.recorder.close()
+        serializer = SerializerStub()
+
+        self.assertEqual(6,
+                         recording.replay(
+                             [self.recording_dir],
+                             serializer,
+                             processes=2,
+                             chunk_polls=2))
+
+        for s in built_states + serializer.states:
+            for field in ('api_latency', 'contracts_api_latency',
+                          'files_api_latency', 'wallet_api_latency'):
+                setattr(s, field, None)
+        self.assertEqual([s.as_dict() for s in built_states],
+                         [s.as_dict() for s in serializer.states])
+        self.assertIsNone(serializer.states[-1].wallet_siacoin_balance)
+
+    def test_replays_reused_and_late_calls_into_same_metrics(self):
+        # Contracts are queried every other poll, and the third poll's wallet
+        # call doesn't return until after the poll.
+        wallet_released = threading.Event()
+
+        def get_wallet():
+            call_count[0] += 1
+            if call_count[0] == 3:
+                wallet_released.wait()
+            elif call_count[0] == 4:
+                raise ValueError('dummy error')
+            return _WALLET
+
+        call_count = [0]
+        self.mock_sia_api.get_wallet.side_effect = get_wallet
+        self.builder = state.Builder(
+            self.recorder.wrap(self.mock_sia_api),
+            lambda: self.times[0],
+            intervals={'contracts': 120},
+            deadlines={'wallet': 0.05},
+            build_listener=self.recorder.save_poll)
+        built_states = []
+        for minute in range(5):
+            built_states.append(
+                self.build(
+                    datetime.datetime(2018, 2, 11, 16, minute, 2),
+                    file_count=minute))
+            if minute == 2:
+                # Let the late wallet call return before the next poll, which
+                # makes a wallet call that fails.
+                wallet_released.set()
+                self.builder._query_threads['wallet'].join()
+        self.recorder.close()
+        serializer = SerializerStub()
+
+        recording.replay(
+            [self.recording_dir], serializer, processes=2, chunk_polls=1)
+
+        self.assertEqual([recording.LATE, None], [
+            responses['get_wallet']
+            for _, responses, _ in recording.read_polls(self.recording_dir)
+        ][2:4])
+        for s in built_states + serializer.states:
+            for field in ('api_latency', 'contracts_api_latency',
+                          'files_api_latency', 'wallet_api_latency'):
+                setattr(s, field, None)
+        self.assertEqual([s.as_dict() for s in built_states],
+                         [s.as_dict() for s in serializer.states])
+        self.assertEqual([1, 1, 1, 1, 1],
+                         [s.contract_count for s in serializer.states])
+        self.assertEqual([0.0, 60.0, 0.0, 60.0, 0.0],
+                         [s.contracts_age for s in serializer.states])
@@ -0,0 +1,90 @@
+import datetime
+import os
+import struct
+
+from sia_metrics_collector import ring_buffer
+from tests import helpers
+
+
+class RingBufferTest(helpers.RoundTripTests, helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(RingBufferTest, self).setUp()
+        self.path = os.path.join(self.temp_dir, 'metrics.ring')
+
+    def read_latest(self, count=None):
+        reader = ring_buffer.RingBufferReader(self.path)
+        try:
+            return [s.as_dict() for s in reader.read_latest(count)]
+        finally:
+            reader.close()
+
+    def write_states(self, states):
+        writer = ring_buffer.RingBufferWriter(self.path, capacity=5)
+        for s in states:
+            writer.write_state(s)
+        writer.close()
+
+    def read_states(self):
+        reader = ring_buffer.RingBufferReader(self.path)
+        try:
+            return reader.read_latest()
+        finally:
+            reader.close()
+
+    def test_keeps_microseconds_of_timestamps(self):
+        s = helpers.make_state(
+            timestamp=datetime.datetime(2018, 2, 11, 16, 0, 2, 500))
+        self.write_states([s])
+
+        self.assertStatesEqual([s], self.read_states())
+
+    def test_keeps_only_most_recent_rows(self):
+        writer = ring_buffer.RingBufferWriter(self.path, capacity=3)
+        for minute in range(5):
+            writer.write_state(helpers.make_state(minute))
+        writer.close()
+
+        self.assertEqual([helpers.make_state(m).as_dict() for m in (2, 3, 4)],
+                         self.read_latest())
+        self.assertEqual([helpers.make_state(4).as_dict()], self.read_latest(1))
+
+    def test_continues_buffer_when_reopened(self):
+        writer = ring_buffer.RingBufferWriter(self.path, capacity=3)
+        writer.write_state(helpers.make_state(0))
+        writer.close()
+
+        writer = ring_buffer.RingBufferWriter(self.path, capacity=3)
+        writer.write_state(helpers.make_state(1))
+        writer.close()
+
+        self.assertEqual([helpers.make_state(m).as_dict() for m in (0, 1)],
+                         self.read_latest())
+
+    def test_starts_over_when_capacity_changes(self):
+        writer = ring_buffer.RingBufferWriter(self.path, capacity=3)
+        writer.write_state(helpers.make_state(0))
+        writer.close()
+
+        ring_buffer.RingBufferWriter(self.path, capacity=4).close()
+
+        self.assertEqual([], self.read_latest())
+
+    def test_skips_record_that_is_being_overwritten(self):
+        writer = ring_buffer.RingBufferWriter(self.path, capacity=2)
+        for minute in range(2):
+            writer.write_state(helpers.make_state(minute))
+        writer.close()
+        # Mark the oldest record as partway through being overwritten.
+        with open(self.path, 'r+b') as ring_file:
+            ring_file.seek(4096)
+            ring_file.write(struct.pack('<Q', 5))
+
+        self.assertEqual([helpers.make_state(1).as_dict()], self.read_latest())
+
+    def test_rejects_file_that_is_not_a_ring_buffer(self):
+        with open(self.path, 'w') as f:
+            f.write('timestamp,contract_count\n')
+
+        with self.assertRaises(ValueError):
+            ring_buffer.RingBufferReader(self.path)
@@ -0,0 +1,139 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from sia_metrics_collector import rollup
+
+_HEADER = 'timestamp,contract_count,uploaded_bytes\n'
+
+
+@unittest.skipIf(rollup.numpy is None, 'numpy is not installed')
+class RollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.temp_dir, 'metrics.csv')
+        self.output_prefix = os.path.join(self.temp_dir, 'rollups', 'metrics')
+        os.makedirs(os.path.dirname(self.output_prefix))
+        with open(self.csv_path, 'w') as csv_file:
+            csv_file.write(_HEADER)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def append_rows(self, rows):
+        with open(self.csv_path, 'a') as csv_file:
+            csv_file.write(rows)
+
+    def run_rollup(self, resolutions=('minute',), chunk_rows=1000):
+        return rollup.Rollup(self.csv_path, self.output_prefix,
+                             list(resolutions), chunk_rows).run()
+
+    def read_rollup(self, resolution):
+        with open(self.output_prefix + '-' + resolution + '.csv') as f:
+            return f.read()
+
+    def test_computes_last_min_max_and_rate_per_period(self):
+        self.append_rows('2018-02-11T16:05:00,5,100\n'
+                         '2018-02-11T16:05:20,3,200\n'
+                         '2018-02-11T16:05:40,4,\n'
+                         '2018-02-11T16:06:00,6,400\n'
+                         '2018-02-11T16:06:10,,700\n'
+                         '2018-02-11T16:07:10,6,700\n')
+
+        self.assertEqual(6, self.run_rollup())
+
+        self.assertEqual(
+            ('timestamp,'
+             'contract_count_last,contract_count_min,contract_count_max,'
+             'uploaded_bytes_last,uploaded_bytes_min,uploaded_bytes_max,'
+             'uploaded_bytes_rate\n'
+             '2018-02-11T16:05:00,4.0,3.0,5.0,200.0,100.0,200.0,\n'
+             '2018-02-11T16:06:00,6.0,6.0,6.0,700.0,400.0,700.0,10.0\n'),
+            self.read_rollup('minute'))
+
+    def test_gives_same_result_regardless_of_chunk_size(self):
+        rows = ''.join(
+            '2018-02-11T16:%02d:%02d,%d,%d\n' % (i // 6, (i % 6) * 10, i % 7,
+                                                 i * 10) for i in range(100))
+        self.append_rows(rows)
+        self.run_rollup(chunk_rows=1000)
+        expected = self.read_rollup('minute')
+        shutil.rmtree(os.path.dirname(self.output_prefix))
+        os.makedirs(os.path.dirname(self.output_prefix))
+
+        self.run_rollup(chunk_rows=7)
+
+        self.assertEqual(expected, self.read_rollup('minute'))
+
+    def test_extends_rollups_with_rows_added_since_last_run(self):
+        self.append_rows('2018-02-11T16:05:00,5,100\n'
+                         '2018-02-11T16:06:00,5,160\n'
+                         '2018-02-11T16:07:00,5,2')
+        self.assertEqual(2, self.run_rollup(resolutions=('minute', 'hour')))
+
+        self.append_rows('80\n2018-02-11T17:00:00,5,400\n')
+        self.assertEqual(2, self.run_rollup(resolutions=('minute', 'hour')))
+
+        self.assertEqual(
+            ('timestamp,'
+             'contract_count_last,contract_count_min,contract_count_max,'
+             'uploaded_bytes_last,uploaded_bytes_min,uploaded_bytes_max,'
+             'uploaded_bytes_rate\n'
+             '2018-02-11T16:05:00,5.0,5.0,5.0,100.0,100.0,100.0,\n'
+             '2018-02-11T16:06:00,5.0,5.0,5.0,160.0,160.0,160.0,1.0\n'
+             '2018-02-11T16:07:00,5.0,5.0,5.0,280.0,280.0,280.0,2.0\n'),
+            self.read_rollup('minute'))
+        self.assertEqual(
+            ('timestamp,'
+             'contract_count_last,contract_count_min,contract_count_max,'
+             'uploaded_bytes_last,uploaded_bytes_min,uploaded_bytes_max,'
+             'uploaded_bytes_rate\n'
+             '2018-02-11T16:00:00,5.0,5.0,5.0,280.0,100.0,280.0,\n'),
+            self.read_rollup('hour'))
+
+    def test_backfills_resolution_added_to_existing_rollup(self):
+        self.append_rows('2018-02-11T16:05:00,5,100\n'
+                         '2018-02-11T16:06:00,5,160\n')
+        self.run_rollup(resolutions=('minute',))
+        self.append_rows('2018-02-11T17:00:00,5,400\n')
+
+        self.assertEqual(3, self.run_rollup(resolutions=('minute', 'hour')))
+
+        self.assertEqual(
+            ('timestamp,'
+             'contract_count_last,contract_count_min,contract_count_max,'
+             'uploaded_bytes_last,uploaded_bytes_min,uploaded_bytes_max,'
+             'uploaded_bytes_rate\n'
+             '2018-02-11T16:05:00,5.0,5.0,5.0,100.0,100.0,100.0,\n'
+             '2018-02-11T16:06:00,5.0,5.0,5.0,160.0,160.0,160.0,1.0\n'),
+            self.read_rollup('minute'))
+        self.assertEqual(
+            ('timestamp,'
+             'contract_count_last,contract_count_min,contract_count_max,'
+             'uploaded_bytes_last,uploaded_bytes_min,uploaded_bytes_max,'
+             'uploaded_bytes_rate\n'
+             '2018-02-11T16:00:00,5.0,5.0,5.0,160.0,100.0,160.0,\n'),
+            self.read_rollup('hour'))
+
+    def test_rejects_row_with_wrong_number_of_columns(self):
+        self.append_rows('2018-02-11T16:05:00,5,100\n'
+                         '2018-02-11T16:06:00,5,160,7\n')
+
+        with self.assertRaises(ValueError):
+            self.run_rollup()
+
+    def test_rejects_unknown_resolution(self):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            rollup._parse_resolutions('minute,week')
+
+    def test_rejects_state_for_different_columns(self):
+        self.append_rows('2018-02-11T16:05:00,5,100\n')
+        self.run_rollup()
+        with open(self.csv_path, 'w') as csv_file:
+            csv_file.write('timestamp,file_count\n')
+
+        with self.assertRaises(ValueError):
+            self.run_rollup()
@@ -0,0 +1,116 @@
+import unittest
+
+from sia_metrics_collector import scheduler
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def make_scheduler(self, overrun_policy=scheduler.SKIP, jitter=0.0):
+        return scheduler.Scheduler(
+            10,
+            overrun_policy=overrun_policy,
+            jitter=jitter,
+            clock=self.clock.time,
+            sleep=self.clock.sleep,
+            random_fn=lambda: 0.5)
+
+    def test_first_wait_returns_immediately(self):
+        self.make_scheduler().wait()
+
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_sleeps_once_until_next_deadline(self):
+        s = self.make_scheduler()
+        s.wait()
+        self.clock.now += 3.0
+        s.wait()
+
+        self.assertEqual([7.0], self.clock.sleeps)
+        self.assertEqual(1010.0, self.clock.now)
+
+    def test_deadlines_do_not_drift(self):
+        s = self.make_scheduler()
+        s.wait()
+        for _ in range(100):
+            self.clock.now += 3.5
+            s.wait()
+
+        self.assertEqual(2000.0, self.clock.now)
+        self.assertEqual(0, s.missed_count)
+
+    def test_skip_waits_for_next_deadline_after_overrun(self):
+        s = self.make_scheduler(scheduler.SKIP)
+        s.wait()
+        self.clock.now += 25.0
+        s.wait()
+
+        self.assertEqual([5.0], self.clock.sleeps)
+        self.assertEqual(1030.0, self.clock.now)
+        self.assertEqual(2, s.missed_count)
+
+    def test_coalesce_polls_once_immediately_after_overrun(self):
+        s = self.make_scheduler(scheduler.COALESCE)
+        s.wait()
+        self.clock.now += 25.0
+        s.wait()
+        s.wait()
+
+        self.assertEqual([5.0], self.clock.sleeps)
+        self.assertEqual(1030.0, self.clock.now)
+        self.assertEqual(2, s.missed_count)
+
+    def test_catch_up_runs_every_overdue_poll(self):
+        s = self.make_scheduler(scheduler.CATCH_UP)
+        s.wait()
+        self.clock.now += 25.0
+        s.wait()
+        s.wait()
+        s.wait()
+
+        self.assertEqual([5.0], self.clock.sleeps)
+        self.assertEqual(1030.0, self.clock.now)
+        self.assertEqual(2, s.missed_count)
+
+    def test_jitter_delays_poll_without_shifting_deadlines(self):
+        s = self.make_scheduler(jitter=2.0)
+        s.wait()
+        s.wait()
+        s.wait()
+
+        self.assertEqual([11.0, 10.0], self.clock.sleeps)
+        self.assertEqual(0, s.missed_count)
+
+    def test_restarts_schedule_when_clock_goes_back(self):
+        s = self.make_scheduler()
+        s.wait()
+        self.clock.now -= 3600.0
+        s.wait()
+
+        self.assertEqual([], self.clock.sleeps)
+        s.wait()
+        self.assertEqual([10.0], self.clock.sleeps)
+
+    def test_rejects_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            scheduler.Scheduler(0)
+        with self.assertRaises(ValueError):
+            scheduler.Scheduler(10, overrun_policy='dummy')
+        with self.assertRaises(ValueError):
+            scheduler.Scheduler(10, jitter=10)
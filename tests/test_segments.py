@@ -0,0 +1,179 @@
+import datetime
+import gzip
+import json
+import os
+
+from sia_metrics_collector import segments
+from tests import helpers
+
+
+def _hour(hour, minute=0):
+    return datetime.datetime(2018, 2, 11, hour, minute, 0)
+
+
+class SegmentedSerializerTest(helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(SegmentedSerializerTest, self).setUp()
+        self.segment_dir = os.path.join(self.temp_dir, 'metrics')
+
+    def read_manifest_file(self):
+        with open(os.path.join(self.segment_dir,
+                               segments.MANIFEST_FILENAME)) as manifest_file:
+            return json.load(manifest_file)['segments']
+
+    def test_starts_new_segment_each_period(self):
+        serializer = segments.SegmentedSerializer(
+            self.segment_dir, max_segment_seconds=3600)
+        for timestamp in (_hour(16, 5), _hour(16, 55), _hour(17, 5)):
+            serializer.write_state(helpers.make_state(timestamp=timestamp))
+        serializer.close()
+
+        self.assertEqual([{
+            'file': 'metrics-20180211T160500.csv.gz',
+            'start': '2018-02-11T16:05:00',
+            'end': '2018-02-11T16:55:00',
+            'rows': 2,
+        }, {
+            'file': 'metrics-20180211T170500.csv',
+            'start': '2018-02-11T17:05:00',
+            'end': None,
+            'rows': 0,
+        }], self.read_manifest_file())
+        with gzip.open(
+                os.path.join(self.segment_dir,
+                             'metrics-20180211T160500.csv.gz')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('timestamp,contract_count,'))
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(self.segment_dir, 'metrics-20180211T160500.csv')))
+
+    def test_starts_new_segment_when_segment_is_full(self):
+        serializer = segments.SegmentedSerializer(
+            self.segment_dir, max_segment_bytes=1, compress=False)
+        for minute in range(3):
+            serializer.write_state(
+                helpers.make_state(timestamp=_hour(16, minute)))
+        serializer.close()
+
+        self.assertEqual([
+            'metrics-20180211T160000.csv', 'metrics-20180211T160100.csv',
+            'metrics-20180211T160200.csv'
+        ], [segment['file'] for segment in self.read_manifest_file()])
+
+    def test_appends_to_open_segment_when_reopened(self):
+        serializer = segments.SegmentedSerializer(
+            self.segment_dir, max_segment_seconds=3600)
+        serializer.write_state(helpers.make_state(timestamp=_hour(16, 0)))
+        serializer.close()
+
+        serializer = segments.SegmentedSerializer(
+            self.segment_dir, max_segment_seconds=3600)
+        serializer.write_state(helpers.make_state(timestamp=_hour(16, 30)))
+        serializer.write_state(helpers.make_state(timestamp=_hour(17, 0)))
+        serializer.close()
+
+        manifest = self.read_manifest_file()
+        self.assertEqual(2, len(manifest))
+        self.assertEqual('2018-02-11T16:30:00', manifest[0]['end'])
+        self.assertEqual(2, manifest[0]['rows'])
+
+    def test_continues_open_segment_with_its_older_columns(self):
+        serializer = segments.SegmentedSerializer(
+            self.segment_dir, max_segment_seconds=3600, compress=False)
+        serializer.write_state(helpers.make_state(timestamp=_hour(16, 0)))
+        serializer.close()
+        segment_path = os.path.join(self.segment_dir,
+                                    'metrics-20180211T160000.csv')
+        with open(segment_path, 'w') as segment_file:
+            segment_file.write('timestamp,contract_count\n'
+                               '2018-02-11T16:00:00,5\n')
+
+        serializer = segments.SegmentedSerializer(
+            self.segment_dir, max_segment_seconds=3600, compress=False)
+        serializer.write_state(helpers.make_state(timestamp=_hour(16, 30)))
+        serializer.close()
+
+        with open(segment_path) as segment_file:
+            self.assertEqual(('timestamp,contract_count\n'
+                              '2018-02-11T16:00:00,5\n'
+                              '2018-02-11T16:30:00,5\n'), segment_file.read())
+
+    def test_compresses_segments_left_uncompressed(self):
+        serializer = segments.SegmentedSerializer(
+            self.segment_dir, max_segment_seconds=3600, compress=False)
+        serializer.write_state(helpers.make_state(timestamp=_hour(16)))
+        serializer.write_state(helpers.make_state(timestamp=_hour(17)))
+        serializer.close()
+
+        segments.SegmentedSerializer(
+            self.segment_dir, max_segment_seconds=3600).close()
+
+        self.assertEqual(
+            ['metrics-20180211T160000.csv.gz', 'metrics-20180211T170000.csv'],
+            [segment['file'] for segment in self.read_manifest_file()])
+
+
+class QueryRowsTest(helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(QueryRowsTest, self).setUp()
+        self.segment_dir = os.path.join(self.temp_dir, 'metrics')
+        serializer = segments.SegmentedSerializer(
+            self.segment_dir, max_segment_seconds=3600)
+        for hour in (16, 17, 18):
+            for minute in (0, 30):
+                serializer.write_state(
+                    helpers.make_state(timestamp=_hour(hour, minute)))
+        serializer.close()
+
+    def test_finds_only_segments_within_time_range(self):
+        self.assertEqual(
+            [os.path.join(self.segment_dir, 'metrics-20180211T170000.csv.gz')],
+            segments.find_segments(self.segment_dir, _hour(17, 10), _hour(18)))
+        self.assertEqual([
+            os.path.join(self.segment_dir, 'metrics-20180211T170000.csv.gz'),
+            os.path.join(self.segment_dir, 'metrics-20180211T180000.csv')
+        ], segments.find_segments(self.segment_dir, _hour(17, 10)))
+
+    def test_returns_rows_within_time_range(self):
+        self.assertEqual(
+            [
+                ['2018-02-11T16:30:00', '5'],
+                ['2018-02-11T17:00:00', '5'],
+                ['2018-02-11T17:30:00', '5'],
+                ['2018-02-11T18:00:00', '5'],
+            ],
+            list(
+                segments.query_rows(self.segment_dir,
+                                    ['timestamp', 'contract_count'],
+                                    _hour(16, 30), _hour(18, 30))))
+
+    def test_returns_empty_values_for_columns_older_segments_lack(self):
+        segment_dir = os.path.join(self.temp_dir, 'upgraded')
+        serializer = segments.SegmentedSerializer(
+            segment_dir,
+            max_segment_seconds=3600,
+            fieldnames=['timestamp', 'contract_count'])
+        serializer.write_state(helpers.make_state(timestamp=_hour(16)))
+        serializer.close()
+        serializer = segments.SegmentedSerializer(
+            segment_dir, max_segment_seconds=3600)
+        serializer.write_state(helpers.make_state(timestamp=_hour(17)))
+        serializer.close()
+
+        self.assertEqual(
+            [
+                ['2018-02-11T16:00:00', '5', ''],
+                ['2018-02-11T17:00:00', '5', '4444.5'],
+            ],
+            list(
+                segments.query_rows(
+                    segment_dir,
+                    ['timestamp', 'contract_count', 'total_file_bytes'])))
+
+    def test_reads_header_of_first_segment(self):
+        self.assertEqual(['timestamp', 'contract_count'],
+                         segments.read_header(self.segment_dir)[:2])
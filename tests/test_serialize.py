@@ -2,6 +2,7 @@ import datetime
 import io
 import unittest
 
+from sia_metrics_collector import csv_index
 from sia_metrics_collector import serialize
 from sia_metrics_collector import state
 
@@ -29,7 +30,13 @@ class CsvSerializerTest(unittest.TestCase):
                           'wallet_siacoin_balance,'
                           'wallet_outgoing_siacoins,'
                           'wallet_incoming_siacoins,'
-                          'api_latency\n'), mock_file.getvalue())
+                          'api_latency,'
+                          'contracts_api_latency,'
+                          'files_api_latency,'
+                          'wallet_api_latency,'
+                          'contracts_age,'
+                          'files_age,'
+                          'wallet_age\n'), mock_file.getvalue())
 
     def test_writes_state_to_file(self):
         mock_file = io.BytesIO()
@@ -53,7 +60,13 @@ class CsvSerializerTest(unittest.TestCase):
                 wallet_siacoin_balance=75,
                 wallet_outgoing_siacoins=26,
                 wallet_incoming_siacoins=83,
-                api_latency=5.0))
+                api_latency=5.0,
+                contracts_api_latency=3.0,
+                files_api_latency=1.0,
+                wallet_api_latency=1.0,
+                contracts_age=0.0,
+                files_age=30.0,
+                wallet_age=0.0))
 
         self.assertEqual((
             'timestamp,'
@@ -72,10 +85,88 @@ class CsvSerializerTest(unittest.TestCase):
             'wallet_siacoin_balance,'
             'wallet_outgoing_siacoins,'
             'wallet_incoming_siacoins,'
-            'api_latency\n'
-            '2018-02-11T16:05:02,5,3,2,9,4444,900,65,25,2,35,0,100,75,26,83,5.0\n'
+            'api_latency,'
+            'contracts_api_latency,'
+            'files_api_latency,'
+            'wallet_api_latency,'
+            'contracts_age,'
+            'files_age,'
+            'wallet_age\n'
+            '2018-02-11T16:05:02,5,3,2,9,4444,900,65,25,2,35,0,100,75,26,83,5.0,3.0,1.0,1.0,0.0,30.0,0.0\n'
         ), mock_file.getvalue())
 
+    def test_writes_optional_columns_it_is_given(self):
+        mock_file = io.BytesIO()
+
+        serializer = serialize.CsvSerializer(
+            mock_file,
+            fieldnames=serialize.select_fieldnames(serialize.CACHE_FIELDNAMES))
+        serializer.write_state(
+            state.SiaState(
+                timestamp=datetime.datetime(2018, 2, 11, 16, 5, 2),
+                wallet_age=0.0,
+                response_cache_hits=2,
+                response_cache_misses=1,
+                contracts_status=state.STATUS_OK))
+
+        header, row = mock_file.getvalue().splitlines()
+        self.assertTrue(
+            header.endswith(',wallet_age,response_cache_hits,'
+                            'response_cache_misses'))
+        self.assertTrue(row.endswith(',0.0,2,1'))
+
+    def test_appends_rows_with_columns_of_older_file(self):
+        old_contents = (
+            'timestamp,contract_count,file_count,uploads_in_progress_count,'
+            'total_contract_size,total_file_bytes,uploaded_bytes,'
+            'total_contract_spending,contract_fee_spending,storage_spending,'
+            'upload_spending,download_spending,remaining_renter_funds,'
+            'wallet_siacoin_balance,wallet_outgoing_siacoins,'
+            'wallet_incoming_siacoins,api_latency\n'
+            '2018-02-11T16:05:02,5,3,2,9,4444,900,65,25,2,35,0,100,75,26,83,'
+            '5.0\n')
+        mock_file = io.BytesIO(old_contents)
+
+        serializer = serialize.CsvSerializer(mock_file)
+        serializer.write_state(
+            state.SiaState(
+                timestamp=datetime.datetime(2018, 2, 11, 16, 5, 7),
+                contract_count=6,
+                api_latency=6.0,
+                contracts_api_latency=4.0))
+
+        self.assertEqual(
+            old_contents + '2018-02-11T16:05:07,6,,,,,,,,,,,,,,,6.0\n',
+            mock_file.getvalue())
+
+    def test_leaves_columns_it_does_not_know_empty(self):
+        mock_file = io.BytesIO('timestamp,contract_count,new_metric\n')
+
+        serialize.CsvSerializer(mock_file).write_state(
+            state.SiaState(
+                timestamp=datetime.datetime(2018, 2, 11, 16, 5, 7),
+                contract_count=6))
+
+        self.assertEqual('timestamp,contract_count,new_metric\n'
+                         '2018-02-11T16:05:07,6,\n', mock_file.getvalue())
+
+    def test_rejects_file_that_is_not_a_metrics_csv(self):
+        mock_file = io.BytesIO('name,value\nfoo,5\n')
+
+        with self.assertRaises(ValueError):
+            serialize.CsvSerializer(mock_file)
+        self.assertEqual('name,value\nfoo,5\n', mock_file.getvalue())
+
+    def test_continues_file_with_current_columns(self):
+        mock_file = io.BytesIO()
+        serialize.CsvSerializer(mock_file).write_state(
+            state.SiaState(timestamp=datetime.datetime(2018, 2, 11, 16, 5, 2)))
+
+        serialize.CsvSerializer(mock_file).write_state(
+            state.SiaState(timestamp=datetime.datetime(2018, 2, 11, 16, 5, 7)))
+
+        self.assertEqual(3, len(mock_file.getvalue().splitlines()))
+
     def test_appends_to_existing_file(self):
         if True:
             return
@@ -96,8 +187,21 @@ class CsvSerializerTest(unittest.TestCase):
             'wallet_siacoin_balance,'
             'wallet_outgoing_siacoins,'
             'wallet_incoming_siacoins,'
-            'api_latency\n'
-            '2018-02-11T16:05:02,5,3,2,9,4444,900,65,25,2,35,0,100,75,26,83,5.0\n'
+            'api_latency,'
+            'contracts_api_latency,'
+            'files_api_latency,'
+            'wallet_api_latency,'
+            'contracts_age,'
+            'files_age,'
+            'wallet_age,'
+            'response_cache_hits,'
+            'response_cache_misses,'
+            'contracts_status,'
+            'files_status,'
+            'wallet_status,'
+            'write_queue_depth,'
+            'dropped_state_count\n'
+            '2018-02-11T16:05:02,5,3,2,9,4444,900,65,25,2,35,0,100,75,26,83,5.0,3.0,1.0,1.0,0.0,30.0,0.0,,,,,,,\n'
         ))
 
         serializer = serialize.CsvSerializer(mock_file)
@@ -119,7 +223,13 @@ class CsvSerializerTest(unittest.TestCase):
                 wallet_siacoin_balance=76,
                 wallet_outgoing_siacoins=27,
                 wallet_incoming_siacoins=84,
-                api_latency=6.0))
+                api_latency=6.0,
+                contracts_api_latency=4.0,
+                files_api_latency=1.0,
+                wallet_api_latency=1.0,
+                contracts_age=0.0,
+                files_age=30.0,
+                wallet_age=0.0))
 
         self.assertEqual((
             'timestamp,'
@@ -138,7 +248,106 @@ class CsvSerializerTest(unittest.TestCase):
             'wallet_siacoin_balance,'
             'wallet_outgoing_siacoins,'
             'wallet_incoming_siacoins,'
-            'api_latency\n'
-            '2018-02-11T16:05:02,5,3,2,9,4444,900,65,25,2,35,0,100,75,26,83,5.0\n'
-            '2018-02-11T16:05:07,6,4,3,10,5555,901,75,26,3,36,1,101,76,27,84,6.0\n'
+            'api_latency,'
+            'contracts_api_latency,'
+            'files_api_latency,'
+            'wallet_api_latency,'
+            'contracts_age,'
+            'files_age,'
+            'wallet_age,'
+            'response_cache_hits,'
+            'response_cache_misses,'
+            'contracts_status,'
+            'files_status,'
+            'wallet_status,'
+            'write_queue_depth,'
+            'dropped_state_count\n'
+            '2018-02-11T16:05:02,5,3,2,9,4444,900,65,25,2,35,0,100,75,26,83,5.0,3.0,1.0,1.0,0.0,30.0,0.0,,,,,,,\n'
+            '2018-02-11T16:05:07,6,4,3,10,5555,901,75,26,3,36,1,101,76,27,84,6.0,4.0,1.0,1.0,0.0,30.0,0.0,,,,,,,\n'
         ), mock_file.getvalue())
+
+
+class CsvSerializerFlushPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_file = io.BytesIO()
+        self.current_time = 1000.0
+        header_file = io.BytesIO()
+        serialize.CsvSerializer(header_file)
+        self.header = header_file.getvalue()
+
+    def make_serializer(self, flush_policy):
+        return serialize.CsvSerializer(
+            self.mock_file, flush_policy, time_fn=lambda: self.current_time)
+
+    def make_state(self, second):
+        return state.SiaState(
+            timestamp=datetime.datetime(2018, 2, 11, 16, 5, second),
+            contract_count=5)
+
+    def test_buffers_rows_until_row_limit(self):
+        serializer = self.make_serializer(serialize.FlushPolicy(max_rows=3))
+
+        serializer.write_state(self.make_state(1))
+        serializer.write_state(self.make_state(2))
+        self.assertEqual(self.header, self.mock_file.getvalue())
+
+        serializer.write_state(self.make_state(3))
+        self.assertEqual(3, len(self.mock_file.getvalue().splitlines()[1:]))
+
+    def test_buffers_rows_until_byte_limit(self):
+        serializer = self.make_serializer(
+            serialize.FlushPolicy(max_rows=None, max_bytes=60))
+
+        serializer.write_state(self.make_state(1))
+        self.assertEqual(self.header, self.mock_file.getvalue())
+
+        serializer.write_state(self.make_state(2))
+        self.assertEqual(2, len(self.mock_file.getvalue().splitlines()[1:]))
+
+    def test_buffers_rows_until_interval_elapses(self):
+        serializer = self.make_serializer(
+            serialize.FlushPolicy(max_rows=None, max_interval=30))
+
+        self.current_time += 29
+        serializer.write_state(self.make_state(1))
+        self.assertEqual(self.header, self.mock_file.getvalue())
+
+        self.current_time += 1
+        serializer.write_state(self.make_state(2))
+        self.assertEqual(2, len(self.mock_file.getvalue().splitlines()[1:]))
+
+    def test_flush_writes_buffered_rows(self):
+        serializer = self.make_serializer(serialize.FlushPolicy(max_rows=100))
+        serializer.write_state(self.make_state(1))
+
+        serializer.flush()
+
+        self.assertEqual(self.header + '2018-02-11T16:05:01,5' +
+                         (',' * (len(self.header.split(',')) - 2)) + '\n',
+                         self.mock_file.getvalue())
+
+
+class CsvSerializerIndexTest(unittest.TestCase):
+
+    def test_records_offset_of_each_row_in_index(self):
+        mock_file = io.BytesIO()
+        index_file = io.BytesIO()
+        serializer = serialize.CsvSerializer(
+            mock_file,
+            serialize.FlushPolicy(max_rows=2),
+            index_writer=csv_index.IndexWriter(index_file, interval=1))
+
+        for second in (2, 7, 12):
+            serializer.write_state(
+                state.SiaState(
+                    timestamp=datetime.datetime(2018, 2, 11, 16, 5, second)))
+        # The third row has not been flushed yet, so isn't indexed.
+        self.assertEqual(2, len(index_file.getvalue().splitlines()))
+        serializer.flush()
+
+        for line in index_file.getvalue().splitlines():
+            timestamp, offset = line.split()
+            mock_file.seek(int(offset))
+            self.assertEqual(timestamp, mock_file.read(len(timestamp)))
+        self.assertEqual(3, len(index_file.getvalue().splitlines()))
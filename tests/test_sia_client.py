@@ -0,0 +1,128 @@
+import BaseHTTPServer
+import json
+import socket
+import threading
+import unittest
+
+import requests
+
+from sia_metrics_collector import sia_client
+
+
+class FakeSiaHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connection_count += 1
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('User-agent')))
+        if self.server.statuses:
+            status = self.server.statuses.pop(0)
+        else:
+            status = 200
+        body = self.server.bodies.get(self.path, '{}')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SiaClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                FakeSiaHandler)
+        self.server.connection_count = 0
+        self.server.requests = []
+        self.server.statuses = []
+        self.server.bodies = {
+            '/renter/contracts': '{"activecontracts": []}',
+            '/renter/files': '{"files": [{"siapath": "a.txt"}]}',
+            '/wallet': '{"confirmedsiacoinbalance": "900"}',
+        }
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={
+                'poll_interval': 0.05
+            })
+        self.server_thread.start()
+        self.client = sia_client.SiaClient('http://127.0.0.1',
+                                           self.server.server_address[1])
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+
+    def test_decodes_responses(self):
+        self.assertEqual({
+            'activecontracts': []
+        }, self.client.get_renter_contracts())
+        self.assertEqual({
+            'files': [{
+                'siapath': 'a.txt'
+            }]
+        }, self.client.get_renter_files())
+        self.assertEqual({
+            'confirmedsiacoinbalance': '900'
+        }, self.client.get_wallet())
+        self.assertEqual([
+            ('/renter/contracts', 'Sia-Agent'),
+            ('/renter/files', 'Sia-Agent'),
+            ('/wallet', 'Sia-Agent'),
+        ], self.server.requests)
+
+    def test_streams_files(self):
+        self.assertEqual([{
+            'siapath': 'a.txt'
+        }], list(self.client.iter_renter_files()))
+
+    def test_returns_raw_body(self):
+        self.assertEqual(self.server.bodies['/wallet'],
+                         self.client.get_raw('/wallet'))
+
+    def test_reuses_connection_between_calls(self):
+        for _ in range(3):
+            self.client.get_renter_contracts()
+            self.client.get_renter_files()
+            list(self.client.iter_renter_files())
+            self.client.get_wallet()
+
+        self.assertEqual(12, len(self.server.requests))
+        self.assertEqual(1, self.server.connection_count)
+
+    def test_returns_error_responses(self):
+        self.server.bodies['/wallet'] = json.dumps({'message': 'wallet locked'})
+        self.server.statuses = [400]
+
+        self.assertEqual({'message': 'wallet locked'}, self.client.get_wallet())
+
+    def test_retries_when_sia_is_unavailable(self):
+        self.server.statuses = [503, 503]
+
+        self.assertEqual({
+            'confirmedsiacoinbalance': '900'
+        }, self.client.get_wallet())
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_returns_none_for_body_that_is_not_json(self):
+        self.server.bodies['/wallet'] = 'dummy non-JSON body'
+
+        self.assertIsNone(self.client.get_wallet())
+
+    def test_raises_when_sia_is_not_listening(self):
+        unused_socket = socket.socket()
+        unused_socket.bind(('127.0.0.1', 0))
+        unused_port = unused_socket.getsockname()[1]
+        unused_socket.close()
+        client = sia_client.SiaClient(
+            'http://127.0.0.1', unused_port, retries=0)
+
+        with self.assertRaises(requests.RequestException):
+            client.get_wallet()
@@ -0,0 +1,107 @@
+import datetime
+import os
+import sqlite3
+
+from sia_metrics_collector import sqlite_store
+from tests import helpers
+
+
+class SqliteSerializerTest(helpers.RoundTripTests, helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(SqliteSerializerTest, self).setUp()
+        self.path = os.path.join(self.temp_dir, 'metrics.db')
+
+    def write_states(self, states):
+        serializer = sqlite_store.SqliteSerializer(self.path, 'renter-1')
+        for s in states:
+            serializer.write_state(s)
+        serializer.close()
+
+    def read_states(self):
+        rows = list(sqlite_store.iter_states(self.path))
+        self.assertEqual(['renter-1'] * len(rows), [node for node, _ in rows])
+        return [s for _, s in rows]
+
+    def count_rows(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(
+                'SELECT COUNT(*) FROM metrics').fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_inserts_rows_in_batches(self):
+        serializer = sqlite_store.SqliteSerializer(
+            self.path, 'renter-1', rows_per_transaction=3)
+        serializer.write_state(helpers.make_state(0))
+        serializer.write_state(helpers.make_state(1))
+
+        self.assertEqual(0, self.count_rows())
+
+        serializer.write_state(helpers.make_state(2))
+
+        self.assertEqual(3, self.count_rows())
+        serializer.close()
+
+    def test_batches_rows_of_every_node_written_through_it(self):
+        serializer = sqlite_store.SqliteSerializer(
+            self.path, rows_per_transaction=3)
+        renter_1 = serializer.for_node('renter-1')
+        renter_2 = serializer.for_node('renter-2')
+        renter_1.write_state(helpers.make_state(0))
+        renter_2.write_state(helpers.make_state(0))
+
+        self.assertEqual(0, self.count_rows())
+
+        renter_1.write_state(helpers.make_state(1))
+
+        self.assertEqual(3, self.count_rows())
+        renter_2.write_state(helpers.make_state(1))
+        serializer.close()
+        self.assertEqual(
+            ['renter-1', 'renter-2', 'renter-1', 'renter-2'],
+            [node for node, _ in sqlite_store.iter_states(self.path)])
+
+    def test_uses_write_ahead_log(self):
+        sqlite_store.SqliteSerializer(self.path, 'renter-1').close()
+
+        connection = sqlite3.connect(self.path)
+        self.assertEqual(
+            'wal',
+            connection.execute('PRAGMA journal_mode').fetchone()[0])
+        connection.close()
+
+    def test_reads_rows_of_one_node_within_time_range(self):
+        for node in ('renter-1', 'renter-2'):
+            serializer = sqlite_store.SqliteSerializer(self.path, node)
+            for minute in range(4):
+                serializer.write_state(helpers.make_state(minute))
+            serializer.close()
+
+        self.assertEqual(
+            [('renter-2', datetime.datetime(2018, 2, 11, 16, 1, 2)),
+             ('renter-2', datetime.datetime(2018, 2, 11, 16, 2, 2))],
+            [(node, s.timestamp) for node, s in sqlite_store.iter_states(
+                self.path,
+                node='renter-2',
+                start=datetime.datetime(2018, 2, 11, 16, 1),
+                end=datetime.datetime(2018, 2, 11, 16, 3))])
+
+    def test_adds_columns_missing_from_older_database(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE metrics (node TEXT NOT NULL, '
+                           'timestamp TEXT, contract_count INTEGER)')
+        connection.execute('INSERT INTO metrics VALUES '
+                           '(\'renter-1\', \'2018-02-11T16:00:02\', 4)')
+        connection.commit()
+        connection.close()
+
+        serializer = sqlite_store.SqliteSerializer(self.path, 'renter-1')
+        serializer.write_state(helpers.make_state(1))
+        serializer.close()
+
+        rows = list(sqlite_store.iter_states(self.path))
+        self.assertEqual([4, 5], [s.contract_count for _, s in rows])
+        self.assertIsNone(rows[0][1].upload_spending)
+        self.assertEqual(35, rows[1][1].upload_spending)
@@ -1,8 +1,11 @@
 import datetime
+import itertools
+import threading
 import unittest
 
 import mock
 
+from sia_metrics_collector import aggregate
 from sia_metrics_collector import state
 
 _DUMMY_START_TIMESTAMP = datetime.datetime(2018, 2, 12, 18, 5, 55, 0)
@@ -37,8 +40,12 @@ class StateBuilderTest(unittest.TestCase):
             'dummy get_wallet exception')
 
         self.assertSiaStateEqual(
-            state.SiaState(timestamp=_DUMMY_END_TIMESTAMP, api_latency=207.0),
-            self.builder.build())
+            state.SiaState(
+                timestamp=_DUMMY_END_TIMESTAMP,
+                api_latency=207.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0), self.builder.build())
 
     def test_builds_empty_state_when_all_api_calls_return_errors(self):
         self.mock_sia_api.get_renter_contracts.return_value = {
@@ -52,8 +59,12 @@ class StateBuilderTest(unittest.TestCase):
         }
 
         self.assertSiaStateEqual(
-            state.SiaState(timestamp=_DUMMY_END_TIMESTAMP, api_latency=207.0),
-            self.builder.build())
+            state.SiaState(
+                timestamp=_DUMMY_END_TIMESTAMP,
+                api_latency=207.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0), self.builder.build())
 
     def test_builds_zero_metrics_when_files_is_None(self):
         self.mock_sia_api.get_renter_contracts.return_value = {
@@ -81,7 +92,11 @@ class StateBuilderTest(unittest.TestCase):
                 remaining_renter_funds=None,
                 storage_spending=None,
                 wallet_siacoin_balance=None,
-                api_latency=207.0), self.builder.build())
+                api_latency=207.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0,
+                files_age=0.0), self.builder.build())
 
     def test_builds_full_state_when_all_api_calls_return_successfully(self):
         self.mock_sia_api.get_renter_contracts.return_value = {
@@ -169,7 +184,13 @@ class StateBuilderTest(unittest.TestCase):
                 wallet_siacoin_balance=900L,
                 wallet_outgoing_siacoins=35L,
                 wallet_incoming_siacoins=92L,
-                api_latency=207.0), self.builder.build())
+                api_latency=207.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0,
+                contracts_age=0.0,
+                files_age=0.0,
+                wallet_age=0.0), self.builder.build())
 
     def test_builds_partial_state_when_one_api_call_fails(self):
         self.mock_sia_api.get_renter_contracts.return_value = {
@@ -241,4 +262,552 @@ class StateBuilderTest(unittest.TestCase):
                 wallet_siacoin_balance=900L,
                 wallet_outgoing_siacoins=35L,
                 wallet_incoming_siacoins=92L,
-                api_latency=207.0), self.builder.build())
+                api_latency=207.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0,
+                contracts_age=0.0,
+                wallet_age=0.0), self.builder.build())
+
+    def test_records_latency_of_each_api_call(self):
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'message': u'dummy get_renter_contracts error'
+        }
+        self.mock_sia_api.get_renter_files.return_value = {
+            u'message': u'dummy get_renter_files error'
+        }
+        self.mock_sia_api.get_wallet.side_effect = ValueError(
+            'dummy get_wallet exception')
+        self.times = [
+            datetime.datetime(2018, 2, 12, 18, 5, 55, 0),
+            # /renter/contracts start and end.
+            datetime.datetime(2018, 2, 12, 18, 5, 55, 0),
+            datetime.datetime(2018, 2, 12, 18, 5, 55, 15000),
+            # /renter/files start and end.
+            datetime.datetime(2018, 2, 12, 18, 5, 55, 15000),
+            datetime.datetime(2018, 2, 12, 18, 5, 55, 190000),
+            # /wallet start and end.
+            datetime.datetime(2018, 2, 12, 18, 5, 55, 190000),
+            datetime.datetime(2018, 2, 12, 18, 5, 55, 207000),
+        ]
+
+        self.assertSiaStateEqual(
+            state.SiaState(
+                timestamp=_DUMMY_END_TIMESTAMP,
+                api_latency=207.0,
+                contracts_api_latency=15.0,
+                files_api_latency=175.0,
+                wallet_api_latency=17.0), self.builder.build())
+
+    def test_builds_full_state_when_querying_concurrently(self):
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, concurrent=True)
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'activecontracts': [
+                {
+                    u'totalcost': u'200000',
+                    u'fees': u'10000',
+                    u'StorageSpending': u'2000',
+                    u'uploadspending': u'800',
+                    u'downloadspending': u'60',
+                    u'renterfunds': u'3',
+                    u'size': 22,
+                },
+            ],
+            u'inactivecontracts': [],
+        }
+        self.mock_sia_api.get_renter_files.return_value = {
+            u'files': [
+                {
+                    u'filesize': 800,
+                    u'uploadedbytes': 100,
+                    u'uploadprogress': 100,
+                },
+            ],
+        }
+        self.mock_sia_api.get_wallet.return_value = {
+            u'confirmedsiacoinbalance': u'900',
+            u'unconfirmedoutgoingsiacoins': u'35',
+            u'unconfirmedincomingsiacoins': u'92',
+        }
+
+        self.assertSiaStateEqual(
+            state.SiaState(
+                timestamp=_DUMMY_END_TIMESTAMP,
+                contract_count=1,
+                file_count=1,
+                total_file_bytes=800.0,
+                total_contract_size=22L,
+                uploads_in_progress_count=0,
+                uploaded_bytes=100,
+                total_contract_spending=200000L,
+                contract_fee_spending=10000L,
+                upload_spending=800L,
+                download_spending=60L,
+                remaining_renter_funds=3L,
+                storage_spending=2000L,
+                wallet_siacoin_balance=900L,
+                wallet_outgoing_siacoins=35L,
+                wallet_incoming_siacoins=92L,
+                api_latency=207.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0,
+                contracts_age=0.0,
+                files_age=0.0,
+                wallet_age=0.0), self.builder.build())
+
+    def test_builds_file_metrics_from_streamed_files(self):
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, stream_files=True)
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'message': u'dummy get_renter_contracts error'
+        }
+        self.mock_sia_api.iter_renter_files.return_value = iter([
+            {
+                u'filesize': 900,
+                u'uploadedbytes': 50,
+                u'uploadprogress': 90,
+            },
+            {
+                u'filesize': 800,
+                u'uploadedbytes': 100,
+                u'uploadprogress': 100,
+            },
+        ])
+        self.mock_sia_api.get_wallet.return_value = {
+            u'message': u'dummy get_wallet error'
+        }
+
+        self.assertSiaStateEqual(
+            state.SiaState(
+                timestamp=_DUMMY_END_TIMESTAMP,
+                file_count=2,
+                total_file_bytes=((900 * .9) + (800 * 1.0)),
+                uploads_in_progress_count=1,
+                uploaded_bytes=150,
+                api_latency=207.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0,
+                files_age=0.0), self.builder.build())
+        self.mock_sia_api.get_renter_files.assert_not_called()
+
+    def test_leaves_file_metrics_empty_when_file_stream_fails(self):
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, stream_files=True)
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'message': u'dummy get_renter_contracts error'
+        }
+
+        def failing_file_stream():
+            yield {
+                u'filesize': 900,
+                u'uploadedbytes': 50,
+                u'uploadprogress': 90,
+            }
+            raise ValueError('dummy truncated response')
+
+        self.mock_sia_api.iter_renter_files.return_value = failing_file_stream()
+        self.mock_sia_api.get_wallet.return_value = {
+            u'message': u'dummy get_wallet error'
+        }
+
+        self.assertSiaStateEqual(
+            state.SiaState(
+                timestamp=_DUMMY_END_TIMESTAMP,
+                api_latency=207.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0), self.builder.build())
+
+    def test_incremental_builder_applies_changes_between_builds(self):
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, incremental=True)
+        contract_a = {
+            u'id': u'contract-a',
+            u'totalcost': u'200000',
+            u'fees': u'10000',
+            u'StorageSpending': u'2000',
+            u'uploadspending': u'800',
+            u'downloadspending': u'60',
+            u'renterfunds': u'3',
+            u'size': 22,
+        }
+        contract_b = {
+            u'id': u'contract-b',
+            u'totalcost': u'500000',
+            u'fees': u'70000',
+            u'StorageSpending': u'5000',
+            u'uploadspending': u'100',
+            u'downloadspending': u'10',
+            u'renterfunds': u'2',
+            u'size': 77,
+        }
+        file_a = {
+            u'siapath': u'a.txt',
+            u'filesize': 900,
+            u'uploadedbytes': 50,
+            u'uploadprogress': 90,
+        }
+        file_b = {
+            u'siapath': u'b.txt',
+            u'filesize': 800,
+            u'uploadedbytes': 100,
+            u'uploadprogress': 100,
+        }
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'activecontracts': [contract_a],
+            u'inactivecontracts': [contract_b],
+        }
+        self.mock_sia_api.get_renter_files.return_value = {
+            u'files': [file_a, file_b],
+        }
+        self.mock_sia_api.get_wallet.return_value = {
+            u'message': u'dummy get_wallet error'
+        }
+        self.builder.build()
+
+        contract_a_updated = dict(contract_a)
+        contract_a_updated[u'uploadspending'] = u'900'
+        contract_a_updated[u'renterfunds'] = u'2'
+        file_a_updated = dict(file_a)
+        file_a_updated[u'uploadedbytes'] = 100
+        file_a_updated[u'uploadprogress'] = 100
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'activecontracts': [contract_a_updated],
+            u'inactivecontracts': [],
+        }
+        self.mock_sia_api.get_renter_files.return_value = {
+            u'files': [file_a_updated, file_b],
+        }
+
+        self.assertSiaStateEqual(
+            state.SiaState(
+                timestamp=_DUMMY_END_TIMESTAMP,
+                contract_count=1,
+                file_count=2,
+                total_file_bytes=1700.0,
+                total_contract_size=22L,
+                uploads_in_progress_count=0,
+                uploaded_bytes=200,
+                total_contract_spending=200000L,
+                contract_fee_spending=10000L,
+                upload_spending=900L,
+                download_spending=60L,
+                remaining_renter_funds=2L,
+                storage_spending=2000L,
+                api_latency=0.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0,
+                contracts_age=0.0,
+                files_age=0.0), self.builder.build())
+        self.assertEqual(
+            aggregate.Changes(added_count=0, removed_count=1, changed_count=1),
+            self.builder.contract_changes)
+        self.assertEqual(
+            aggregate.Changes(added_count=0, removed_count=0, changed_count=1),
+            self.builder.file_changes)
+
+    def test_reuses_metrics_of_groups_not_due_for_a_query(self):
+        self.times = [_DUMMY_START_TIMESTAMP]
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, intervals={
+                'files': 60
+            })
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'message': u'dummy get_renter_contracts error'
+        }
+        self.mock_sia_api.get_renter_files.return_value = {
+            u'files': [{
+                u'siapath': u'a.txt',
+                u'filesize': 900,
+                u'uploadedbytes': 50,
+                u'uploadprogress': 90,
+            }],
+        }
+        self.mock_sia_api.get_wallet.return_value = {
+            u'confirmedsiacoinbalance': u'900',
+            u'unconfirmedoutgoingsiacoins': u'35',
+            u'unconfirmedincomingsiacoins': u'92',
+        }
+        self.builder.build()
+
+        self.times = [_DUMMY_START_TIMESTAMP + datetime.timedelta(seconds=10)]
+        self.mock_sia_api.get_wallet.return_value = {
+            u'confirmedsiacoinbalance': u'800',
+            u'unconfirmedoutgoingsiacoins': u'35',
+            u'unconfirmedincomingsiacoins': u'92',
+        }
+        self.assertSiaStateEqual(
+            state.SiaState(
+                timestamp=self.times[0],
+                file_count=1,
+                total_file_bytes=810.0,
+                uploads_in_progress_count=1,
+                uploaded_bytes=50,
+                wallet_siacoin_balance=800L,
+                wallet_outgoing_siacoins=35L,
+                wallet_incoming_siacoins=92L,
+                api_latency=0.0,
+                contracts_api_latency=0.0,
+                wallet_api_latency=0.0,
+                files_age=10.0,
+                wallet_age=0.0), self.builder.build())
+        self.assertEqual(1, self.mock_sia_api.get_renter_files.call_count)
+        self.assertEqual(2, self.mock_sia_api.get_renter_contracts.call_count)
+
+        self.times = [_DUMMY_START_TIMESTAMP + datetime.timedelta(seconds=60)]
+        self.assertEqual(0.0, self.builder.build().files_age)
+        self.assertEqual(2, self.mock_sia_api.get_renter_files.call_count)
+
+    def test_passes_queried_contracts_to_listener(self):
+        listener = mock.Mock()
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, contract_listener=listener)
+        contract = {
+            u'id': u'a',
+            u'totalcost': u'200000',
+            u'fees': u'10000',
+            u'StorageSpending': u'2000',
+            u'uploadspending': u'800',
+            u'downloadspending': u'60',
+            u'renterfunds': u'3',
+            u'size': 22,
+        }
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'activecontracts': [contract],
+            u'inactivecontracts': [],
+        }
+        listener.side_effect = lambda timestamp, contracts: self.assertEqual(
+            (_DUMMY_END_TIMESTAMP, [contract]), (timestamp, list(contracts)))
+        self.builder.build()
+
+        self.assertEqual(1, listener.call_count)
+
+    def test_does_not_call_listener_when_contracts_query_fails(self):
+        listener = mock.Mock()
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, contract_listener=listener)
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'message': u'dummy get_renter_contracts error'
+        }
+        self.builder.build()
+
+        self.assertFalse(listener.called)
+
+    def test_reuses_metrics_of_unchanged_responses(self):
+        self.times = [_DUMMY_START_TIMESTAMP]
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, skip_unchanged=True)
+        responses = {
+            '/renter/contracts':
+            '{"message": "dummy error"}',
+            '/renter/files': ('{"files": [{"filesize": 900, '
+                              '"uploadedbytes": 50, "uploadprogress": 90}]}'),
+            '/wallet': ('{"confirmedsiacoinbalance": "900", '
+                        '"unconfirmedoutgoingsiacoins": "35", '
+                        '"unconfirmedincomingsiacoins": "92"}'),
+        }
+        self.mock_sia_api.get_raw.side_effect = lambda path: responses[path]
+        first_state = self.builder.build()
+        self.assertEqual(0, first_state.response_cache_hits)
+        self.assertEqual(3, first_state.response_cache_misses)
+
+        second_state = self.builder.build()
+        self.assertEqual(2, second_state.response_cache_hits)
+        self.assertEqual(1, second_state.response_cache_misses)
+        for s in (first_state, second_state):
+            s.response_cache_hits = None
+            s.response_cache_misses = None
+        self.assertSiaStateEqual(first_state, second_state)
+        self.assertEqual(1, second_state.file_count)
+        self.assertEqual(900L, second_state.wallet_siacoin_balance)
+
+    def test_recomputes_metrics_of_changed_responses(self):
+        self.times = [_DUMMY_START_TIMESTAMP]
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, skip_unchanged=True)
+        responses = {
+            '/renter/contracts':
+            '{"message": "dummy error"}',
+            '/renter/files':
+            '{"files": null}',
+            '/wallet': ('{"confirmedsiacoinbalance": "900", '
+                        '"unconfirmedoutgoingsiacoins": "35", '
+                        '"unconfirmedincomingsiacoins": "92"}'),
+        }
+        self.mock_sia_api.get_raw.side_effect = lambda path: responses[path]
+        self.builder.build()
+
+        responses['/wallet'] = ('{"confirmedsiacoinbalance": "800", '
+                                '"unconfirmedoutgoingsiacoins": "35", '
+                                '"unconfirmedincomingsiacoins": "92"}')
+        sia_state = self.builder.build()
+
+        self.assertEqual(800L, sia_state.wallet_siacoin_balance)
+        self.assertEqual(1, sia_state.response_cache_hits)
+        self.assertEqual(2, sia_state.response_cache_misses)
+        self.assertFalse(self.mock_sia_api.get_wallet.called)
+
+    def test_builds_partial_state_when_query_misses_deadline(self):
+        self.times = [_DUMMY_START_TIMESTAMP]
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, deadlines={
+                'wallet': 0.05
+            })
+        wallet_released = threading.Event()
+        self.addCleanup(wallet_released.set)
+
+        def hang_until_released():
+            wallet_released.wait()
+            return {
+                u'confirmedsiacoinbalance': u'900',
+                u'unconfirmedoutgoingsiacoins': u'35',
+                u'unconfirmedincomingsiacoins': u'92',
+            }
+
+        self.mock_sia_api.get_renter_contracts.return_value = {
+            u'message': u'dummy get_renter_contracts error'
+        }
+        self.mock_sia_api.get_renter_files.return_value = {u'files': None}
+        self.mock_sia_api.get_wallet.side_effect = hang_until_released
+
+        self.assertSiaStateEqual(
+            state.SiaState(
+                timestamp=_DUMMY_START_TIMESTAMP,
+                file_count=0,
+                total_file_bytes=0,
+                uploads_in_progress_count=0,
+                uploaded_bytes=0,
+                api_latency=0.0,
+                contracts_api_latency=0.0,
+                files_api_latency=0.0,
+                wallet_api_latency=0.0,
+                files_age=0.0,
+                contracts_status=state.STATUS_FAILED,
+                files_status=state.STATUS_OK,
+                wallet_status=state.STATUS_TIMED_OUT), self.builder.build())
+
+        # The wallet query is still running, so the next build doesn't start
+        # another.
+        self.assertEqual(state.STATUS_TIMED_OUT,
+                         self.builder.build().wallet_status)
+        self.assertEqual(1, self.mock_sia_api.get_wallet.call_count)
+
+        wallet_released.set()
+        self.builder._query_threads['wallet'].join()
+        sia_state = self.builder.build()
+        self.assertEqual(state.STATUS_OK, sia_state.wallet_status)
+        self.assertEqual(900L, sia_state.wallet_siacoin_balance)
+        self.assertEqual(2, self.mock_sia_api.get_wallet.call_count)
+
+    def test_drops_results_of_query_that_returns_late(self):
+        self.times = [_DUMMY_START_TIMESTAMP]
+        self.builder = state.Builder(
+            self.mock_sia_api,
+            self.mock_time_fn,
+            incremental=True,
+            deadlines={
+                'contracts': 0.05
+            })
+        contracts_released = threading.Event()
+        self.addCleanup(contracts_released.set)
+
+        def get_renter_contracts():
+            contracts_released.wait()
+            return {
+                u'activecontracts': [{
+                    u'id': u'contract-a',
+                    u'totalcost': u'200000',
+                    u'fees': u'10000',
+                    u'StorageSpending': u'2000',
+                    u'uploadspending': u'800',
+                    u'downloadspending': u'60',
+                    u'renterfunds': u'3',
+                    u'size': 22,
+                }],
+                u'inactivecontracts': [],
+            }
+
+        self.mock_sia_api.get_renter_contracts.side_effect = (
+            get_renter_contracts)
+        self.mock_sia_api.get_renter_files.return_value = {u'files': None}
+        self.mock_sia_api.get_wallet.return_value = {}
+        self.assertEqual(state.STATUS_TIMED_OUT,
+                         self.builder.build().contracts_status)
+
+        contracts_released.set()
+        self.builder._query_threads['contracts'].join()
+
+        self.assertIsNone(self.builder.contract_changes)
+        sia_state = self.builder.build()
+        self.assertEqual(1, sia_state.contract_count)
+        # The late query's contract wasn't kept, so it's new to this build.
+        self.assertEqual(
+            aggregate.Changes(added_count=1), self.builder.contract_changes)
+
+    def test_poll_budget_limits_wait_for_every_query(self):
+        self.times = [_DUMMY_START_TIMESTAMP]
+        self.builder = state.Builder(
+            self.mock_sia_api, self.mock_time_fn, poll_budget=0.05)
+        released = threading.Event()
+        self.addCleanup(released.set)
+        self.mock_sia_api.get_renter_contracts.side_effect = (
+            lambda: released.wait())
+        self.mock_sia_api.get_renter_files.side_effect = (
+            lambda: released.wait())
+        self.mock_sia_api.get_wallet.return_value = {
+            u'confirmedsiacoinbalance': u'900',
+            u'unconfirmedoutgoingsiacoins': u'35',
+            u'unconfirmedincomingsiacoins': u'92',
+        }
+
+        sia_state = self.builder.build()
+
+        self.assertEqual(state.STATUS_TIMED_OUT, sia_state.contracts_status)
+        self.assertEqual(state.STATUS_TIMED_OUT, sia_state.files_status)
+        self.assertEqual(state.STATUS_OK, sia_state.wallet_status)
+        self.assertIsNone(sia_state.contract_count)
+        self.assertEqual(900L, sia_state.wallet_siacoin_balance)
+
+    def test_measures_deadlines_with_time_fn(self):
+        # Each reading of the clock is an hour after the last, so the budget
+        # has run out by the time the build waits for any query.
+        hours = itertools.count()
+        self.builder = state.Builder(
+            self.mock_sia_api,
+            lambda: _DUMMY_START_TIMESTAMP + datetime.timedelta(
+                hours=next(hours)),
+            poll_budget=3600)
+        released = threading.Event()
+        self.addCleanup(released.set)
+        self.mock_sia_api.get_renter_contracts.side_effect = (
+            lambda: released.wait())
+        self.mock_sia_api.get_renter_files.return_value = {u'files': None}
+        self.mock_sia_api.get_wallet.return_value = {}
+
+        self.assertEqual(state.STATUS_TIMED_OUT,
+                         self.builder.build().contracts_status)
+
+    def test_rejects_deadline_for_unknown_metric_group(self):
+        with self.assertRaises(ValueError):
+            state.Builder(
+                self.mock_sia_api, self.mock_time_fn, deadlines={
+                    'dummy': 60
+                })
+
+    def test_rejects_interval_for_unknown_metric_group(self):
+        with self.assertRaises(ValueError):
+            state.Builder(
+                self.mock_sia_api, self.mock_time_fn, intervals={
+                    'dummy': 60
+                })
+
+
+class SiaStateTest(unittest.TestCase):
+
+    def test_state_has_no_per_instance_dict(self):
+        # SiaState stores its fields in slots, which keeps each state compact.
+        self.assertFalse(hasattr(state.SiaState(), '__dict__'))
@@ -0,0 +1,127 @@
+import threading
+import unittest
+
+import mock
+
+from sia_metrics_collector import writer
+from tests import helpers
+
+
+class SinkStub(object):
+
+    def __init__(self):
+        self.states = []
+        self.flush_count = 0
+
+    def write_state(self, s):
+        self.states.append(s)
+
+    def flush(self):
+        self.flush_count += 1
+
+
+class BlockingSinkStub(SinkStub):
+    """Holds up the writer thread on its first state until released."""
+
+    def __init__(self):
+        super(BlockingSinkStub, self).__init__()
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def write_state(self, s):
+        self.started.set()
+        self.released.wait()
+        super(BlockingSinkStub, self).write_state(s)
+
+
+class QueuedWriterTest(unittest.TestCase):
+
+    def test_writes_every_state_to_every_sink(self):
+        sinks = [SinkStub(), SinkStub()]
+        queued_writer = writer.QueuedWriter(sinks)
+        states = [helpers.make_state(minute) for minute in range(3)]
+        for s in states:
+            queued_writer.write_state(s)
+        queued_writer.close()
+
+        for sink in sinks:
+            self.assertEqual(states, sink.states)
+            self.assertEqual(1, sink.flush_count)
+
+    def test_flush_waits_for_queued_states(self):
+        sink = SinkStub()
+        queued_writer = writer.QueuedWriter([sink])
+        queued_writer.write_state(helpers.make_state(0))
+        queued_writer.flush()
+
+        self.assertEqual(1, len(sink.states))
+        self.assertEqual(1, sink.flush_count)
+        queued_writer.close()
+
+    def test_drops_oldest_state_when_queue_is_full(self):
+        sink = BlockingSinkStub()
+        queued_writer = writer.QueuedWriter(
+            [sink], max_queue_size=1, overflow_policy=writer.DROP_OLDEST)
+        states = [helpers.make_state(minute) for minute in range(3)]
+        queued_writer.write_state(states[0])
+        sink.started.wait()
+        queued_writer.write_state(states[1])
+        queued_writer.write_state(states[2])
+        sink.released.set()
+        queued_writer.close()
+
+        self.assertEqual([states[0], states[2]], sink.states)
+        self.assertEqual(1, queued_writer.dropped_count)
+        self.assertEqual(1, states[2].write_queue_depth)
+
+    def test_drops_newest_state_when_queue_is_full(self):
+        sink = BlockingSinkStub()
+        queued_writer = writer.QueuedWriter(
+            [sink], max_queue_size=1, overflow_policy=writer.DROP_NEWEST)
+        states = [helpers.make_state(minute) for minute in range(4)]
+        queued_writer.write_state(states[0])
+        sink.started.wait()
+        for s in states[1:]:
+            queued_writer.write_state(s)
+        sink.released.set()
+        queued_writer.close()
+
+        self.assertEqual([states[0], states[1]], sink.states)
+        self.assertEqual(2, queued_writer.dropped_count)
+        self.assertEqual(1, states[3].dropped_state_count)
+
+    @mock.patch.object(writer, '_PUT_TIMEOUT_SECONDS', 0.01)
+    def test_waits_for_room_when_queue_is_full(self):
+        sink = BlockingSinkStub()
+        queued_writer = writer.QueuedWriter(
+            [sink], max_queue_size=1, overflow_policy=writer.BLOCK)
+        states = [helpers.make_state(minute) for minute in range(3)]
+        queued_writer.write_state(states[0])
+        sink.started.wait()
+        queued_writer.write_state(states[1])
+        thread = threading.Thread(
+            target=queued_writer.write_state, args=(states[2],))
+        thread.start()
+        # Wait out several put timeouts before making room.
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        sink.released.set()
+        thread.join()
+        queued_writer.close()
+
+        self.assertEqual(states, sink.states)
+        self.assertEqual(0, queued_writer.dropped_count)
+
+    def test_keeps_writing_to_other_sinks_when_one_fails(self):
+        failing_sink = mock.Mock()
+        failing_sink.write_state.side_effect = IOError('dummy write error')
+        sink = SinkStub()
+        queued_writer = writer.QueuedWriter([failing_sink, sink])
+        queued_writer.write_state(helpers.make_state(0))
+        queued_writer.close()
+
+        self.assertEqual(1, len(sink.states))
+
+    def test_rejects_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            writer.QueuedWriter([], overflow_policy='dummy')